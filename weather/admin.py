@@ -1,3 +1,23 @@
 from django.contrib import admin
 
+from weather.models import JobRun, Location, Station
+
 # Register your models here.
+
+
+class StationInline(admin.TabularInline):
+    model = Station
+    extra = 1
+
+
+@admin.register(Location)
+class LocationAdmin(admin.ModelAdmin):
+    list_display = ('slug', 'name', 'station_name')
+    inlines = [StationInline]
+
+
+@admin.register(JobRun)
+class JobRunAdmin(admin.ModelAdmin):
+    list_display = ('name', 'started', 'status', 'duration', 'attempts')
+    list_filter = ('status', 'name')
+    readonly_fields = ('name', 'station_id', 'status', 'started', 'duration', 'attempts', 'error')
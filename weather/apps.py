@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class WeatherConfig(AppConfig):
     name = 'weather'
+
+    def ready(self):
+        from weather import instrumentation
+        instrumentation.configure(settings.WEATHER_METRICS_ENABLED)
@@ -0,0 +1,146 @@
+"""
+Benchmarks of the ingest -> stats -> plot pipeline on synthetic multi-decade, multi-station data.
+Run with `python manage.py benchmark`; the results are saved as JSON and can be compared between runs.
+"""
+from datetime import date, timedelta
+from pathlib import Path
+import json
+import platform
+import statistics
+import tempfile
+import time
+
+import pandas as pd
+from bokeh.embed import components
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from weather.model_manager import get_retriever, get_plot_df, set_current_weather, set_info, set_stats, \
+    update_weather_tables
+from weather.models import Info, Location, Station
+from weather.synthetic_data import fill_cache
+from weather.trend_plot_builder import TrendPlotBuilder
+from weather.weather_data import WeatherDataRetriever, WeatherStatsCreator
+
+
+def timed(func, repeat, setup=None):
+    """
+    Runs func repeat times and returns its timings in seconds
+    @param setup: optional function run before each call, outside the timing
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {'min': min(timings), 'median': statistics.median(timings), 'max': max(timings), 'runs': repeat}
+
+
+def create_locations(num_locations, years):
+    """
+    Replaces the registered locations with synthetic ones, each with an old and a current station
+    """
+    Location.objects.all().delete()
+    this_year = date.today().year
+    split_year = this_year - years // 3
+    for i in range(num_locations):
+        location = Location.objects.create(slug=f'bench{i}', name=f'Bench {i}', station_name=f'Bench station {i}')
+        Station.objects.create(location=location, station_id=1000 + 2 * i, start_yr=this_year - years + 1,
+                               end_yr=split_year)
+        Station.objects.create(location=location, station_id=1001 + 2 * i, start_yr=split_year, end_yr=None)
+    return list(Location.objects.all())
+
+
+def run_benchmarks(years=60, num_locations=3, repeat=3):
+    """
+    Runs the benchmarks in a test database, reading synthetic API data from a temporary disk cache (with a
+    temporary history store). Prerendering is disabled, so the views are timed.
+    @param years: years of history of each location
+    @param num_locations: number of locations
+    @param repeat: number of timed runs of each benchmark
+    @return: dict of benchmark name to timings
+    """
+    results = {}
+    setup_test_environment()
+    old_db_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as history_dir, \
+                override_settings(WEATHER_CACHE_DIR=cache_dir, WEATHER_CACHE_MAX_AGE=10 ** 9,
+                                  WEATHER_CACHE_MAX_BYTES=2 ** 40, WEATHER_HISTORY_DIR=history_dir,
+                                  WEATHER_PRERENDER_DIR=''):
+            locations = create_locations(num_locations, years)
+            fill_cache(get_retriever().cache, [station for location in locations
+                                               for station in location.station_years()])
+            location = locations[0]
+
+            # ingest and stats of one location
+            retriever = get_retriever()
+            station_years = [(station['station_id'], yr) for station in location.station_years()
+                             for yr in range(station['start_yr'], station['end_yr'] + 1)]
+            results['ingest.read_csv'] = timed(
+                lambda: [retriever._call_api(station, yr) for station, yr in station_years], repeat)
+            raw_df = pd.concat([retriever._call_api(station, yr) for station, yr in station_years])
+            results['ingest.clean_data'] = timed(lambda: WeatherDataRetriever._clean_data(raw_df.copy()), repeat)
+            clean_df = WeatherDataRetriever._clean_data(raw_df.copy())
+            results['ingest.add_month_day'] = timed(lambda: WeatherDataRetriever._add_month_day(clean_df.copy()),
+                                                    repeat)
+            weather_df = WeatherDataRetriever._add_month_day(clean_df)
+            results['stats.create_weather_stats'] = timed(
+                lambda: WeatherStatsCreator(weather_df).create_weather_stats(), repeat)
+
+            # database loads and updates of all locations
+            results['db.set_stats'] = timed(lambda: set_stats(from_api=True), repeat)
+            results['db.set_stats_from_history'] = timed(lambda: set_stats(from_api=False), repeat)
+            results['db.set_current_weather'] = timed(lambda: set_current_weather(from_api=True), repeat)
+            set_info()
+            results['db.update_weather_tables'] = timed(
+                update_weather_tables, repeat,
+                setup=lambda: Info.objects.update(last_update=date.today() - timedelta(days=1)))
+
+            # plot
+            results['plot.get_plot_df'] = timed(lambda: get_plot_df(True, location), repeat)
+            results['plot.trend_plot_builder'] = timed(
+                lambda: components(TrendPlotBuilder(location, smoothed=True).get_plot()), repeat)
+
+            # views, with the rendered plot cache cold and warm
+            client = Client()
+            url = f'/{location.slug}/'
+            data_url = f'/{location.slug}/plot-data.json'
+            results['view.homepage_miss'] = timed(lambda: client.get(url), repeat, setup=cache.clear)
+            results['view.homepage_hit'] = timed(lambda: client.get(url), repeat)
+            results['view.plot_data_miss'] = timed(lambda: client.get(data_url), repeat, setup=cache.clear)
+            results['view.plot_data_hit'] = timed(lambda: client.get(data_url), repeat)
+    finally:
+        connection.creation.destroy_test_db(old_db_name, verbosity=0)
+        teardown_test_environment()
+    return results
+
+
+def save_results(results, path, **meta):
+    """
+    Saves benchmark results as JSON, with the run parameters and environment
+    """
+    report = {'meta': dict(meta, date=date.today().isoformat(), python=platform.python_version(),
+                           machine=platform.machine()),
+              'results': results}
+    Path(path).write_text(json.dumps(report, indent=2, sort_keys=True))
+
+
+def compare_results(results, baseline_path, threshold):
+    """
+    Compares the median timings with a previously saved run
+    @param threshold: ratio of new to baseline median above which a benchmark counts as a regression
+    @return: list of (name, baseline median, new median, ratio), and the subset that regressed
+    """
+    baseline = json.loads(Path(baseline_path).read_text())['results']
+    comparison = []
+    for name, timings in sorted(results.items()):
+        if name in baseline:
+            old, new = baseline[name]['median'], timings['median']
+            comparison.append((name, old, new, new / old if old else float('inf')))
+    regressions = [row for row in comparison if row[3] > threshold]
+    return comparison, regressions
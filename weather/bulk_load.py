@@ -0,0 +1,62 @@
+"""
+Bulk loading of DataFrames into the database tables with batched multi-row upserts
+(INSERT ... ON CONFLICT DO UPDATE, on SQLite and PostgreSQL), without building a model instance per row.
+"""
+from django.db import NotSupportedError, connection
+from pandas.api.types import is_datetime64_any_dtype
+
+# operator testing whether two values differ, NULLs included
+DISTINCT_OPERATORS = {'sqlite': 'IS NOT', 'postgresql': 'IS DISTINCT FROM'}
+
+
+def db_values(field, column):
+    """
+    Returns the values of a DataFrame column prepared for the database column of a model field,
+    with None for NaN and NaT
+    """
+    if is_datetime64_any_dtype(column):
+        column = column.dt.date
+    values = column.astype(object).where(column.notna(), None)  # python scalars, not numpy ones
+    return [None if value is None else field.get_db_prep_save(value, connection) for value in values]
+
+
+def upsert_df(table, df, unique_fields, update_fields=None):
+    """
+    Writes the rows of a DataFrame to a table, inserting the new rows and updating the existing ones. Rows whose
+    values are unchanged are not rewritten.
+    @param table: model class of the table
+    @param df: DataFrame with a column per written field (attnames, e.g. location_id)
+    @param unique_fields: fields of a unique constraint of the table, identifying the existing rows
+    @param update_fields: fields updated in the existing rows (defaults to all the other columns)
+    @return: number of rows inserted or updated
+    """
+    if connection.vendor not in DISTINCT_OPERATORS:
+        raise NotSupportedError(f"Upserts are not supported on {connection.vendor}")
+    if df.empty:
+        return 0
+    meta = table._meta
+    fields = [meta.get_field(name) for name in df.columns]
+    if update_fields is None:
+        update_fields = [name for name in df.columns if name not in unique_fields]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+    conflict = ', '.join(quote(meta.get_field(name).column) for name in unique_fields)
+    updated = [quote(meta.get_field(name).column) for name in update_fields]
+    changed = ' OR '.join(f'{quote(meta.db_table)}.{column} {DISTINCT_OPERATORS[connection.vendor]} excluded.{column}'
+                          for column in updated)
+    on_conflict = f"DO UPDATE SET {', '.join(f'{column} = excluded.{column}' for column in updated)} WHERE {changed}" \
+        if updated else 'DO NOTHING'
+    row_placeholder = f"({', '.join(['%s'] * len(fields))})"
+
+    rows = list(zip(*[db_values(field, df[field.attname]) for field in fields]))
+    batch_size = connection.ops.bulk_batch_size(fields, rows)
+    written = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(f"INSERT INTO {quote(meta.db_table)} ({columns}) "
+                           f"VALUES {', '.join([row_placeholder] * len(batch))} "
+                           f"ON CONFLICT ({conflict}) {on_conflict}",
+                           [value for row in batch for value in row])
+            written += cursor.rowcount
+    return written
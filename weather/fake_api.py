@@ -0,0 +1,79 @@
+"""
+Local stand-in for the bulk data endpoint of the climate data API, serving synthetic daily and hourly CSVs with
+configurable latency and failures. Used for load tests: set WEATHER_API_URL to the url of the server.
+"""
+from datetime import date
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import random
+import time
+
+from weather.raw_data_cache import RawDataCache
+from weather.synthetic_data import synthetic_daily_csv, synthetic_hourly_csv
+
+API_PATH = '/climate_data/bulk_data_e.html'
+
+
+@lru_cache(maxsize=1024)
+def _synthetic_daily_csv(station, year, today):
+    """
+    Returns the synthetic daily CSV of a station-year, cached per day as its days from today on are blank
+    """
+    return synthetic_daily_csv(station, year)
+
+
+class FakeClimateAPIHandler(BaseHTTPRequestHandler):
+    latency = 0.0  # mean seconds before responding, uniformly jittered by +/-50%
+    failure_rate = 0.0  # fraction of requests answered with a 503
+    verbose = False
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if self.latency:
+            time.sleep(self.latency * (0.5 + random.random()))
+        if url.path != API_PATH:
+            self.send_error(404)
+        elif random.random() < self.failure_rate:
+            self.send_error(503, "Simulated failure")
+        elif query.get('timeframe') not in (str(RawDataCache.DAILY), str(RawDataCache.HOURLY)) or \
+                'stationID' not in query or 'Year' not in query or 'Month' not in query:
+            self.send_error(400, "Only daily (timeframe=2) and hourly (timeframe=1) data by stationID, Year and "
+                                 "Month is served")
+        else:
+            if query['timeframe'] == str(RawDataCache.DAILY):
+                body = _synthetic_daily_csv(int(query['stationID']), int(query['Year']), date.today())
+            else:
+                body = synthetic_hourly_csv(int(query['stationID']), int(query['Year']), int(query['Month']))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def make_fake_api_server(host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, verbose=False):
+    """
+    Returns a threaded HTTP server for the fake API, to be run with serve_forever()
+    @param port: port to listen on (0 for any free port, see server.server_address)
+    @param latency: mean seconds before responding
+    @param failure_rate: fraction of requests failed with a 503
+    """
+    handler = type('ConfiguredFakeClimateAPIHandler', (FakeClimateAPIHandler,),
+                   {'latency': latency, 'failure_rate': failure_rate, 'verbose': verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def fake_api_url(server):
+    """
+    Returns the WEATHER_API_URL of a running fake API server
+    """
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}{API_PATH}'
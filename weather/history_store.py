@@ -0,0 +1,137 @@
+from pathlib import Path
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class HistoryStore:
+    """
+    Local columnar store of the cleaned daily history (date, min_temp and max_temp), partitioned by station and
+    year: each partition is a directory with one raw binary file per column, read back memory-mapped.
+    Partitions are append-only: fetched rows are appended when their date is new or their temperatures differ
+    from the stored ones (corrections, backfills, or blanked days), and the last row stored for a date wins
+    when reading. A partition exists once its station-year was fetched, even if it had no data.
+    """
+    COLUMNS = {'date': np.dtype('<M8[D]'), 'min_temp': np.dtype('<f4'), 'max_temp': np.dtype('<f4')}
+
+    def __init__(self, directory):
+        """
+        @param directory: directory holding the partitions (created if missing)
+        """
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, station, year):
+        """
+        Returns the directory of a station-year partition
+        """
+        return self.directory / str(station) / str(year)
+
+    def _columns(self, station, year):
+        """
+        Returns the raw (unordered, possibly repeated dates) columns of a partition as memory-mapped arrays,
+        or None if the partition is missing. Rows of an interrupted append are ignored.
+        """
+        path = self.path(station, year)
+        if not path.is_dir():
+            return None
+        sizes = {col: (path / col).stat().st_size // dtype.itemsize for col, dtype in self.COLUMNS.items()}
+        rows = min(sizes.values())
+        if rows == 0:
+            return {col: np.empty(0, dtype) for col, dtype in self.COLUMNS.items()}
+        return {col: np.memmap(path / col, dtype=dtype, mode='r', shape=(rows,))
+                for col, dtype in self.COLUMNS.items()}
+
+    def read(self, station, year, drop_blanks=True):
+        """
+        Returns the stored history of a station-year as a DataFrame of temperatures indexed by date,
+        or None if the partition is missing
+        @param drop_blanks: whether to drop the days with a blank temperature
+        """
+        columns = self._columns(station, year)
+        if columns is None:
+            return None
+        dates = columns['date']
+        # the last row of each date wins: take the first occurrence of each date in the reversed rows
+        _, first = np.unique(dates[::-1], return_index=True)
+        rows = len(dates) - 1 - first
+        weather_df = pd.DataFrame({'min_temp': columns['min_temp'][rows], 'max_temp': columns['max_temp'][rows]},
+                                  index=pd.DatetimeIndex(dates[rows], name='date'))
+        if drop_blanks:
+            weather_df = weather_df.dropna()
+        return weather_df
+
+    def read_stations(self, stations):
+        """
+        Returns the stored history of the stations' years as one DataFrame sorted by date
+        @param stations: station dicts with station_id, start_yr and end_yr
+        @return: the DataFrame, and the list of (station_id, year) partitions missing from the store
+        """
+        frames, missing = [], []
+        for station in stations:
+            for year in range(station['start_yr'], station['end_yr'] + 1):
+                weather_df = self.read(station['station_id'], year)
+                if weather_df is None:
+                    missing.append((station['station_id'], year))
+                else:
+                    frames.append(weather_df)
+        weather_df = pd.concat(frames) if frames else self._empty()
+        return weather_df.sort_index(), missing
+
+    @staticmethod
+    def _empty():
+        return pd.DataFrame({'min_temp': np.empty(0, 'f4'), 'max_temp': np.empty(0, 'f4')},
+                            index=pd.DatetimeIndex([], name='date'))
+
+    def append(self, station, year, weather_df):
+        """
+        Appends the rows of a fetched station-year that are not already stored, creating the partition if missing
+        @param weather_df: cleaned DataFrame with columns min_temp and max_temp, indexed by date
+        @return: number of rows appended
+        """
+        dates = pd.DatetimeIndex(weather_df.index).to_numpy(dtype='datetime64[D]')
+        temps = {col: weather_df[col].to_numpy(dtype='f4') for col in ['min_temp', 'max_temp']}
+        blank = np.isnan(temps['min_temp']) | np.isnan(temps['max_temp'])
+        with self._lock:
+            stored = self.read(station, year, drop_blanks=False)
+            if stored is None:
+                self._create(station, year)
+                stored = self._empty()
+            # stored temperatures aligned on the fetched dates (blank for dates not stored)
+            stored = stored.reindex(pd.DatetimeIndex(dates))
+            stored_blank = stored.isna().any(axis=1).to_numpy()
+            new = (blank != stored_blank) | (~blank & (
+                (stored['min_temp'].to_numpy() != temps['min_temp']) |
+                (stored['max_temp'].to_numpy() != temps['max_temp'])))
+            if new.any():
+                self._append_rows(station, year, {'date': dates[new], 'min_temp': temps['min_temp'][new],
+                                                  'max_temp': temps['max_temp'][new]})
+        return int(new.sum())
+
+    def _create(self, station, year):
+        """
+        Creates an empty partition, moved into place complete so readers never see it without its column files
+        """
+        path = self.path(station, year)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(tempfile.mkdtemp(dir=path.parent, suffix='.tmp'))
+        for col in self.COLUMNS:
+            (tmp_path / col).touch()
+        try:
+            os.rename(tmp_path, path)
+        except OSError:  # created by another process meanwhile
+            shutil.rmtree(tmp_path)
+
+    def _append_rows(self, station, year, columns):
+        path = self.path(station, year)
+        rows = min((path / col).stat().st_size // dtype.itemsize for col, dtype in self.COLUMNS.items())
+        for col, dtype in self.COLUMNS.items():
+            with open(path / col, 'r+b') as f:
+                f.truncate(rows * dtype.itemsize)  # drop the rows of an interrupted append
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(columns[col], dtype=dtype).tobytes())
@@ -0,0 +1,204 @@
+"""
+Lightweight stage timings and in-process metrics, exported as a Server-Timing header and in the Prometheus
+text format. Disabled by default (WEATHER_METRICS_ENABLED): stage() then returns a shared no-op context manager
+and the metric updates return after a single flag check.
+The metrics are kept per process, so with several workers each one is scraped separately.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import nullcontext
+from contextvars import ContextVar
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_enabled = False
+_NO_STAGE = nullcontext()
+# stage timings of the current request, as a list of (name, seconds); None outside of an instrumented request
+_request_timings = ContextVar('weather_request_timings', default=None)
+
+
+def configure(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled():
+    return _enabled
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    """
+    A metric family with values per combination of label values
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _labels(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _format_labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{name}{labels} {value:g}' for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = defaultdict(float)
+        if not self.labelnames:
+            self._values[()]  # exported as 0 before the first increment
+
+    def inc(self, amount=1, **labels):
+        if not _enabled:
+            return
+        key = self._labels(labels)
+        with self._lock:
+            self._values[key] += amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, self._format_labels(key), value) for key, value in values]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # per label values: count of each bucket (non-cumulative, the last one is +Inf), and the sum
+        self._values = defaultdict(lambda: [[0] * (len(self.buckets) + 1), 0.0])
+        if not self.labelnames:
+            self._values[()]
+
+    def observe(self, value, **labels):
+        if not _enabled:
+            return
+        key = self._labels(labels)
+        with self._lock:
+            counts, _ = entry = self._values[key]
+            counts[bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        samples = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                samples.append((f'{self.name}_bucket', self._format_labels(key, [('le', le)]), cumulative))
+            samples.append((f'{self.name}_sum', self._format_labels(key), total))
+            samples.append((f'{self.name}_count', self._format_labels(key), cumulative))
+        return samples
+
+
+REGISTRY = []
+
+REQUEST_SECONDS = Histogram('weather_request_seconds', "Latency of the weather views.", ['view'])
+STAGE_SECONDS = Histogram('weather_stage_seconds', "Duration of the stages of the ingest, stats and plot "
+                                                   "pipeline.", ['stage'])
+REFRESHES = Counter('weather_refreshes_total', "Refreshes of the weather tables by outcome.", ['outcome'])
+REFRESH_SECONDS = Histogram('weather_refresh_seconds', "Duration of the refreshes of the weather tables.",
+                            buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+UPSTREAM_BYTES = Counter('weather_upstream_bytes_total', "Bytes downloaded from the climate data API.")
+UPSTREAM_ERRORS = Counter('weather_upstream_errors_total', "Failed downloads from the climate data API "
+                                                           "(including the ones retried).")
+CACHE_REQUESTS = Counter('weather_cache_requests_total', "Lookups in the weather caches by result; the hit "
+                                                         "ratio is hits / (hits + misses).", ['cache', 'result'])
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(duration, stage=self.name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((self.name, duration))
+
+
+def stage(name):
+    """
+    Returns a context manager timing a pipeline stage, for the stage histogram and the Server-Timing header
+    of the current request
+    @param name: stage name (a Server-Timing metric name, so no spaces)
+    """
+    return _Stage(name) if _enabled else _NO_STAGE
+
+
+def cache_lookup(cache, hit):
+    """
+    Counts a lookup in one of the weather caches
+    """
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def start_request():
+    """
+    Starts collecting the stage timings of a request
+    @return: token for finish_request
+    """
+    return _request_timings.set([])
+
+
+def finish_request(token):
+    """
+    Stops collecting the stage timings of a request
+    @return: list of (stage name, seconds)
+    """
+    timings = _request_timings.get()
+    _request_timings.reset(token)
+    return timings
+
+
+def server_timing(timings, total=None):
+    """
+    Returns a Server-Timing header value for the stage timings (durations in milliseconds)
+    """
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def render_metrics():
+    """
+    Returns all metrics in the Prometheus text exposition format
+    """
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
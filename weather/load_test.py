@@ -0,0 +1,144 @@
+"""
+Load test driver: requests a view at a target concurrency across a simulated day rollover and reports the latency
+percentiles and throughput. Run with `python manage.py loadtest`.
+"""
+from contextlib import contextmanager
+from datetime import date, timedelta
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from weather.fake_api import fake_api_url, make_fake_api_server
+from weather.model_manager import initialize_db
+from weather.models import Info
+
+REQUEST_TIMEOUT = 60  # seconds
+
+
+@contextmanager
+def local_environment(latency=0.2, failure_rate=0.0):
+    """
+    Runs the app in process against a throwaway test database, filled from a fake climate API served in a thread
+    with the given latency and failure rate (see weather.fake_api). The download cache is disabled, and the
+    history store and prerendered pages are temporary, so no real data is touched.
+    """
+    server = make_fake_api_server(latency=latency, failure_rate=failure_rate)
+    threading.Thread(target=server.serve_forever, name='fake-climate-api', daemon=True).start()
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if connection.vendor == 'sqlite':  # a file, as in-memory test databases don't suit concurrent threads
+            connection.settings_dict['TEST']['NAME'] = f'{tmp_dir}/loadtest.sqlite3'
+        old_db_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(WEATHER_API_URL=fake_api_url(server), WEATHER_CACHE_DIR='',
+                                   WEATHER_HISTORY_DIR=f'{tmp_dir}/history',
+                                   WEATHER_PRERENDER_DIR=f'{tmp_dir}/prerendered'):
+                cache.clear()
+                initialize_db()
+                yield
+        finally:
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+            teardown_test_environment()
+            server.shutdown()
+            server.server_close()
+
+
+def _requester(url, path):
+    """
+    Returns a function sending one request and returning its status code, for use by a single thread
+    @param url: base url of a running server, or None to call the WSGI app in process
+    """
+    if url is None:
+        client = Client(raise_request_exception=False)
+        return lambda: client.get(path).status_code
+
+    def request():
+        try:
+            with urlopen(url.rstrip('/') + path, timeout=REQUEST_TIMEOUT) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            return e.code
+    return request
+
+
+def _simulate_rollover(rollover_at, deadline, result):
+    """
+    At rollover_at, marks the weather tables as last updated yesterday, as on the first request of a new day,
+    then waits for the daily refresh to bring them up to date
+    """
+    time.sleep(max(0.0, rollover_at - time.perf_counter()))
+    try:
+        Info.objects.filter(pk=1).update(last_update=date.today() - timedelta(days=1), refresh_started=None)
+        while time.perf_counter() < deadline:
+            if Info.objects.get(pk=1).last_update == date.today():
+                result['refresh_seconds'] = time.perf_counter() - rollover_at
+                break
+            time.sleep(0.1)
+    finally:
+        connection.close()
+
+
+def run_load_test(url=None, path='/', concurrency=16, duration=30.0, rollover_at=None):
+    """
+    Requests path from concurrency clients, each sending its next request as soon as the previous one completes,
+    for duration seconds
+    @param url: base url of a running server (sharing this project's database), or None to call the WSGI app
+    in process
+    @param rollover_at: seconds into the run at which the day rolls over (None for no rollover)
+    @return: summaries of the whole run and, with a rollover, of the requests sent before and after it,
+    and the seconds the refresh took to complete after the rollover (None if it did not complete in time)
+    """
+    start = time.perf_counter()
+    deadline = start + duration
+    samples = []  # (start offset, seconds, status) of each request, appended by all threads
+    result = {'refresh_seconds': None}
+
+    def client():
+        request = _requester(url, path)
+        try:
+            while time.perf_counter() < deadline:
+                sent = time.perf_counter()
+                try:
+                    status = request()
+                except OSError:  # connection errors and timeouts
+                    status = None
+                samples.append((sent - start, time.perf_counter() - sent, status))
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=client, name=f'load-client-{i}') for i in range(concurrency)]
+    if rollover_at is not None:
+        threads.append(threading.Thread(target=_simulate_rollover, args=(start + rollover_at, deadline, result)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result['all'] = summarize(samples, elapsed)
+    if rollover_at is not None:
+        result['before_rollover'] = summarize([s for s in samples if s[0] < rollover_at], rollover_at)
+        result['after_rollover'] = summarize([s for s in samples if s[0] >= rollover_at], elapsed - rollover_at)
+    return result
+
+
+def summarize(samples, seconds):
+    """
+    Returns the request count, error count, throughput (requests per second) and latency percentiles
+    (milliseconds) of (start offset, seconds, status) samples spread over seconds
+    """
+    latencies = np.array([latency for _, latency, _ in samples]) * 1000
+    errors = sum(1 for _, _, status in samples if status is None or status >= 500)
+    summary = {'requests': len(samples), 'errors': errors, 'throughput': len(samples) / seconds if seconds else 0.0}
+    for name, q in [('p50', 50), ('p95', 95), ('p99', 99), ('max', 100)]:
+        summary[name] = float(np.percentile(latencies, q)) if len(latencies) else None
+    return summary
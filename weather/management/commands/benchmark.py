@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from weather.benchmarks import compare_results, run_benchmarks, save_results
+
+
+class Command(BaseCommand):
+    help = "Times the ingest -> stats -> plot pipeline on synthetic data and saves the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=60, help="years of history of each location")
+        parser.add_argument('--locations', type=int, default=3, help="number of locations")
+        parser.add_argument('--repeat', type=int, default=3, help="timed runs of each benchmark")
+        parser.add_argument('--output', default='bench_results.json', help="JSON file the results are saved to")
+        parser.add_argument('--compare', metavar='BASELINE', help="JSON results of a previous run to compare with")
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help="slowdown ratio of the median counted as a regression")
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(years=options['years'], num_locations=options['locations'],
+                                 repeat=options['repeat'])
+        save_results(results, options['output'], years=options['years'], locations=options['locations'],
+                     repeat=options['repeat'])
+        for name, timings in sorted(results.items()):
+            self.stdout.write(f"{name:32} median {timings['median'] * 1000:10.1f} ms   "
+                              f"min {timings['min'] * 1000:10.1f} ms")
+        self.stdout.write(f"Results saved to {options['output']}")
+        if options['compare']:
+            comparison, regressions = compare_results(results, options['compare'], options['threshold'])
+            for name, old, new, ratio in comparison:
+                self.stdout.write(f"{name:32} {old * 1000:10.1f} -> {new * 1000:10.1f} ms  x{ratio:.2f}")
+            if regressions:
+                raise CommandError(f"Regressions beyond x{options['threshold']}: "
+                                   f"{', '.join(name for name, *_ in regressions)}")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from weather.fake_api import fake_api_url, make_fake_api_server
+
+
+class Command(BaseCommand):
+    help = "Serves synthetic daily CSVs in place of the climate data API, with configurable latency and failures"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.2, help="mean seconds before responding")
+        parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of requests failed with a 503")
+        parser.add_argument('--log-requests', action='store_true')
+
+    def handle(self, *args, **options):
+        server = make_fake_api_server(options['host'], options['port'], latency=options['latency'],
+                                      failure_rate=options['failure_rate'], verbose=options['log_requests'])
+        self.stdout.write(f"Fake climate API running, set WEATHER_API_URL={fake_api_url(server)}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
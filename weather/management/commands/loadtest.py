@@ -0,0 +1,49 @@
+import json
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand
+
+from weather.load_test import local_environment, run_load_test
+
+
+class Command(BaseCommand):
+    help = "Load tests a view across a simulated day rollover and reports latency percentiles and throughput. " \
+           "By default the app runs in process on a test database fed by a fake climate API."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="base url of a running server sharing this project's database "
+                                          "(its WEATHER_API_URL should point at `manage.py fake_climate_api`)")
+        parser.add_argument('--path', default='/', help="path requested (default: the homepage)")
+        parser.add_argument('--concurrency', type=int, default=16, help="number of concurrent clients")
+        parser.add_argument('--duration', type=float, default=30.0, help="seconds the load is applied for")
+        parser.add_argument('--rollover-at', type=float,
+                            help="seconds into the run at which the day rolls over (default: a third of the run)")
+        parser.add_argument('--no-rollover', action='store_true')
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help="mean latency of the in-process fake climate API, in seconds")
+        parser.add_argument('--failure-rate', type=float, default=0.0,
+                            help="fraction of in-process fake climate API requests failed with a 503")
+        parser.add_argument('--output', help="JSON file the results are saved to")
+
+    def handle(self, *args, **options):
+        rollover_at = None if options['no_rollover'] else \
+            options['rollover_at'] if options['rollover_at'] is not None else options['duration'] / 3
+        environment = nullcontext() if options['url'] else \
+            local_environment(latency=options['latency'], failure_rate=options['failure_rate'])
+        with environment:
+            result = run_load_test(url=options['url'], path=options['path'], concurrency=options['concurrency'],
+                                   duration=options['duration'], rollover_at=rollover_at)
+        for phase in ['all', 'before_rollover', 'after_rollover']:
+            if phase in result:
+                s = result[phase]
+                percentiles = '  '.join(f"{name} {s[name]:8.1f} ms" if s[name] is not None else f"{name} -"
+                                        for name in ['p50', 'p95', 'p99', 'max'])
+                self.stdout.write(f"{phase:16} {s['requests']:7d} requests {s['errors']:5d} errors "
+                                  f"{s['throughput']:8.1f} req/s  {percentiles}")
+        if rollover_at is not None:
+            refresh = result['refresh_seconds']
+            self.stdout.write("refresh after rollover: " +
+                              (f"{refresh:.1f} s" if refresh is not None else "not completed before the end"))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(result, f, indent=2)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from weather.prerender import prerender
+
+
+class Command(BaseCommand):
+    help = "Renders the homepage and plot data of every location to static files served by WhiteNoise"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help="directory of the renders (default: WEATHER_PRERENDER_DIR)")
+
+    def handle(self, *args, **options):
+        manifest = prerender(options['directory'])
+        self.stdout.write(f"Published {manifest['renders'][-1]} (tables of {manifest['last_update']}, "
+                          f"version {manifest['data_version']})")
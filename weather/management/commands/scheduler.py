@@ -1,5 +1,7 @@
 from apscheduler.schedulers.blocking import BlockingScheduler
-from weather.model_manager import set_stats, update_weather_tables
+from django.conf import settings
+from weather.model_manager import set_stats
+from weather.pipeline import run_pipeline, run_today_refresh
 from django.core.management.base import BaseCommand
 import logging
 
@@ -11,13 +13,19 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
 
     def handle(self, *args, **options):
-        # for background tasks
-        scheduler = BlockingScheduler()
+        # for background tasks. Missed runs are coalesced into one, and a run never starts while the
+        # previous one is still going (runs of other processes are excluded by the refresh lease).
+        scheduler = BlockingScheduler(timezone='UTC', job_defaults={'coalesce': True, 'max_instances': 1,
+                                                                    'misfire_grace_time': 3600})
 
         # Run only once to initialize stats
         # scheduler.add_job(set_stats, 'cron', year=2020, month=11, day=4, hour=23, timezone='UTC')
 
-        # Run this once per day to speed up responses
-        scheduler.add_job(update_weather_tables, 'cron', hour=10, timezone='UTC')
+        # Refresh the tables once per day to speed up responses, retried hourly until it succeeds
+        scheduler.add_job(run_pipeline, 'cron', hour=settings.WEATHER_REFRESH_HOURS, minute=0, id='refresh')
+
+        # Hourly ingest mode: refresh the so far today values every hour
+        if settings.WEATHER_HOURLY_INGEST:
+            scheduler.add_job(run_today_refresh, 'cron', minute=30, id='today')
 
         scheduler.start()
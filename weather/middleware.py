@@ -0,0 +1,202 @@
+from pathlib import Path
+import asyncio
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from weather import instrumentation
+from weather.prerender import IMMUTABLE_FILE, MANIFEST, prerender_in_background, read_manifest
+from weather.refresh import refresh_in_background
+from weather.views import in_thread
+
+logger = logging.getLogger(__name__)
+
+
+@sync_and_async_middleware
+def static_files_middleware(get_response):
+    """
+    Serves the static files with WhiteNoise, as whitenoise.middleware.WhiteNoiseMiddleware does, but async-capable:
+    that middleware is sync-only, so under ASGI Django runs it, and every request it passes on to the async views,
+    in asgiref's single thread for sync code, one request at a time.
+    """
+    whitenoise = WhiteNoiseMiddleware()
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            response = whitenoise.process_request(request)  # a lookup in its files, opened only when found
+            if response is None:
+                response = await get_response(request)
+            return response
+    else:
+        def middleware(request):
+            response = whitenoise.process_request(request)
+            if response is None:
+                response = get_response(request)
+            return response
+    return middleware
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """
+    Adds the stage timings of each request as a Server-Timing header, and records the request latency.
+    Passes requests straight through when the metrics are disabled.
+    """
+    def record(request, response, start, token):
+        total = time.perf_counter() - start
+        timings = instrumentation.finish_request(token)
+        match = request.resolver_match
+        instrumentation.REQUEST_SECONDS.observe(total, view=match.url_name if match else 'unresolved')
+        response['Server-Timing'] = instrumentation.server_timing(timings, total)
+        return response
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not instrumentation.is_enabled():
+                return await get_response(request)
+            token, start = instrumentation.start_request(), time.perf_counter()
+            response = await get_response(request)
+            return record(request, response, start, token)
+    else:
+        def middleware(request):
+            if not instrumentation.is_enabled():
+                return get_response(request)
+            token, start = instrumentation.start_request(), time.perf_counter()
+            response = get_response(request)
+            return record(request, response, start, token)
+    return middleware
+
+
+class PrerenderedFiles:
+    """
+    The files of the renders published by `manage.py prerender` (see weather.prerender), and whether they are up to
+    date with the weather tables. The manifest is checked on every request (one stat), and the render against the
+    weather tables every WEATHER_PRERENDER_CHECK seconds, which also starts their daily refresh and a new render
+    when they changed.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.manifest = None
+        self.manifest_mtime = None
+        self.files = {}  # url -> whitenoise StaticFile of the published renders
+        self.up_to_date = False
+        self.checked = 0.0
+        self._lock = threading.Lock()  # held to swap the files and claim a check, never across file or db work
+
+    def find(self, url):
+        """
+        Returns the published file of a url, or None if there is none or it is a page of a render not up to date.
+        The content-hashed plot data files never change, so they are served whether their render is up to date or
+        not: pages cached by browsers still load them while a new render is pending, or if it fails.
+        """
+        if self.up_to_date or IMMUTABLE_FILE.search(url):
+            return self.files.get(url)
+        return None
+
+    def needs_update(self):
+        """
+        Returns whether the manifest changed or a check is due, so update() must run before find()
+        """
+        return self._manifest_mtime() != self.manifest_mtime or \
+            time.monotonic() - self.checked > settings.WEATHER_PRERENDER_CHECK
+
+    def update(self):
+        """
+        Loads the published renders if the manifest changed, and checks them against the weather tables if due.
+        Runs the file and database work without holding the lock, so only the request doing it waits for it.
+        """
+        mtime = self._manifest_mtime()
+        if mtime != self.manifest_mtime:
+            manifest, files = self.load()
+            with self._lock:
+                self.manifest_mtime, self.manifest, self.files = mtime, manifest, files
+                self.checked = 0.0
+        with self._lock:
+            if time.monotonic() - self.checked <= settings.WEATHER_PRERENDER_CHECK:
+                return  # checked meanwhile, or by another request now
+            self.checked = time.monotonic()
+        self.check()
+
+    def _manifest_mtime(self):
+        try:
+            return (self.directory / MANIFEST).stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """
+        Returns the manifest and the files of the published renders: those of the current render, and the plot data
+        of the renders before it, still loaded by pages cached by browsers
+        """
+        manifest, files = read_manifest(self.directory), {}
+        if manifest is None or not (self.directory / manifest['renders'][-1]).is_dir():
+            return None, files
+        for render in manifest['renders']:
+            render_files = WhiteNoise(None, max_age=getattr(settings, 'WHITENOISE_MAX_AGE', 60), index_file=True,
+                                      immutable_file_test=IMMUTABLE_FILE.pattern)
+            if (self.directory / render).is_dir():
+                render_files.add_files(str(self.directory / render))
+            current = render == manifest['renders'][-1]
+            files.update({url: static_file for url, static_file in render_files.files.items()
+                          if current or IMMUTABLE_FILE.search(url)})
+        return manifest, files
+
+    def check(self):
+        """
+        Checks that the render is up to date with the weather tables, starting their refresh if they are stale and
+        a new render if they changed or were never rendered
+        """
+        manifest = self.manifest
+        try:
+            info = refresh_in_background()
+        except Exception:
+            logger.exception("Checking the prerendered pages failed, serving the dynamic views")
+            self.up_to_date = False
+            return
+        self.up_to_date = manifest is not None and (info.last_update.isoformat(), info.data_version) == \
+            (manifest['last_update'], manifest['data_version'])
+        if not self.up_to_date:
+            prerender_in_background()
+
+
+@sync_and_async_middleware
+def prerender_middleware(get_response):
+    """
+    Serves the published renders (see PrerenderedFiles) with WhiteNoise, their pages while they are up to date with
+    the weather tables. Requests with a query string, and the requests of pages while a new render is pending, go on
+    to the dynamic views.
+    Under ASGI, the updates of the files run in a worker thread, and the lookups in the event loop.
+    """
+    if not settings.WEATHER_PRERENDER_DIR:
+        raise MiddlewareNotUsed
+    prerendered = PrerenderedFiles(settings.WEATHER_PRERENDER_DIR)
+
+    def servable(request):
+        return request.method in ('GET', 'HEAD') and not request.META.get('QUERY_STRING')
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            if servable(request):
+                if prerendered.needs_update():
+                    await in_thread(prerendered.update)()
+                static_file = prerendered.find(request.path_info)
+                if static_file is not None:
+                    return WhiteNoiseMiddleware.serve(static_file, request)
+            return await get_response(request)
+    else:
+        def middleware(request):
+            if servable(request):
+                if prerendered.needs_update():
+                    prerendered.update()
+                static_file = prerendered.find(request.path_info)
+                if static_file is not None:
+                    return WhiteNoiseMiddleware.serve(static_file, request)
+            return get_response(request)
+    return middleware
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='info',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-18 09:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0002_info_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='info',
+            name='refresh_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,108 @@
+# Stats and current weather become per location. Their primary keys change, so the tables are recreated with the
+# location key, under a temporary name until the existing rows are copied to them as the rows of Calgary, the only
+# location until then.
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_yyc(apps, schema_editor):
+    Location = apps.get_model('weather', 'Location')
+    Station = apps.get_model('weather', 'Station')
+    yyc = Location.objects.create(slug='yyc', name='Calgary, AB', station_name='YYC Calgary International Airport')
+    Station.objects.create(location=yyc, station_id=2205, start_yr=1881, end_yr=2012)
+    Station.objects.create(location=yyc, station_id=50430, start_yr=2012, end_yr=None)
+
+
+def copy_to_yyc(apps, schema_editor):
+    yyc = apps.get_model('weather', 'Location').objects.get(slug='yyc')
+    for old_name, new_name in [('CurrentWx', 'LocationCurrentWx'), ('WxStats', 'LocationWxStats')]:
+        old_model, new_model = apps.get_model('weather', old_name), apps.get_model('weather', new_name)
+        rows = old_model.objects.values(*[field.name for field in old_model._meta.fields]).iterator()
+        new_model.objects.bulk_create([new_model(location=yyc, **row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0003_info_refresh_started'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(max_length=30, unique=True)),
+                ('name', models.CharField(max_length=100)),
+                ('station_name', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Station',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('station_id', models.IntegerField()),
+                ('start_yr', models.IntegerField()),
+                ('end_yr', models.IntegerField(blank=True, null=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stations',
+                                               to='weather.location')),
+            ],
+            options={
+                'ordering': ['start_yr'],
+            },
+        ),
+        migrations.RunPython(create_yyc, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='LocationCurrentWx',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('month_day', models.CharField(max_length=5)),
+                ('min_temp', models.FloatField(blank=True, null=True)),
+                ('max_temp', models.FloatField(blank=True, null=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='weather.location')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LocationWxStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month_day', models.CharField(max_length=5)),
+                ('last_date', models.DateField()),
+                ('stats_count', models.IntegerField()),
+                ('record_min_temp', models.FloatField()),
+                ('avg_min_temp', models.FloatField()),
+                ('avg_max_temp', models.FloatField()),
+                ('record_max_temp', models.FloatField()),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='weather.location')),
+            ],
+        ),
+        migrations.RunPython(copy_to_yyc, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='CurrentWx',
+        ),
+        migrations.DeleteModel(
+            name='WxStats',
+        ),
+        migrations.RenameModel(
+            old_name='LocationCurrentWx',
+            new_name='CurrentWx',
+        ),
+        migrations.RenameModel(
+            old_name='LocationWxStats',
+            new_name='WxStats',
+        ),
+        migrations.AddConstraint(
+            model_name='wxstats',
+            constraint=models.UniqueConstraint(fields=('location', 'month_day'), name='unique_location_month_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='currentwx',
+            constraint=models.UniqueConstraint(fields=('location', 'date'), name='unique_location_date'),
+        ),
+        migrations.AddIndex(
+            model_name='currentwx',
+            index=models.Index(fields=['location', 'month_day'], name='weather_cur_locatio_fdf375_idx'),
+        ),
+    ]
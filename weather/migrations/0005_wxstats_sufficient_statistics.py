@@ -0,0 +1,45 @@
+# Generated by Django 3.1.2 on 2026-10-18 10:04
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def sums_from_averages(apps, schema_editor):
+    # The sums are exact. The observations behind the existing rows are not stored, so the sums of squares
+    # assume zero variance until the next set_stats rebuild.
+    WxStats = apps.get_model('weather', 'WxStats')
+    WxStats.objects.update(sum_min_temp=F('avg_min_temp') * F('stats_count'),
+                           sum_max_temp=F('avg_max_temp') * F('stats_count'),
+                           sumsq_min_temp=F('avg_min_temp') * F('avg_min_temp') * F('stats_count'),
+                           sumsq_max_temp=F('avg_max_temp') * F('avg_max_temp') * F('stats_count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0004_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wxstats',
+            name='sum_max_temp',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wxstats',
+            name='sum_min_temp',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wxstats',
+            name='sumsq_max_temp',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wxstats',
+            name='sumsq_min_temp',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(sums_from_averages, migrations.RunPython.noop),
+    ]
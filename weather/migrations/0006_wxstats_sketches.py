@@ -0,0 +1,33 @@
+# Generated by Django 3.1.2 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0005_wxstats_sufficient_statistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wxstats',
+            name='max_temp_sketch',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.AddField(
+            model_name='wxstats',
+            name='min_temp_sketch',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+        migrations.AddField(
+            model_name='wxstats',
+            name='p10_min_temp',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='wxstats',
+            name='p90_max_temp',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.2 on 2026-10-18 10:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0006_wxstats_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmoothedAverages',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variant', models.CharField(max_length=30)),
+                ('window', models.IntegerField()),
+                ('order', models.IntegerField()),
+                ('avg_min_temp', models.BinaryField()),
+                ('avg_max_temp', models.BinaryField()),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='smoothed_averages', to='weather.location')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='smoothedaverages',
+            constraint=models.UniqueConstraint(fields=('location', 'variant'), name='unique_location_variant'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.1.2 on 2026-10-18 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0007_smoothedaverages'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='currentwx',
+            name='unique_location_date',
+        ),
+        migrations.RemoveConstraint(
+            model_name='smoothedaverages',
+            name='unique_location_variant',
+        ),
+        migrations.RemoveConstraint(
+            model_name='wxstats',
+            name='unique_location_month_day',
+        ),
+        migrations.AddField(
+            model_name='currentwx',
+            name='snapshot',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='current_wx_snapshot',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='stats_snapshot',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='smoothedaverages',
+            name='snapshot',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wxstats',
+            name='snapshot',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name='currentwx',
+            constraint=models.UniqueConstraint(fields=('location', 'snapshot', 'date'), name='unique_location_snapshot_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='smoothedaverages',
+            constraint=models.UniqueConstraint(fields=('location', 'snapshot', 'variant'), name='unique_location_snapshot_variant'),
+        ),
+        migrations.AddConstraint(
+            model_name='wxstats',
+            constraint=models.UniqueConstraint(fields=('location', 'snapshot', 'month_day'), name='unique_location_snapshot_month_day'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.2 on 2026-10-18 10:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0009_jobrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyWeather',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('min_temp', models.FloatField(blank=True, null=True)),
+                ('max_temp', models.FloatField(blank=True, null=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='weather.location')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyweather',
+            constraint=models.UniqueConstraint(fields=('location', 'date'), name='unique_location_date'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 3.1.2 on 2026-10-18 10:45
+
+from django.db import migrations, models
+from django.db.models import IntegerField, Value
+from django.db.models.functions import Cast, ExtractDay, ExtractMonth, Substr
+
+
+def day_of_year(month, day):
+    """
+    Returns the expression of the day of year (0-365, on the leap year calendar of weather_data.day_of_year) of
+    integer month and day expressions: floor(275 * month / 9) is the day before the first of the month, from March
+    on of a year with a 30 day February, hence the correction of (month + 9) / 12
+    """
+    return Value(275) * month / Value(9) - (month + Value(9)) / Value(12) + day - Value(31)
+
+
+def set_day_of_year(apps, schema_editor):
+    """
+    Fills the day of year of the existing rows, with one update per table
+    """
+    month_day = [Cast(Substr('month_day', 1, 2), IntegerField()), Cast(Substr('month_day', 4, 2), IntegerField())]
+    for model in ('WxStats', 'CurrentWx'):
+        apps.get_model('weather', model).objects.update(day_of_year=day_of_year(*month_day))
+    apps.get_model('weather', 'DailyWeather').objects.update(day_of_year=day_of_year(
+        Cast(ExtractMonth('date'), IntegerField()), Cast(ExtractDay('date'), IntegerField())))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0010_dailyweather'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currentwx',
+            name='day_of_year',
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='dailyweather',
+            name='day_of_year',
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='wxstats',
+            name='day_of_year',
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_day_of_year, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='wxstats',
+            name='unique_location_snapshot_month_day',
+        ),
+        migrations.RemoveIndex(
+            model_name='currentwx',
+            name='weather_cur_locatio_fdf375_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='wxstats',
+            constraint=models.UniqueConstraint(fields=('location', 'snapshot', 'day_of_year'), name='unique_location_snapshot_day_of_year'),
+        ),
+    ]
@@ -1,61 +1,367 @@
-from datetime import date
+from datetime import date, timedelta
+import numpy as np
 import pandas as pd
-from weather.models import WxStats, CurrentWx, Info
-from weather.weather_data import WeatherDataRetriever, WeatherStatsCreator, \
-    get_latest_weather, WEATHER_URL, get_wx_stats_from_csv, get_latest_wx_from_csv
+from collections import defaultdict
+from weather.bulk_load import upsert_df
+from weather.history_store import HistoryStore
+from weather.instrumentation import stage
+from weather.models import WxStats, CurrentWx, DailyWeather, Info, Location, SmoothedAverages
+from weather.raw_data_cache import RawDataCache
+from weather.weather_data import WeatherDataRetriever, DailyStats, DAYS_IN_YEAR, \
+    WEATHER_QUERY, MONTH_DAY_KEYS, get_wx_stats_from_csv, get_latest_wx_from_csv, day_of_year, \
+    latest_weeks, latest_weeks_start, changed_observations, to_float64, HourlyDownsampler, downsample, \
+    downsample_freq
 import logging
 import django
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, FloatField
 from scipy.signal import savgol_filter
 
 
 django.setup()
 
+CURRENT_WX_FIELDS = ['location_id', 'date', 'day_of_year', 'month_day', 'min_temp', 'max_temp']
+STATS_UPDATE_FIELDS = ['last_date', 'stats_count', 'record_min_temp', 'avg_min_temp', 'avg_max_temp',
+                       'record_max_temp', 'sum_min_temp', 'sum_max_temp', 'sumsq_min_temp', 'sumsq_max_temp',
+                       'min_temp_sketch', 'max_temp_sketch', 'p10_min_temp', 'p90_max_temp']
+PLOT_STATS_FIELDS = ['record_min_temp', 'avg_min_temp', 'avg_max_temp', 'record_max_temp', 'p10_min_temp',
+                     'p90_max_temp']
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+# field of Location pointing at the live snapshot of each weather table
+SNAPSHOT_POINTERS = {WxStats: 'stats_snapshot', SmoothedAverages: 'stats_snapshot', CurrentWx: 'current_wx_snapshot'}
+
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
 
 
-def set_stats(from_api=True):
+def get_retriever():
     """
-    Initializes the db table for weather stats
-    @param from_api: Whether to pull the data from the online API of from a csv file
+    Returns a WeatherDataRetriever configured from the project settings
+    """
+    return WeatherDataRetriever(settings.WEATHER_API_URL + WEATHER_QUERY,
+                                max_workers=settings.WEATHER_API_WORKERS,
+                                max_per_host=settings.WEATHER_API_MAX_PER_HOST,
+                                retries=settings.WEATHER_API_RETRIES,
+                                backoff=settings.WEATHER_API_BACKOFF,
+                                cache=get_raw_data_cache(),
+                                chunksize=settings.WEATHER_API_CHUNKSIZE or None,
+                                use_async=settings.WEATHER_API_ASYNC)
+
+
+def get_raw_data_cache():
+    """
+    Returns the on-disk cache of raw API downloads, or None if caching is disabled
+    """
+    if not settings.WEATHER_CACHE_DIR:
+        return None
+    return RawDataCache(settings.WEATHER_CACHE_DIR,
+                        max_bytes=settings.WEATHER_CACHE_MAX_BYTES,
+                        max_age=settings.WEATHER_CACHE_MAX_AGE,
+                        grace=settings.WEATHER_CACHE_GRACE)
+
+
+def get_history_store():
+    """
+    Returns the local store of the cleaned daily history, or None if it is disabled
+    """
+    if not settings.WEATHER_HISTORY_DIR:
+        return None
+    return HistoryStore(settings.WEATHER_HISTORY_DIR)
+
+
+def set_stats(from_api=True, locations=None):
     """
+    Initializes the db table for weather stats, and the daily weather table with the history they are built from
+    @param from_api: Whether to pull the data from the online API, or from the local history store (from a csv
+    file if the store is disabled)
+    @param locations: Locations to initialize (defaults to all locations)
+    """
+    locations = list(Location.objects.all() if locations is None else locations)
+    history = get_history_store()
     if from_api:
-        yyc_stations_all_years = ({'station_id': 2205, 'start_yr': 1881, 'end_yr': 2012},
-                                  {'station_id': 50430, 'start_yr': 2012, 'end_yr': 2020},)
-        retriever = WeatherDataRetriever(WEATHER_URL)
-        all_weather = retriever.create_weather_df(yyc_stations_all_years, drop_blanks=True)
-        stats = WeatherStatsCreator(all_weather).create_weather_stats()
+        # the station-years of all locations share one download pool, the partial stats of each
+        # station-year are merged into their location's stats as they arrive
+        stations = [station for location in locations for station in location.station_years()]
+        location_stats = {location.pk: DailyStats.empty() for location in locations}
+        daily_weather = []
+        for station, year, weather_df in get_retriever().iter_weather_data(stations, drop_blanks=True):
+            location_stats[station['location_id']].merge(DailyStats.from_weather_df(weather_df))
+            daily_weather.append(weather_df.assign(location_id=station['location_id']))
+            if history is not None:
+                history.append(station['station_id'], year, weather_df)
+        stats = pd.concat([daily_stats.to_df().assign(location_id=location_id)
+                           for location_id, daily_stats in location_stats.items()], ignore_index=True)
+        store_daily_weather(daily_weather)
+    elif history is not None:
+        location_history = {location.pk: read_history(history, location) for location in locations}
+        stats = pd.concat([DailyStats.from_weather_df(weather_df).to_df().assign(location_id=location_id)
+                           for location_id, weather_df in location_history.items()], ignore_index=True)
+        store_daily_weather([weather_df.assign(location_id=location_id)
+                             for location_id, weather_df in location_history.items()])
     else:
-        stats = get_wx_stats_from_csv()
-    WxStats.objects.all().delete()
-    entries = []
-    for entry in stats.T.to_dict().values():
-        entries.append(WxStats(**entry))
-    WxStats.objects.bulk_create(entries)
+        stats = pd.concat([get_wx_stats_from_csv().assign(location_id=location.pk) for location in locations],
+                          ignore_index=True)
+    write_snapshot(WxStats, stats, locations, 'day_of_year', write_derived=set_smoothed_averages)
 
 
-def set_current_weather(from_api=True):
+def set_current_weather(from_api=True, locations=None, since=None, fetch=None):
     """
     Initializes the db table for latest weeks of weather (min and max daily temperature)
     @param from_api: Whether to pull the data from the online API of from a csv file
-    @return: DataFrame for the latest weather
+    @param locations: Locations to initialize (defaults to all locations)
+    @param since: dict of location id to the first date to fetch, for locations whose current weather is stored
+    up to the day before: only the station-years from that date are fetched, and
+    the stored days before it are kept (by default, all the days are fetched)
+    @param fetch: function fetching the weather of stations (defaults to fetch_current_weather). Locations
+    without fetched weather keep their stored current weather.
+    @return: DataFrame for the latest weather, with a location_id column
     """
+    locations = list(Location.objects.all() if locations is None else locations)
     if from_api:
-        yyc_current_station = ({'station_id': 50430, 'start_yr': date.today().year - 1,
-                                'end_yr': date.today().year},)
-        latest_weather = get_latest_weather(yyc_current_station)
+        latest_weather = latest_weather_df(fetch_latest_weather(locations, since, fetch), since)
+        locations = [location for location in locations if location.pk in set(latest_weather['location_id'])]
     else:
-        latest_weather = get_latest_wx_from_csv()
-    CurrentWx.objects.all().delete()
-    entries = []
-    for entry in latest_weather.T.to_dict().values():
-        entry = {k: v for k, v in entry.items() if not pd.isnull(v)}  # don't include blank fields
-        entries.append(CurrentWx(**entry))
-    CurrentWx.objects.bulk_create(entries)
+        latest_weather = pd.concat([get_latest_wx_from_csv().assign(location_id=location.pk)
+                                    for location in locations], ignore_index=True)
+    write_current_weather(latest_weather, locations)
     return latest_weather
 
 
+def fetch_latest_weather(locations, since=None, fetch=None):
+    """
+    Fetches the latest weeks of weather of locations from the API (see set_current_weather for the parameters)
+    @return: dict of location id to the fetched weather of its stations, sorted by date
+    """
+    since = since or {}
+    first_days = {location.pk: since.get(location.pk, latest_weeks_start()) for location in locations}
+    stations = [dict(station, since=first_days[location.pk],
+                     start_yr=max(station['start_yr'], first_days[location.pk].year))
+                for location in locations for station in location.current_station_years()]
+    return {location_id: pd.concat(dfs).sort_index()
+            for location_id, dfs in (fetch or fetch_current_weather)(stations).items()}
+
+
+def latest_weather_df(location_weather, since=None):
+    """
+    Returns the latest weeks of weather of locations from their fetched weather, completed with their stored
+    current weather before their since date (see set_current_weather). In hourly ingest mode, the stored so far
+    today values are kept until their next refresh (see update_today_weather), rather than the blank today row of
+    the daily data.
+    @param location_weather: dict of location id to fetched weather, as returned by fetch_latest_weather
+    @return: DataFrame of the latest weather, with a location_id column
+    """
+    since = since or {}
+    frames = []
+    for location_id, weather_df in location_weather.items():
+        if location_id in since:
+            weather_df = pd.concat([stored_weather(location_id, before=since[location_id]),
+                                    weather_df[str(since[location_id]):]])
+        if settings.WEATHER_HOURLY_INGEST:
+            today = date.today()
+            weather_df = pd.concat([weather_df[:str(today - timedelta(days=1))],
+                                    stored_weather(location_id, since=today)])
+        frames.append(latest_weeks(WeatherDataRetriever._add_month_day(weather_df),
+                                   through_today=settings.WEATHER_HOURLY_INGEST).assign(location_id=location_id))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=CURRENT_WX_FIELDS)
+
+
+def write_current_weather(latest_weather, locations):
+    """
+    Writes the latest weather as the new current weather snapshots of the locations, and to the daily weather table
+    @param latest_weather: DataFrame of the latest weather of the locations, with a location_id column
+    """
+    write_snapshot(CurrentWx, latest_weather[CURRENT_WX_FIELDS], locations, 'date')
+    store_daily_weather([latest_weather.set_index('date')])
+
+
+def fetch_current_weather(stations):
+    """
+    Fetches the daily weather of the station-years from the API, appending it to the history store. The daily
+    data is fetched in hourly ingest mode too: the API's daily values are the reference ones for the stats.
+    @param stations: station dicts, as returned by Location.current_station_years
+    @return: dict of location id to the list of the fetched DataFrames of its stations
+    """
+    location_weather = defaultdict(list)
+    history = get_history_store()
+    for station, year, weather_df in get_retriever().iter_weather_data(stations, drop_blanks=False):
+        location_weather[station['location_id']].append(weather_df)
+        if history is not None:
+            history.append(station['station_id'], year, weather_df)
+    return location_weather
+
+
+def fetch_hourly_weather(stations):
+    """
+    Fetches the hourly weather of the stations month by month and downsamples it to daily min and max
+    temperatures on the fly, so a full year of hourly rows is never held in memory. Today's values are so far
+    today. The history store is not appended to, as it holds the API's daily data.
+    @param stations: station dicts, fetched from their since date if set, else from the start of their start_yr
+    @return: dict of location id to the list of the daily DataFrames of its stations
+    """
+    retriever = get_retriever()
+    location_weather = defaultdict(list)
+    for station in stations:
+        downsampler = HourlyDownsampler()
+        start = station.get('since', date(station['start_yr'], 1, 1))
+        for _, _, hourly_df in retriever.iter_hourly_data([station], start):
+            downsampler.add(hourly_df)
+        location_weather[station['location_id']].append(downsampler.to_df()[['min_temp', 'max_temp']])
+    return location_weather
+
+
+def update_today_weather():
+    """
+    Refreshes the so far today values of the current weather from today's hourly data (WEATHER_HOURLY_INGEST),
+    in place in the live snapshots, between the daily updates
+    @return: number of locations updated
+    """
+    today = date.today()
+    locations = list(Location.objects.all())
+    location_weather = fetch_hourly_weather([dict(station, since=today) for location in locations
+                                             for station in location.current_station_years()])
+    rows = []
+    for location_id, dfs in location_weather.items():
+        weather_df = pd.concat(dfs)
+        weather_df = weather_df[(weather_df.index == pd.Timestamp(today)) & ~weather_df.index.duplicated(keep='last')]
+        rows.append(WeatherDataRetriever._add_month_day(to_float64(weather_df)).reset_index()
+                    .assign(location_id=location_id))
+    if not rows:
+        return 0
+    today_wx_df = pd.concat(rows, ignore_index=True)
+    with transaction.atomic():
+        # locking the locations keeps their current weather snapshots from being switched meanwhile
+        snapshots = dict(Location.objects.select_for_update().filter(pk__in=today_wx_df['location_id'].tolist())
+                         .values_list('pk', 'current_wx_snapshot'))
+        upsert_df(CurrentWx, today_wx_df[CURRENT_WX_FIELDS].assign(snapshot=today_wx_df['location_id'].map(snapshots)),
+                  unique_fields=['location_id', 'snapshot', 'date'])
+        store_daily_weather([today_wx_df.set_index('date')])
+        bump_data_version()
+    return len(rows)
+
+
+def store_daily_weather(frames):
+    """
+    Writes fetched daily weather to the daily weather table, inserting the new days and updating the changed ones
+    @param frames: DataFrames of min_temp and max_temp indexed by date, with a location_id column. Where they
+    overlap (several stations of a location), the last frame's temperatures are kept.
+    @return: number of rows inserted or updated
+    """
+    frames = [weather_df for weather_df in frames if not weather_df.empty]
+    if not frames:
+        return 0
+    daily_df = to_float64(pd.concat(frames)[['location_id', 'min_temp', 'max_temp']]).rename_axis('date').reset_index()
+    daily_df = daily_df.drop_duplicates(['location_id', 'date'], keep='last')
+    daily_df['day_of_year'] = day_of_year(daily_df['date'])
+    return upsert_df(DailyWeather, daily_df[['location_id', 'date', 'day_of_year', 'min_temp', 'max_temp']],
+                     unique_fields=['location_id', 'date'])
+
+
+def stored_weather(location_id, before=None, since=None):
+    """
+    Returns the live current weather of a location before a date or since a date, in the format of fetched weather
+    (min_temp and max_temp indexed by date)
+    """
+    queryset = live_rows(CurrentWx, location_id)
+    if before is not None:
+        queryset = queryset.filter(date__lt=before)
+    if since is not None:
+        queryset = queryset.filter(date__gte=since)
+    weather_df = queryset_to_df(queryset.order_by('date'), ['date', 'min_temp', 'max_temp'])
+    return weather_df.set_index(pd.DatetimeIndex(weather_df.pop('date'), name='date'))
+
+
+def refetch_since(previous_wx_df):
+    """
+    Returns the first date the daily update fetches for each location with stored current weather: the first day
+    of yesterday's month, as the API may still correct or backfill the days of the current month, or the day
+    after the last stored day if earlier (the update did not run for a while)
+    @param previous_wx_df: the stored current weather, with columns location_id and date
+    @return: dict of location id to date
+    """
+    start = (date.today() - timedelta(days=1)).replace(day=1)
+    if previous_wx_df.empty:
+        return {}
+    last_dates = previous_wx_df.groupby('location_id')['date'].max()
+    return {int(location_id): min(start, last_date + timedelta(days=1))
+            for location_id, last_date in last_dates.items()}
+
+
+def live_rows(table, location=None):
+    """
+    Returns the rows of the live snapshots of a weather table (see write_snapshot)
+    @param table: WxStats, CurrentWx or SmoothedAverages
+    @param location: only return the rows of this location
+    """
+    queryset = table.objects.filter(snapshot=F(f'location__{SNAPSHOT_POINTERS[table]}'))
+    return queryset if location is None else queryset.filter(location=location)
+
+
+def write_snapshot(table, df, locations, key, write_derived=None):
+    """
+    Replaces the rows of the locations in a weather table without disturbing the readers, which only read the
+    live snapshot of each location (see live_rows): the rows are written as a new snapshot, and the locations are
+    switched to it in the same transaction. The locations are locked from the choice of the new snapshot to the
+    switch, so the writes in place in the live snapshot (see update_today_weather) wait for the switch rather than
+    being lost with the snapshot switched from. The snapshot live until then is kept for the requests that started
+    reading it, older ones are deleted.
+    @param table: WxStats or CurrentWx
+    @param df: DataFrame of the new rows of the locations, with a location_id column
+    @param key: field identifying a row within a snapshot of a location
+    @param write_derived: optional function writing the rows derived from the new snapshots (given as a dict of
+    location id to snapshot), called in the same transaction
+    """
+    pointer = SNAPSHOT_POINTERS[table]
+    tables = [other for other, other_pointer in SNAPSHOT_POINTERS.items() if other_pointer == pointer]
+    with transaction.atomic():
+        live = dict(Location.objects.select_for_update().filter(pk__in=[location.pk for location in locations])
+                    .order_by('pk').values_list('pk', pointer))
+        snapshots = {location_id: snapshot + 1 for location_id, snapshot in live.items()}
+        for location_id, snapshot in live.items():
+            for snapshot_table in tables:  # leftovers of a rebuild interrupted before its switch
+                snapshot_table.objects.filter(location=location_id, snapshot__gt=snapshot).delete()
+        upsert_df(table, df.assign(snapshot=df['location_id'].map(snapshots)),
+                  unique_fields=['location_id', 'snapshot', key])
+        if write_derived is not None:
+            write_derived(snapshots)
+        for location_id, snapshot in live.items():
+            Location.objects.filter(pk=location_id, **{pointer: snapshot}).update(**{pointer: snapshot + 1})
+            for snapshot_table in tables:
+                snapshot_table.objects.filter(location=location_id, snapshot__lt=snapshot).delete()
+        bump_data_version()
+
+
+def read_history(history, location):
+    """
+    Returns the stored daily history of all the stations of a location
+    @param history: HistoryStore
+    """
+    weather_df, missing = history.read_stations(location.station_years())
+    if missing:
+        raise FileNotFoundError(f"History of {location.slug} is not stored for these station-years: {missing}, "
+                                f"rebuild its stats from the API")
+    return weather_df
+
+
+def recompute_records(stats, days, history, location_id):
+    """
+    Recomputes records of a location's stats from its stored history
+    @param stats: DailyStats of the location
+    @param days: days of year to recompute
+    @param history: HistoryStore, or None if disabled
+    @return: whether the records could be recomputed
+    """
+    if history is None:
+        return False
+    try:
+        weather_df = read_history(history, Location.objects.get(pk=location_id))
+    except FileNotFoundError:
+        return False
+    stats.recompute_records(weather_df, days)
+    return True
+
+
 def set_info():
     """
     Initialize the info table with a single record that keeps track of the date
@@ -65,14 +371,31 @@ def set_info():
     Info(last_update=date.today()).save()
 
 
-def table_to_df(table):
+def queryset_to_df(queryset, fields):
     """
-    Returns a db table as a dataframe
+    Returns the fields of a queryset's rows as a dataframe, fetched as tuples with values_list (no dict per row)
+    and built column-wise. Float columns are typed float64, with NaN for NULL.
+    @param fields: names of the columns to select (attnames, e.g. location_id)
     """
-    table_list = list(table.objects.all().values())
-    df = pd.DataFrame(table_list)
-    df.sort_values(by=['month_day'], inplace=True)
-    return df
+    rows = list(queryset.values_list(*fields))
+    columns = zip(*rows) if rows else [()] * len(fields)
+    float_fields = {field.attname for field in queryset.model._meta.concrete_fields
+                    if isinstance(field, FloatField)}
+    return pd.DataFrame({name: np.array(column, dtype='f8') if name in float_fields else list(column)
+                         for name, column in zip(fields, columns)}, columns=fields)
+
+
+def table_to_df(table, location=None, fields=None, order_by=('day_of_year',)):
+    """
+    Returns the live snapshot of a weather table as a dataframe, filtered and ordered in the query
+    @param location: only return the rows of this location
+    @param fields: names of the columns to select (default: all the table's columns)
+    @param order_by: fields the rows are ordered by
+    """
+    queryset = live_rows(table, location)
+    if fields is None:
+        fields = [field.attname for field in table._meta.concrete_fields]
+    return queryset_to_df(queryset.order_by(*order_by), fields)
 
 
 def update_last_db_access_date():
@@ -85,64 +408,214 @@ def date_db_last_updated():
     return Info.objects.get(pk=1).last_update
 
 
-def update_weather_tables():
-    current_wx_df = set_current_weather(from_api=True)
-    current_wx_df = current_wx_df.dropna()
-    for index, row in current_wx_df.iterrows():
-        d, min_temp, max_temp, month_day = row['date'], row['min_temp'], row['max_temp'], row['month_day']
-        rec = WxStats.objects.get(month_day=month_day)
-        if d <= rec.last_date:
-            continue
-        if min_temp < rec.record_min_temp:
-            rec.record_min_temp = min_temp
-        if max_temp > rec.record_max_temp:
-            rec.record_max_temp = max_temp
-        new_stats_count = rec.stats_count + 1
-        rec.avg_min_temp = (rec.avg_min_temp * rec.stats_count + min_temp) / new_stats_count
-        rec.avg_max_temp = (rec.avg_max_temp * rec.stats_count + max_temp) / new_stats_count
-        rec.stats_count = new_stats_count
-        rec.last_date = d
-        rec.save()
-    update_last_db_access_date()
+def bump_data_version():
+    """
+    Marks the weather tables as changed, which invalidates the cached plots once the transaction commits
+    """
+    Info.objects.filter(pk=1).update(data_version=F('data_version') + 1)
+
+
+def update_weather_tables(fetch=None):
+    """
+    Fetches the latest weather and folds it into the weather stats: days not yet counted are added, and
+    counted days whose temperatures were corrected, blanked or backfilled since the previous fetch are
+    retracted and re-added, in O(days changed).
+    The weather is fetched first, then the locations are locked, so overlapping updates fold their fetched
+    weather one after the other: each compares it with the current weather stored by the previous one, read
+    under the lock. The affected stats rows are loaded with one query, updated as arrays and upserted back in
+    place in their live snapshot, along with the new current weather, all in one transaction.
+    Only the station-years of the recent days are fetched (see refetch_since).
+    @param fetch: function fetching the weather of stations (defaults to fetch_current_weather)
+    """
+    locations = list(Location.objects.all())
+    since = refetch_since(table_to_df(CurrentWx, fields=CURRENT_WX_FIELDS, order_by=()))
+    location_weather = fetch_latest_weather(locations, since, fetch)
+    history = get_history_store()
+    with transaction.atomic():
+        # the current weather is read again under the lock, in case an overlapping update stored it meanwhile
+        locations = list(Location.objects.select_for_update().filter(pk__in=list(location_weather)).order_by('pk'))
+        previous_wx_df = table_to_df(CurrentWx, fields=CURRENT_WX_FIELDS, order_by=())
+        current_wx_df = latest_weather_df(location_weather, since)
+        write_current_weather(current_wx_df, locations)
+        # so far today values (hourly ingest) are never counted in the stats: the day is counted from the daily
+        # data once it is over
+        current_wx_df = current_wx_df[pd.to_datetime(current_wx_df['date']) < pd.Timestamp(date.today())]
+        stats_df = queryset_to_df(
+            live_rows(WxStats).select_for_update().filter(location__in=current_wx_df['location_id'].unique(),
+                                                       day_of_year__in=current_wx_df['day_of_year'].unique()),
+            [field.attname for field in WxStats._meta.concrete_fields])
+        updated = []
+        for location_id, location_stats_df in (stats_df.groupby('location_id') if not stats_df.empty else []):
+            stats = DailyStats.from_df(location_stats_df)
+            location_wx_df = current_wx_df[current_wx_df['location_id'] == location_id]
+            if not previous_wx_df.empty:
+                retract, add = changed_observations(
+                    previous_wx_df[previous_wx_df['location_id'] == location_id], location_wx_df, stats.last_date)
+                retracted, stale_records = stats.retract_days(retract)
+                corrected = np.union1d(retracted, stats.add_days(add))
+                if len(stale_records) and not recompute_records(stats, stale_records, history, location_id):
+                    logger.warning(f"Records of {list(MONTH_DAY_KEYS[stale_records])} (location {location_id}) "
+                                   f"may include retracted temperatures until the stats are rebuilt")
+            else:
+                corrected = []
+            days = np.union1d(corrected, stats.add_days(location_wx_df, only_new=True)).astype(int)
+            updated.append(stats.to_df(days).assign(location_id=location_id,
+                                                    snapshot=location_stats_df['snapshot'].iloc[0]))
+        if updated:
+            updated = pd.concat(updated, ignore_index=True)
+            upsert_df(WxStats, updated, unique_fields=['location_id', 'snapshot', 'day_of_year'],
+                      update_fields=STATS_UPDATE_FIELDS)
+            set_smoothed_averages(dict(updated[['location_id', 'snapshot']].drop_duplicates().to_numpy().tolist()))
+        update_last_db_access_date()
+        bump_data_version()
 
 
 def initialize_db():
     """
-    Initializes all database tables on first time access to the website.
+    Initializes all database tables on first time access to the website, and the tables of
+    locations added since.
     """
-    if WxStats.objects.exists() and CurrentWx.objects.exists() and Info.objects.exists():
-        return
-    set_stats(from_api=True)
-    set_current_weather(from_api=True)
-    set_info()
+    new_locations = Location.objects.exclude(pk__in=live_rows(WxStats).values('location'))
+    if new_locations:
+        set_stats(from_api=True, locations=new_locations)
+        set_current_weather(from_api=True, locations=new_locations)
+    if not Info.objects.exists():
+        set_info()
 
 
-def smooth_averages(wx_stats):
+def smooth_averages(wx_stats, window=31, order=2):
     """
     Smooth the min and max averages in the stats DataFrame using savgol_filter
     @param wx_stats: Weather stats DataFrame
+    @param window: filter window length (days)
+    @param order: order of the polynomial fitted over the window
     @return: The weather stats DataFrame with smoothed min and max averages
     """
     cols = ['avg_min_temp', 'avg_max_temp']
-    window, order = 31, 2
     for col in cols:
         wx_stats[col] = savgol_filter(wx_stats[col], window, order, mode="wrap")
     return wx_stats
 
 
-def get_plot_df(smoothed):
+def smoothed_averages(wx_stats, window, order):
+    """
+    Returns the smoothed min and max averages of a location's stats as arrays indexed by day of year
+    (NaN for days without stats)
+    @param wx_stats: stats DataFrame of the location with day_of_year, avg_min_temp and avg_max_temp columns
+    """
+    wx_stats = smooth_averages(wx_stats[['day_of_year', 'avg_min_temp', 'avg_max_temp']].sort_values('day_of_year'),
+                               window, order)
+    doy = wx_stats['day_of_year'].to_numpy()
+    averages = []
+    for col in ['avg_min_temp', 'avg_max_temp']:
+        values = np.full(DAYS_IN_YEAR, np.nan)
+        values[doy] = wx_stats[col].to_numpy()
+        averages.append(values)
+    return averages
+
+
+def set_smoothed_averages(snapshots):
+    """
+    Computes and stores every smoothing variant of settings.WEATHER_SMOOTHING from stats snapshots of the
+    locations. Called in the transactions changing the stats, so the smoothed averages are committed with them.
+    @param snapshots: dict of location id to the stats snapshot
+    """
+    entries = []
+    for location_id, snapshot in snapshots.items():
+        SmoothedAverages.objects.filter(location=location_id, snapshot=snapshot).delete()
+        wx_stats = queryset_to_df(WxStats.objects.filter(location=location_id, snapshot=snapshot),
+                                  ['day_of_year', 'avg_min_temp', 'avg_max_temp'])
+        for variant, (window, order) in (settings.WEATHER_SMOOTHING.items() if not wx_stats.empty else []):
+            avg_min_temp, avg_max_temp = smoothed_averages(wx_stats, window, order)
+            entries.append(SmoothedAverages(location_id=location_id, snapshot=snapshot, variant=variant,
+                                            window=window, order=order, avg_min_temp=avg_min_temp.tobytes(),
+                                            avg_max_temp=avg_max_temp.tobytes()))
+    SmoothedAverages.objects.bulk_create(entries)
+
+
+def get_smoothed_averages(location, variant):
+    """
+    Returns the stored smoothed min and max averages of a location as arrays indexed by day of year, computing them
+    from its live stats only if the variant was added or changed in the settings since the stats last changed
+    @param variant: name of the smoothing variant
+    """
+    window, order = settings.WEATHER_SMOOTHING[variant]
+    stored = live_rows(SmoothedAverages, location).filter(variant=variant, window=window, order=order) \
+        .values_list('avg_min_temp', 'avg_max_temp').first()
+    if stored is None:
+        wx_stats = table_to_df(WxStats, location, fields=['day_of_year', 'avg_min_temp', 'avg_max_temp'])
+        return smoothed_averages(wx_stats, window, order)
+    return [np.frombuffer(averages) for averages in stored]
+
+
+def plot_rows(location, date_range=None):
+    """
+    Returns the plot rows of a location in one query: its live current weather (or its daily weather over a date
+    range) joined with the live stats of each day on the stats' (location, snapshot, day_of_year) index, ordered
+    by date. Days without stats are left out. The snapshot pointers are read in the same statement, so the rows
+    are consistent even while a snapshot is switched.
+    @param date_range: (start, end) dates read from the daily weather table, or None for the current weather
+    @return: DataFrame with the columns date (datetime64), min_temp, max_temp, day_of_year and PLOT_STATS_FIELDS
+    """
+    weather_table = CurrentWx if date_range is None else DailyWeather
+    quote = connection.ops.quote_name
+
+    def column(table, name):
+        return f'{quote(table._meta.db_table)}.{quote(table._meta.get_field(name).column)}'
+
+    weather_fields = ['date', 'min_temp', 'max_temp', 'day_of_year']
+    selected = [column(weather_table, name) for name in weather_fields] + \
+        [column(WxStats, name) for name in PLOT_STATS_FIELDS]
+    sql = f"SELECT {', '.join(selected)} FROM {quote(weather_table._meta.db_table)} " \
+          f"INNER JOIN {quote(Location._meta.db_table)} " \
+          f"ON {column(Location, 'id')} = {column(weather_table, 'location')} " \
+          f"INNER JOIN {quote(WxStats._meta.db_table)} " \
+          f"ON {column(WxStats, 'location')} = {column(weather_table, 'location')} " \
+          f"AND {column(WxStats, 'snapshot')} = {column(Location, 'stats_snapshot')} " \
+          f"AND {column(WxStats, 'day_of_year')} = {column(weather_table, 'day_of_year')} " \
+          f"WHERE {column(weather_table, 'location')} = %s "
+    params = [location.pk]
+    if date_range is None:
+        sql += f"AND {column(CurrentWx, 'snapshot')} = {column(Location, 'current_wx_snapshot')} "
+    else:
+        date_field = DailyWeather._meta.get_field('date')
+        sql += f"AND {column(DailyWeather, 'date')} BETWEEN %s AND %s "
+        params += [date_field.get_db_prep_value(day, connection) for day in date_range]
+    with connection.cursor() as cursor:
+        cursor.execute(sql + f"ORDER BY {column(weather_table, 'date')}", params)
+        rows = cursor.fetchall()
+    columns = list(zip(*rows)) if rows else [()] * len(selected)
+    # dates converted through their ordinals, much faster than parsing the date objects
+    days = np.array([day.toordinal() for day in columns[0]], dtype='i8') - EPOCH_ORDINAL
+    plot_df = pd.DataFrame({'date': days.astype('datetime64[D]').astype('datetime64[ns]')})
+    for name, values in zip(weather_fields[1:] + PLOT_STATS_FIELDS, columns[1:]):
+        plot_df[name] = np.array(values, dtype='f8')
+    plot_df['day_of_year'] = plot_df['day_of_year'].astype(int)
+    return plot_df[weather_fields + PLOT_STATS_FIELDS]
+
+
+def get_plot_df(smoothed, location, date_range=None):
     """
     Returns a dataframe suitable for the Bokeh plot
-    @param smoothed: whether to smooth the min and max averages in the stats
+    @param smoothed: the name of a smoothing variant of the min and max averages, True for the default variant,
+    or False for the raw averages
+    @param location: Location to plot
+    @param date_range: (start, end) dates to plot from the daily weather table instead of the latest weeks. Spans
+    longer than settings.WEATHER_PLOT_MAX_BARS days are downsampled to weeks, months, quarters or years (see
+    downsample), with a width column giving the days covered by each row.
     """
-    if date_db_last_updated() < date.today():  # typically only true on the first server access of any given day
-        update_weather_tables()
-        logger.info("DB Tables updated!")
-    current_wx = table_to_df(CurrentWx)
-    wx_stats = table_to_df(WxStats)
+    with stage('plot_query'):
+        plot_df = plot_rows(location, date_range)
     if smoothed:
-        wx_stats = smooth_averages(wx_stats)
-    wx_stats = wx_stats.drop(columns=['last_date', 'stats_count'])
-    plot_df = pd.merge(current_wx, wx_stats, how='inner', on=['month_day'])
-    plot_df = plot_df.drop(columns=['month_day'])
+        with stage('smoothed_averages'):
+            variant = settings.WEATHER_DEFAULT_SMOOTHING if smoothed is True else smoothed
+            avg_min_temp, avg_max_temp = get_smoothed_averages(location, variant)
+    with stage('plot_df'):
+        doy = plot_df.pop('day_of_year').to_numpy(dtype=int)
+        if smoothed:
+            # smoothed averages indexed by day of year
+            plot_df['avg_min_temp'], plot_df['avg_max_temp'] = avg_min_temp[doy], avg_max_temp[doy]
+    if date_range is not None:
+        with stage('downsample'):
+            plot_df = downsample(plot_df, downsample_freq(*date_range, settings.WEATHER_PLOT_MAX_BARS))
     return plot_df
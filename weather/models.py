@@ -1,27 +1,166 @@
+from datetime import date
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
 
+class Location(models.Model):
+    """ Model representing a city the temperature trend is served for"""
+    slug = models.SlugField(unique=True, max_length=30)  # used in the url, e.g. 'yyc'
+    name = models.CharField(max_length=100, null=False, blank=False)  # e.g. 'Calgary, AB'
+    station_name = models.CharField(max_length=100, null=False, blank=False)  # description of the station site
+    # live snapshots of the location's weather tables: rebuilds write a new snapshot, then switch to it
+    stats_snapshot = models.IntegerField(null=False, blank=False, default=0, editable=False)
+    current_wx_snapshot = models.IntegerField(null=False, blank=False, default=0, editable=False)
+
+    def __str__(self):
+        return self.name
+
+    def station_years(self):
+        """
+        Returns the stations providing the history of this location, in the format used by WeatherDataRetriever
+        """
+        return [station.as_dict() for station in self.stations.all()]
+
+    def current_station_years(self):
+        """
+        Returns the stations still reporting for this location, covering last year and this year
+        """
+        today = date.today()
+        return [dict(station.as_dict(), start_yr=max(station.start_yr, today.year - 1))
+                for station in self.stations.all() if station.end_yr is None]
+
+    def first_year(self):
+        """
+        Returns the first year of the history of this location, or None if it has no stations yet
+        """
+        return min((station.start_yr for station in self.stations.all()), default=None)
+
+
+class Station(models.Model):
+    """ Model representing a Canada climate data station and the years it provides data for its location"""
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='stations')
+    station_id = models.IntegerField(null=False, blank=False)  # climate data API station ID
+    start_yr = models.IntegerField(null=False, blank=False)
+    end_yr = models.IntegerField(null=True, blank=True)  # None for a station that is still reporting
+
+    class Meta:
+        ordering = ['start_yr']
+
+    def __str__(self):
+        return f"{self.station_id} ({self.start_yr}-{self.end_yr or ''})"
+
+    def as_dict(self):
+        return {'station_id': self.station_id, 'start_yr': self.start_yr, 'end_yr': self.end_yr or date.today().year,
+                'location_id': self.location_id}
+
+
 class WxStats(models.Model):
-    """ Model representing the temperature stats (temperatures in °C)"""
-    month_day = models.CharField(primary_key=True, max_length=5, null=False, blank=False)
+    """ Model representing the temperature stats of a location (temperatures in °C)"""
+    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    snapshot = models.IntegerField(null=False, blank=False, default=0)  # live if equal to location.stats_snapshot
+    day_of_year = models.SmallIntegerField(null=False, blank=False)  # 0-365 on a leap year calendar
+    month_day = models.CharField(max_length=5, null=False, blank=False)
     last_date = models.DateField(null=False, blank=False)
     stats_count = models.IntegerField(null=False, blank=False)
     record_min_temp = models.FloatField(null=False, blank=False)
     avg_min_temp = models.FloatField(null=False, blank=False)
     avg_max_temp = models.FloatField(null=False, blank=False)
     record_max_temp = models.FloatField(null=False, blank=False)
+    # sufficient statistics the averages are derived from, so observations can be added and retracted
+    sum_min_temp = models.FloatField(null=False, blank=False, default=0)
+    sum_max_temp = models.FloatField(null=False, blank=False, default=0)
+    sumsq_min_temp = models.FloatField(null=False, blank=False, default=0)
+    sumsq_max_temp = models.FloatField(null=False, blank=False, default=0)
+    # serialized histogram sketches of the min and max temperatures, and the percentiles derived from them
+    min_temp_sketch = models.BinaryField(null=False, blank=True, default=b'')
+    max_temp_sketch = models.BinaryField(null=False, blank=True, default=b'')
+    p10_min_temp = models.FloatField(null=True, blank=True)
+    p90_max_temp = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        # also the index the plot rows are joined on (see model_manager.plot_rows)
+        constraints = [models.UniqueConstraint(fields=['location', 'snapshot', 'day_of_year'],
+                                               name='unique_location_snapshot_day_of_year')]
 
 
 class CurrentWx(models.Model):
-    """ Model representing the recent min and max temperatures (temperatures in °C)"""
-    date = models.DateField(primary_key=True, null=False, blank=False)
+    """ Model representing the recent min and max temperatures of a location (temperatures in °C)"""
+    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    snapshot = models.IntegerField(null=False, blank=False, default=0)  # live if equal to location.current_wx_snapshot
+    date = models.DateField(null=False, blank=False)
+    day_of_year = models.SmallIntegerField(null=False, blank=False)
     month_day = models.CharField(max_length=5, null=False, blank=False)
     min_temp = models.FloatField(null=True, blank=True)
     max_temp = models.FloatField(null=True, blank=True)
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['location', 'snapshot', 'date'],
+                                               name='unique_location_snapshot_date')]
+
+
+class DailyWeather(models.Model):
+    """ Model representing the full daily history of min and max temperatures of a location (temperatures in °C),
+    queried by date range. Rows are updated in place as the fetched weather changes."""
+    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    date = models.DateField(null=False, blank=False)
+    day_of_year = models.SmallIntegerField(null=False, blank=False)
+    min_temp = models.FloatField(null=True, blank=True)
+    max_temp = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        # also the index of the date range queries of a location
+        constraints = [models.UniqueConstraint(fields=['location', 'date'], name='unique_location_date')]
+
 
 class Info(models.Model):
     """ Model to store the time of last tables update date"""
     last_update = models.DateField(null=False, blank=False)
+    data_version = models.IntegerField(null=False, blank=False, default=0)  # incremented on every tables change
+    refresh_started = models.DateTimeField(null=True, blank=True)  # lease held by the process refreshing the tables
+
+
+class SmoothedAverages(models.Model):
+    """ Model representing the smoothed daily averages of a location for one smoothing variant, computed whenever
+    the stats change (float64 arrays indexed by day of year, NaN for days without stats)"""
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, related_name='smoothed_averages')
+    snapshot = models.IntegerField(null=False, blank=False, default=0)  # snapshot of the stats they were computed from
+    variant = models.CharField(max_length=30, null=False, blank=False)  # a name in settings.WEATHER_SMOOTHING
+    window = models.IntegerField(null=False, blank=False)  # Savitzky-Golay filter window length and polynomial order
+    order = models.IntegerField(null=False, blank=False)
+    avg_min_temp = models.BinaryField(null=False, blank=False)
+    avg_max_temp = models.BinaryField(null=False, blank=False)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['location', 'snapshot', 'variant'],
+                                               name='unique_location_snapshot_variant')]
+
+
+class JobRun(models.Model):
+    """ Model recording a run of a scheduled refresh job (see weather.pipeline)"""
+    RUNNING, SUCCEEDED, FAILED = 'running', 'succeeded', 'failed'
+    STATUSES = [(RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100, null=False, blank=False)  # e.g. 'refresh', 'fetch 27211'
+    station_id = models.IntegerField(null=True, blank=True)  # climate data API station ID of a per-station job
+    status = models.CharField(max_length=10, choices=STATUSES, default=RUNNING)
+    started = models.DateTimeField(null=False, blank=False, db_index=True)
+    duration = models.FloatField(null=True, blank=True)  # seconds, once finished
+    attempts = models.IntegerField(null=False, blank=False, default=0)
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        ordering = ['-started']
+
+    def __str__(self):
+        return f"{self.name} {self.started:%Y-%m-%d %H:%M} {self.status}"
+
+    @classmethod
+    def start(cls, name, station_id=None):
+        return cls.objects.create(name=name, station_id=station_id, started=timezone.now())
+
+    def finish(self, status, attempts=1, error=''):
+        self.status, self.attempts, self.error = status, attempts, error
+        self.duration = (timezone.now() - self.started).total_seconds()
+        self.save(update_fields=['status', 'attempts', 'error', 'duration'])
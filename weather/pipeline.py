@@ -0,0 +1,138 @@
+"""
+Refresh pipeline run by the scheduler (`python manage.py scheduler`): the recent weather of each station is fetched
+by its own job on a thread pool, retried with jittered backoff on failure, then the weather tables are updated
+from the fetched weather. Every job run is recorded in the JobRun table with its status and duration.
+"""
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from weather.model_manager import fetch_current_weather, update_today_weather
+from weather.models import JobRun
+from weather.prerender import prerender
+from weather.refresh import _refresh, claim_refresh
+
+logger = logging.getLogger(__name__)
+
+
+def run_job(name, func, *args, station_id=None, retries=0, backoff=1.0):
+    """
+    Runs func(*args) as a recorded job, retrying it on failure after an exponential backoff with jitter
+    @param station_id: station of a per-station job
+    @param retries: number of times a failed run is retried
+    @param backoff: base delay in seconds between retries, doubled on each attempt
+    @return: the result of func
+    """
+    run = JobRun.start(name, station_id)
+    for attempt in range(retries + 1):
+        try:
+            result = func(*args)
+        except Exception as e:
+            if attempt == retries:
+                run.finish(JobRun.FAILED, attempts=attempt + 1, error=repr(e))
+                raise
+            delay = backoff * 2 ** attempt * (0.5 + random.random())
+            logger.warning(f"Job {name} failed ({e!r}), retrying in {delay:.1f} s")
+            time.sleep(delay)
+        else:
+            run.finish(JobRun.SUCCEEDED, attempts=attempt + 1)
+            return result
+
+
+def fetch_in_jobs(stations):
+    """
+    Fetches the weather of the stations with one job per station on a thread pool, as the fetch function of
+    update_weather_tables. The locations of a station whose job still fails after its retries are left out,
+    so they keep their stored current weather until the next day's refresh.
+    @return: dict of location id to the list of the fetched DataFrames of its stations
+    @raise RuntimeError: if no location could be fetched, so the refresh fails and is retried
+    """
+    with ThreadPoolExecutor(max_workers=settings.WEATHER_JOB_WORKERS, thread_name_prefix='weather-job') as executor:
+        results = list(executor.map(_fetch_station, stations))
+    failed = {station['location_id'] for station, station_weather in zip(stations, results) if station_weather is None}
+    location_weather = defaultdict(list)
+    for station_weather in results:
+        for location_id, dfs in (station_weather or {}).items():
+            if location_id not in failed:
+                location_weather[location_id] += dfs
+    if stations and not location_weather:
+        raise RuntimeError(f"Fetching all the {len(stations)} stations failed")
+    return location_weather
+
+
+def _fetch_station(station):
+    """
+    Job fetching the weather of one station
+    @return: the fetched weather (see fetch_current_weather), or None if the job failed
+    """
+    try:
+        return run_job(f"fetch {station['station_id']}", fetch_current_weather, [station],
+                       station_id=station['station_id'], retries=settings.WEATHER_JOB_RETRIES,
+                       backoff=settings.WEATHER_JOB_BACKOFF)
+    except Exception:
+        logger.exception(f"Fetching station {station['station_id']} failed, its location keeps its stored weather")
+        return None
+    finally:
+        connection.close()  # the pool thread's own db connection
+
+
+def run_pipeline():
+    """
+    Scheduled refresh: updates the weather tables if they are stale, under the refresh lease, so a run never
+    overlaps another run or a refresh started by a request, in any process. Job runs older than
+    WEATHER_JOB_HISTORY_DAYS are deleted.
+    @return: whether the tables were updated
+    """
+    try:
+        if not claim_refresh():
+            logger.info("Weather tables up to date or being refreshed, skipping the scheduled refresh")
+            return False
+        run = JobRun.start('refresh')
+        updated = _refresh(fetch_in_jobs)
+        run.finish(JobRun.SUCCEEDED if updated else JobRun.FAILED,
+                   error='' if updated else "update_weather_tables failed, see the log")
+        JobRun.objects.filter(started__lt=timezone.now() - timedelta(days=settings.WEATHER_JOB_HISTORY_DAYS)).delete()
+        if updated:
+            publish_prerendered()
+        return updated
+    finally:
+        connection.close()
+
+
+def run_today_refresh():
+    """
+    Scheduled refresh of the so far today values of the current weather, in hourly ingest mode
+    @return: number of locations updated
+    """
+    try:
+        updated = run_job('today', update_today_weather, retries=settings.WEATHER_JOB_RETRIES,
+                          backoff=settings.WEATHER_JOB_BACKOFF)
+    except Exception:
+        logger.exception("Refreshing today's weather failed")
+        return 0
+    else:
+        if updated:
+            publish_prerendered()
+        return updated
+    finally:
+        connection.close()
+
+
+def publish_prerendered():
+    """
+    Job publishing the prerendered pages of the updated tables, in static pre-render mode. If it fails, the
+    dynamic views keep serving the pages until the web processes find the render stale and render it themselves.
+    """
+    if not settings.WEATHER_PRERENDER_DIR:
+        return
+    try:
+        run_job('prerender', prerender)
+    except Exception:
+        logger.exception("Prerendering the pages failed")
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+from bokeh.embed import components
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.urls import reverse
+
+from weather.instrumentation import cache_lookup, stage
+from weather.model_manager import get_plot_df, live_rows
+from weather.models import WxStats
+from weather.refresh import refresh_in_background
+from weather.trend_plot_builder import TrendPlotBuilder
+
+
+def homepage_cache_key(info, location, smoothed, prefix='homepage', date_range=None):
+    """
+    Returns the cache key of the homepage plot for the current state of the weather tables
+    @param info: the Info record
+    @param location: the Location plotted
+    @param smoothed: the smoothing variant of the averages, True for the default one or False for none
+    @param prefix: kind of cached value
+    @param date_range: (start, end) dates plotted, or None for the latest weeks
+    """
+    key = f"weather:{prefix}:{location.slug}:{info.last_update.isoformat()}:{info.data_version}:" \
+          f"{smoothing_param(smoothed)[1]}"
+    if date_range is not None:
+        key += f":{date_range[0].isoformat()}:{date_range[1].isoformat()}:{settings.WEATHER_PLOT_MAX_BARS}"
+    return key
+
+
+def plot_data_etag(info, location, smoothed, date_range=None):
+    """
+    Returns the ETag of the plot data, which changes whenever the weather tables change
+    """
+    return homepage_cache_key(info, location, smoothed, prefix='plot-data', date_range=date_range)
+
+
+def smoothing_param(smoothed):
+    """
+    Returns the query parameter selecting the smoothing of the averages, as a (name, value) pair
+    """
+    return ('smoothing', smoothed) if isinstance(smoothed, str) else ('smoothed', int(smoothed))
+
+
+def plot_data_url(location, smoothed, date_range=None):
+    name, value = smoothing_param(smoothed)
+    url = f"{reverse('location_plot_data', args=[location.slug])}?{name}={value}"
+    if date_range is not None:
+        url += f"&start={date_range[0].isoformat()}&end={date_range[1].isoformat()}"
+    return url
+
+
+def get_homepage_context(location, smoothed, date_range=None):
+    """
+    Returns the homepage template context (location, plot script and div, max_years, first_year, start, end,
+    smoothed, and the smoothing query parameter kept by the date range form),
+    rendering the plot only when it is not cached for the current date and version of the weather tables
+    @param location: the Location to plot
+    @param smoothed: the smoothing variant of the min and max averages, True for the default one or False for none
+    @param date_range: (start, end) dates to plot, or None for the latest weeks
+    """
+    with stage('refresh_check'):
+        info = refresh_in_background()
+    key = homepage_cache_key(info, location, smoothed, date_range=date_range)
+    with stage('cache_get'):
+        context = cache.get(key)
+    cache_lookup('homepage', context is not None)
+    if context is None:
+        context = render_homepage_context(location, smoothed, date_range)
+        cache.set(key, context, settings.WEATHER_PLOT_CACHE_TIMEOUT)
+    return context
+
+
+def render_homepage_context(location, smoothed, date_range=None, data_url=None):
+    """
+    Renders the plot and returns the homepage template context (see get_homepage_context), without caching
+    @param data_url: url the page loads the plot data from (defaults to the plot data view)
+    """
+    builder = TrendPlotBuilder(location, smoothed=smoothed, date_range=date_range,
+                               data_url=data_url or plot_data_url(location, smoothed, date_range))
+    with stage('components'):
+        script, div = components(builder.get_plot())
+    max_years = live_rows(WxStats, location).aggregate(max_years=Max('stats_count'))['max_years'] or 0
+    return {'location': location,
+            'script': script,
+            'div': div,
+            'max_years': max_years,
+            'first_year': location.first_year(),
+            'start': date_range and date_range[0],
+            'end': date_range and date_range[1],
+            'smoothed': smoothed,
+            'smoothing_param': None if smoothed is True else smoothing_param(smoothed)}
+
+
+def get_plot_data(info, location, smoothed, date_range=None):
+    """
+    Returns the plot data as compact columns (dates as days since the epoch, temperatures rounded to
+    0.01°C, blanks as None), cached for the current date and version of the weather tables. The data of a
+    date range also has the days covered by each row (width column, see get_plot_df).
+    @param info: the Info record
+    @param location: the Location to plot
+    @param smoothed: the smoothing variant of the min and max averages, True for the default one or False for none
+    @param date_range: (start, end) dates to plot, or None for the latest weeks
+    """
+    key = homepage_cache_key(info, location, smoothed, prefix='plot-data', date_range=date_range)
+    with stage('cache_get'):
+        data = cache.get(key)
+    cache_lookup('plot_data', data is not None)
+    if data is None:
+        plot_df = get_plot_df(smoothed, location, date_range)
+        with stage('to_columns'):
+            dates = pd.to_datetime(plot_df.pop('date')).to_numpy(dtype='datetime64[D]')
+            data = {'date': dates.astype(np.int64).tolist()}
+            if 'width' in plot_df:
+                data['width'] = plot_df.pop('width').astype(int).tolist()
+            for col in plot_df:
+                values = plot_df[col].astype(float).round(2)
+                data[col] = values.astype(object).where(values.notna(), None).tolist()
+        cache.set(key, data, settings.WEATHER_PLOT_CACHE_TIMEOUT)
+    return data
@@ -0,0 +1,137 @@
+"""
+Static pre-render mode (WEATHER_PRERENDER_DIR): the homepage of every location and its plot data are rendered to
+files whenever the weather tables change, and served by WhiteNoise (see middleware.prerender_middleware) without
+running the views. Each render is a directory named after its content, published by atomically replacing the
+manifest, so files are never rewritten while they may be served. The plot data files have content-hashed names
+and are cached forever by browsers; the pages are revalidated after WHITENOISE_MAX_AGE seconds.
+"""
+from pathlib import Path
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.template.loader import render_to_string
+
+from weather.models import Info, Location
+from weather.plot_cache import get_plot_data, render_homepage_context
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+KEPT_RENDERS = 3  # published renders kept, so pages cached by browsers still find their plot data
+IMMUTABLE_FILE = re.compile(r'/plot-data\.[0-9a-f]{12}\.json$')  # urls of the content-hashed plot data files
+
+_rendering = threading.Lock()
+
+
+def prerender(directory=None):
+    """
+    Renders the homepage (default smoothing, latest weeks) and plot data of every location, and publishes them as
+    the current render. The render of the default location is also the site root page. A location failing to render
+    is left out of the render, and served by the dynamic views.
+    @param directory: directory of the renders (defaults to settings.WEATHER_PRERENDER_DIR)
+    @return: the published manifest
+    """
+    directory = Path(directory or settings.WEATHER_PRERENDER_DIR)
+    info = Info.objects.get(pk=1)
+    files = {}
+    for location in Location.objects.order_by('slug'):
+        try:
+            data = json.dumps(get_plot_data(info, location, True), separators=(',', ':')).encode('utf-8')
+            data_name = f'{location.slug}/plot-data.{hashlib.sha256(data).hexdigest()[:12]}.json'
+            context = render_homepage_context(location, True, data_url=f'/{data_name}')
+            page = render_to_string('weather/base.html', context).encode('utf-8')
+        except Exception:
+            # left to the dynamic views, without holding back the other locations
+            logger.exception(f"Prerendering {location.slug} failed")
+            continue
+        files[data_name] = data
+        files[f'{location.slug}/index.html'] = page
+        if location.slug == settings.WEATHER_DEFAULT_LOCATION:
+            files['index.html'] = page
+    digest = hashlib.sha256()
+    for name, content in sorted(files.items()):
+        digest.update(name.encode('utf-8') + b'\0' + content)
+    render = f'{info.last_update:%Y%m%d}-{info.data_version}-{digest.hexdigest()[:12]}'
+    _write_render(directory, render, files)
+
+    previous = read_manifest(directory)
+    renders = [name for name in (previous or {}).get('renders', []) if name != render][-(KEPT_RENDERS - 1):]
+    manifest = {'last_update': info.last_update.isoformat(), 'data_version': info.data_version,
+                'renders': renders + [render]}
+    _replace(directory / MANIFEST, json.dumps(manifest).encode('utf-8'))
+    for path in directory.iterdir():
+        if path.is_dir() and path.name not in manifest['renders'] and not path.name.endswith('.tmp'):
+            shutil.rmtree(path, ignore_errors=True)
+    logger.info(f"Published the prerendered pages {render}")
+    return manifest
+
+
+def prerender_in_background():
+    """
+    Starts publishing a new render in a background thread, unless this process is already rendering
+    """
+    if not _rendering.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            prerender()
+        except Exception:
+            logger.exception("Prerendering the pages failed, the dynamic views keep serving them")
+        finally:
+            _rendering.release()
+            connection.close()  # the thread's own db connection
+
+    threading.Thread(target=run, name='weather-prerender', daemon=True).start()
+
+
+def read_manifest(directory):
+    """
+    Returns the manifest of the published renders (last_update and data_version of the weather tables they were
+    rendered from, and the names of the kept renders, the current one last), or None if nothing was published
+    """
+    try:
+        return json.loads((Path(directory) / MANIFEST).read_bytes())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_render(directory, render, files):
+    """
+    Writes the files of a render with their gzip variants into a temporary directory moved into place complete.
+    A render with the same name has the same content, and is left as is.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    if (directory / render).is_dir():
+        return
+    tmp_path = Path(tempfile.mkdtemp(dir=directory, suffix='.tmp'))
+    try:
+        for name, content in files.items():
+            path = tmp_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+            Path(f'{path}.gz').write_bytes(gzip.compress(content, mtime=0))
+        os.rename(tmp_path, directory / render)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)  # published by another process meanwhile
+        if not (directory / render).is_dir():
+            raise
+
+
+def _replace(path, content):
+    """
+    Atomically replaces the content of a file
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
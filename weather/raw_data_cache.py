@@ -0,0 +1,105 @@
+from datetime import datetime
+from pathlib import Path
+import os
+import tempfile
+import threading
+import time
+
+
+class RawDataCache:
+    """
+    On-disk cache of the raw CSV files downloaded from the Canada climate data API, keyed by station,
+    year, month and timeframe.
+    Files downloaded once their period (year, or month for hourly data) was over for more than grace seconds
+    no longer change upstream, so they are served from disk indefinitely. Other files, including those of a past
+    period downloaded while it was still open, are re-downloaded once older than max_age.
+    The modification time of a file is its download time, its access time its last use: the total size of the
+    cache is capped at max_bytes, evicting the least recently used files first.
+    """
+    HOURLY, DAILY = 1, 2  # API timeframe values
+
+    def __init__(self, directory, max_bytes=200 * 2 ** 20, max_age=3600, grace=3 * 86400):
+        """
+        @param directory: directory holding the cached files (created if missing)
+        @param max_bytes: maximum total size of the cached files
+        @param max_age: seconds after which a file that may still change is revalidated
+        @param grace: seconds after the end of a period during which its data may still be completed upstream
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.grace = grace
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, station, year, month, time_int):
+        """
+        Returns the cache file path for a station and period (month is only part of the key for hourly data)
+        """
+        if time_int == self.HOURLY:
+            return self.directory / f"{station}_{year}_{month:02d}_{time_int}.csv"
+        return self.directory / f"{station}_{year}_{time_int}.csv"
+
+    def is_final(self, year, month, time_int, downloaded):
+        """
+        Returns whether a file downloaded at a time holds the final data of its period, meaning the period was over
+        for more than the grace period when it was downloaded
+        @param downloaded: download time, as a POSIX timestamp
+        """
+        if time_int == self.HOURLY:
+            end = datetime(year + month // 12, month % 12 + 1, 1)
+        else:
+            end = datetime(year + 1, 1, 1)
+        return downloaded >= end.timestamp() + self.grace
+
+    def get(self, station, year, month, time_int):
+        """
+        Returns the cached raw CSV bytes, or None if the file is missing or due for revalidation
+        """
+        path = self.path(station, year, month, time_int)
+        try:
+            downloaded = path.stat().st_mtime_ns
+            if not self.is_final(year, month, time_int, downloaded / 1e9) and \
+                    time.time() - downloaded / 1e9 > self.max_age:
+                return None
+            os.utime(path, ns=(time.time_ns(), downloaded))  # last use, keeping the download time
+            return path.read_bytes()
+        except FileNotFoundError:  # missing, or evicted by another thread
+            return None
+
+    def put(self, station, year, month, time_int, data):
+        """
+        Atomically writes the downloaded data to the cache, evicts old files if over the size cap
+        @param data: raw CSV bytes
+        """
+        path = self.path(station, year, month, time_int)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """
+        Deletes the least recently used files until the cache is within max_bytes
+        @param keep: path that must not be evicted (typically the file just written)
+        """
+        with self._lock:
+            entries = []
+            for path in self.directory.glob('*.csv'):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
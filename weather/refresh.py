@@ -0,0 +1,115 @@
+from datetime import date, timedelta
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from weather.instrumentation import REFRESH_SECONDS, REFRESHES
+from weather.model_manager import update_weather_tables
+from weather.models import Info
+
+logger = logging.getLogger(__name__)
+
+
+def claim_refresh():
+    """
+    Takes the refresh lease on the Info row if the weather tables are stale and no other process holds
+    an unexpired lease. The conditional UPDATE is atomic, so only one process across all workers wins.
+    @return: whether the lease was taken
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.WEATHER_REFRESH_TIMEOUT)
+    claimed = Info.objects.filter(pk=1, last_update__lt=date.today()) \
+        .filter(Q(refresh_started__isnull=True) | Q(refresh_started__lt=expired)) \
+        .update(refresh_started=now)
+    return claimed == 1
+
+
+def lease_held(info):
+    """
+    Returns whether the Info record shows an unexpired refresh lease
+    """
+    expired = timezone.now() - timedelta(seconds=settings.WEATHER_REFRESH_TIMEOUT)
+    return info.refresh_started is not None and info.refresh_started >= expired
+
+
+def renew_lease():
+    """
+    Extends the refresh lease held by this process by another WEATHER_REFRESH_TIMEOUT seconds
+    @return: whether a lease was held
+    """
+    return Info.objects.filter(pk=1, refresh_started__isnull=False).update(refresh_started=timezone.now()) == 1
+
+
+def _keep_lease(stop):
+    """
+    Renews the refresh lease every third of WEATHER_REFRESH_TIMEOUT until stop is set, so the lease of a refresh
+    still running never expires: only the lease of a dead process is taken over
+    @param stop: threading.Event set when the refresh is over
+    """
+    try:
+        while not stop.wait(settings.WEATHER_REFRESH_TIMEOUT / 3):
+            renew_lease()
+    finally:
+        connection.close()  # the thread's own db connection
+
+
+def run_refresh(fetch=None):
+    """
+    Updates the weather tables if they are stale and no other process is already updating them
+    @param fetch: function fetching the weather of stations (see update_weather_tables)
+    @return: whether the tables were updated
+    """
+    return claim_refresh() and _refresh(fetch)
+
+
+def _refresh(fetch=None):
+    """
+    Updates the weather tables under a lease taken with claim_refresh, renewed while the update runs
+    @return: whether the tables were updated
+    """
+    start = time.perf_counter()
+    stop = threading.Event()
+    threading.Thread(target=_keep_lease, args=(stop,), name='weather-refresh-lease', daemon=True).start()
+    try:
+        update_weather_tables(fetch)
+    except Exception:
+        # Fallback: the previous data keeps being served. The lease is left to expire, so the next
+        # attempt waits WEATHER_REFRESH_TIMEOUT seconds instead of hammering a failing API.
+        logger.exception("Weather tables refresh failed, serving the previous data")
+        REFRESHES.inc(outcome='failure')
+        return False
+    finally:
+        stop.set()
+        REFRESH_SECONDS.observe(time.perf_counter() - start)
+    Info.objects.filter(pk=1).update(refresh_started=None)
+    REFRESHES.inc(outcome='success')
+    logger.info("DB Tables updated!")
+    return True
+
+
+def _refresh_in_thread():
+    try:
+        _refresh()
+    finally:
+        connection.close()  # the thread's own db connection
+
+
+def refresh_in_background():
+    """
+    Starts a background update of the weather tables if they were last updated before today and no other
+    process is updating them, without waiting for it: requests keep serving the previous day's data until
+    the update commits (stale-while-revalidate). A lease not renewed for WEATHER_REFRESH_TIMEOUT is considered
+    abandoned and may be taken over by another process.
+    @return: the Info record
+    """
+    info = Info.objects.get(pk=1)
+    # typically only true on the first server access of any given day. While the refresh runs, the lease is
+    # checked on the row already read, so requests don't queue up on the write lock the refresh holds.
+    if info.last_update < date.today() and not lease_held(info) and claim_refresh():
+        threading.Thread(target=_refresh_in_thread, name='weather-refresh', daemon=True).start()
+    return info
@@ -0,0 +1,80 @@
+from datetime import date
+import numpy as np
+import pandas as pd
+
+from weather.raw_data_cache import RawDataCache
+
+# Columns of the daily bulk data CSV of the Canada climate data API
+DAILY_CSV_COLUMNS = ['Longitude (x)', 'Latitude (y)', 'Station Name', 'Climate ID', 'Date/Time', 'Year', 'Month',
+                     'Day', 'Data Quality', 'Max Temp (\xb0C)', 'Max Temp Flag', 'Min Temp (\xb0C)', 'Min Temp Flag',
+                     'Mean Temp (\xb0C)', 'Mean Temp Flag', 'Heat Deg Days (\xb0C)', 'Heat Deg Days Flag',
+                     'Cool Deg Days (\xb0C)', 'Cool Deg Days Flag', 'Total Rain (mm)', 'Total Rain Flag',
+                     'Total Snow (cm)', 'Total Snow Flag', 'Total Precip (mm)', 'Total Precip Flag',
+                     'Snow on Grnd (cm)', 'Snow on Grnd Flag', 'Dir of Max Gust (10s deg)', 'Dir of Max Gust Flag',
+                     'Spd of Max Gust (km/h)', 'Spd of Max Gust Flag']
+
+
+# Columns of the hourly bulk data CSV
+HOURLY_CSV_COLUMNS = ['Longitude (x)', 'Latitude (y)', 'Station Name', 'Climate ID', 'Date/Time (LST)', 'Year',
+                      'Month', 'Day', 'Time (LST)', 'Temp (\xb0C)', 'Temp Flag', 'Dew Point Temp (\xb0C)',
+                      'Dew Point Temp Flag', 'Rel Hum (%)', 'Rel Hum Flag', 'Precip. Amount (mm)',
+                      'Precip. Amount Flag', 'Wind Dir (10s deg)', 'Wind Dir Flag', 'Wind Spd (km/h)', 'Wind Spd Flag',
+                      'Visibility (km)', 'Visibility Flag', 'Stn Press (kPa)', 'Stn Press Flag', 'Hmdx', 'Hmdx Flag',
+                      'Wind Chill', 'Wind Chill Flag', 'Weather']
+
+
+EMPTY_FIELDS = ','.join(['""'] * (len(DAILY_CSV_COLUMNS) - 15))  # columns after the temperatures
+HOURLY_EMPTY_FIELDS = ','.join(['""'] * (len(HOURLY_CSV_COLUMNS) - 11))
+
+
+def synthetic_daily_csv(station, year, blank_rate=0.02):
+    """
+    Returns a realistic daily bulk data CSV (as bytes) for a station-year: seasonal temperatures with noise,
+    a few missing days flagged 'M', and blank temperatures for days after yesterday.
+    The data is deterministic for a given station and year.
+    """
+    rng = np.random.default_rng(station * 10000 + year)
+    days = pd.date_range(f'{year}-01-01', f'{year}-12-31')
+    season = -np.cos(2 * np.pi * (days.dayofyear.to_numpy() - 15) / 365.25)
+    max_temp = (10 + 14 * season + rng.normal(0, 6, len(days))).round(1)
+    min_temp = (max_temp - np.abs(rng.normal(11, 3, len(days)))).round(1)
+    blank = (rng.random(len(days)) < blank_rate) | (days.date >= date.today())
+    rows = ['"' + '","'.join(DAILY_CSV_COLUMNS) + '"']
+    for d, high, low, missing in zip(days, max_temp, min_temp, blank):
+        temps = '"","M","","M","",""' if missing else f'"{high}","","{low}","","{(high + low) / 2:.1f}",""'
+        rows.append(f'"-114.01","51.11","STATION {station}","{station}","{d:%Y-%m-%d}","{d.year}",'
+                    f'"{d.month:02d}","{d.day:02d}","",{temps},{EMPTY_FIELDS}')
+    return ('\ufeff' + '\n'.join(rows) + '\n').encode('utf-8')
+
+
+def synthetic_hourly_csv(station, year, month, blank_rate=0.02):
+    """
+    Returns a realistic hourly bulk data CSV (as bytes) for a station-month: seasonal temperatures with a daily
+    cycle and noise, a few missing hours, and blank temperatures for the hours after the current one.
+    The data is deterministic for a given station and month.
+    """
+    rng = np.random.default_rng((station * 10000 + year) * 100 + month)
+    start = pd.Timestamp(year, month, 1)
+    hours = pd.date_range(start, periods=start.days_in_month * 24, freq='H')
+    season = -np.cos(2 * np.pi * (hours.dayofyear.to_numpy() - 15) / 365.25)
+    daily_cycle = -np.cos(2 * np.pi * (hours.hour.to_numpy() - 3) / 24)
+    temp = (4.5 + 14 * season + 5.5 * daily_cycle + rng.normal(0, 2, len(hours))).round(1)
+    blank = (rng.random(len(hours)) < blank_rate) | (hours > pd.Timestamp.now())
+    rows = ['"' + '","'.join(HOURLY_CSV_COLUMNS) + '"']
+    for t, value, missing in zip(hours, temp, blank):
+        temp_fields = '"","M"' if missing else f'"{value}",""'
+        rows.append(f'"-114.01","51.11","STATION {station}","{station}","{t:%Y-%m-%d %H:%M}","{t.year}",'
+                    f'"{t.month:02d}","{t.day:02d}","{t:%H:%M}",{temp_fields},{HOURLY_EMPTY_FIELDS}')
+    return ('\ufeff' + '\n'.join(rows) + '\n').encode('utf-8')
+
+
+def fill_cache(cache, stations):
+    """
+    Writes synthetic daily CSVs for the station-years to a RawDataCache, so a WeatherDataRetriever using the
+    cache reads them instead of calling the API
+    @param stations: station dicts with station_id, start_yr and end_yr
+    """
+    for station in stations:
+        station_id = station['station_id']
+        for year in range(station['start_yr'], station['end_yr'] + 1):
+            cache.put(station_id, year, 1, RawDataCache.DAILY, synthetic_daily_csv(station_id, year))
@@ -0,0 +1,24 @@
+"""
+Tests of the weather app, one module per module tested
+"""
+from asgiref.sync import sync_to_async
+import numpy as np
+import pandas as pd
+
+
+def daily_weather(start, end, seed=0):
+    """
+    Returns random daily min and max temperatures (rounded as the API's) indexed by date
+    """
+    dates = pd.date_range(start, end, name='date')
+    rng = np.random.default_rng(seed)
+    max_temp = rng.normal(8, 10, len(dates)).round(1)
+    return pd.DataFrame({'min_temp': (max_temp - rng.uniform(2, 15, len(dates))).round(1), 'max_temp': max_temp},
+                        index=dates)
+
+
+def in_test_thread(func):
+    """
+    Replaces views.in_thread in the tests: the views then run on the test's thread, in its transaction
+    """
+    return sync_to_async(func, thread_sensitive=True)
@@ -0,0 +1,44 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from django.test import TestCase
+
+from weather.bulk_load import upsert_df
+from weather.models import DailyWeather, Location
+from weather.tests import daily_weather
+
+
+class UpsertTests(TestCase):
+
+    def test_upsert(self):
+        location = Location.objects.get(slug='yyc')
+        daily_df = daily_weather('2020-01-01', '2020-01-03').rename_axis('date').reset_index() \
+            .assign(location_id=location.pk, day_of_year=[0, 1, 2])
+        self.assertEqual(upsert_df(DailyWeather, daily_df, unique_fields=['location_id', 'date']), 3)
+        self.assertEqual(upsert_df(DailyWeather, daily_df, unique_fields=['location_id', 'date']), 0)
+        daily_df.loc[1, 'max_temp'] = 30.0
+        new_day = daily_df.tail(1).assign(date=pd.Timestamp('2020-01-04'), day_of_year=3)
+        self.assertEqual(upsert_df(DailyWeather, pd.concat([daily_df, new_day]),
+                                   unique_fields=['location_id', 'date']), 2)
+        self.assertEqual(DailyWeather.objects.count(), 4)
+        self.assertEqual(DailyWeather.objects.get(date=date(2020, 1, 2)).max_temp, 30.0)
+
+    def test_blanks_and_update_fields(self):
+        location = Location.objects.get(slug='yyc')
+        daily_df = pd.DataFrame({'location_id': location.pk, 'date': pd.to_datetime(['2020-01-01', '2020-01-02']),
+                                 'day_of_year': [0, 1], 'min_temp': [np.nan, -5.0], 'max_temp': [1.0, np.nan]})
+        upsert_df(DailyWeather, daily_df, unique_fields=['location_id', 'date'])
+        self.assertEqual(list(DailyWeather.objects.order_by('date').values_list('min_temp', 'max_temp')),
+                         [(None, 1.0), (-5.0, None)])
+        self.assertEqual(upsert_df(DailyWeather, daily_df.assign(min_temp=-1.0, max_temp=2.0),
+                                   unique_fields=['location_id', 'date'], update_fields=['max_temp']), 2)
+        self.assertEqual(list(DailyWeather.objects.order_by('date').values_list('min_temp', 'max_temp')),
+                         [(None, 2.0), (-5.0, 2.0)])
+
+    def test_batches(self):
+        location = Location.objects.get(slug='yyc')
+        daily_df = daily_weather('2000-01-01', '2009-12-31').rename_axis('date').reset_index() \
+            .assign(location_id=location.pk, day_of_year=0)
+        self.assertEqual(upsert_df(DailyWeather, daily_df, unique_fields=['location_id', 'date']), len(daily_df))
+        self.assertEqual(DailyWeather.objects.count(), len(daily_df))
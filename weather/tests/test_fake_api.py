@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+from datetime import date
+from unittest import mock
+from urllib.request import urlopen
+import threading
+
+from django.test import SimpleTestCase
+
+from weather.fake_api import fake_api_url, make_fake_api_server
+from weather.weather_data import WEATHER_QUERY
+
+
+@contextmanager
+def on_day(day):
+    """
+    Sets the current date of the fake API
+    """
+    class Day(date):
+        @classmethod
+        def today(cls):
+            return day
+
+    with mock.patch('weather.fake_api.date', Day), mock.patch('weather.synthetic_data.date', Day):
+        yield
+
+
+class FakeClimateAPITests(SimpleTestCase):
+    def setUp(self):
+        server = make_fake_api_server()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = fake_api_url(server) + WEATHER_QUERY
+
+    def blank_days(self, station, year):
+        """
+        Returns the dates of the blank days of a daily CSV served by the fake API
+        """
+        with urlopen(self.url.format(station=station, year=year, month=1, time_int=2)) as response:
+            rows = response.read().decode('utf-8-sig').splitlines()[1:]
+        return {date.fromisoformat(row.split(',')[4].strip('"')) for row in rows if '"M"' in row}
+
+    def test_day_rollover(self):
+        with on_day(date(2020, 3, 1)):
+            march = self.blank_days(1, 2020)
+        with on_day(date(2020, 6, 1)):
+            june = self.blank_days(1, 2020)
+        self.assertTrue(all(day >= date(2020, 3, 1) for day in march - june))
+        self.assertGreater(len(march - june), 80)
+        self.assertFalse(any(day >= date(2020, 6, 1) for day in march ^ june))
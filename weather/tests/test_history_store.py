@@ -0,0 +1,31 @@
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from weather.history_store import HistoryStore
+from weather.tests import daily_weather
+
+
+class HistoryStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = HistoryStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_last_row_wins(self):
+        weather_df = daily_weather('2020-01-01', '2020-01-05')
+        self.assertEqual(self.store.append(1, 2020, weather_df), 5)
+        self.assertEqual(self.store.append(1, 2020, weather_df), 0)  # unchanged rows are not appended
+        changed = weather_df.copy()
+        changed.loc['2020-01-02', 'max_temp'] += 1.5
+        changed.loc['2020-01-03', 'min_temp'] = np.nan
+        self.assertEqual(self.store.append(1, 2020, changed), 2)
+        stored = self.store.read(1, 2020)
+        self.assertEqual(list(stored.index.day), [1, 2, 4, 5])
+        self.assertEqual(stored.loc['2020-01-02', 'max_temp'], np.float32(changed.loc['2020-01-02', 'max_temp']))
+        self.assertEqual(len(self.store.read(1, 2020, drop_blanks=False)), 5)
+        self.assertIsNone(self.store.read(1, 2021))
@@ -0,0 +1,49 @@
+from django.test import SimpleTestCase
+
+from weather import instrumentation
+
+
+class InstrumentationTests(SimpleTestCase):
+    def setUp(self):
+        instrumentation.configure(True)
+        self.addCleanup(instrumentation.configure, False)
+        registry = list(instrumentation.REGISTRY)
+
+        def unregister_test_metrics():
+            instrumentation.REGISTRY[:] = registry
+        self.addCleanup(unregister_test_metrics)
+
+    def test_counter(self):
+        counter = instrumentation.Counter('test_total', "Test counter.", ['result'])
+        counter.inc(result='hit')
+        counter.inc(2, result='miss')
+        counter.inc(result='hit')
+        self.assertEqual(counter.render(), '# HELP test_total Test counter.\n# TYPE test_total counter\n'
+                                           'test_total{result="hit"} 2\ntest_total{result="miss"} 2')
+
+    def test_histogram(self):
+        histogram = instrumentation.Histogram('test_seconds', "Test histogram.", buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.render().split('\n')[2:],
+                         ['test_seconds_bucket{le="0.1"} 2', 'test_seconds_bucket{le="1"} 3',
+                          'test_seconds_bucket{le="+Inf"} 4', 'test_seconds_sum 3.65', 'test_seconds_count 4'])
+
+    def test_disabled(self):
+        instrumentation.configure(False)
+        counter = instrumentation.Counter('test_total', "Test counter.")
+        counter.inc()
+        self.assertIn('test_total 0', counter.render())
+        self.assertIs(instrumentation.stage('fetch'), instrumentation.stage('parse'))  # the shared no-op
+
+    def test_request_stages(self):
+        with instrumentation.stage('outside'):  # not part of any request
+            pass
+        token = instrumentation.start_request()
+        with instrumentation.stage('fetch'):
+            with instrumentation.stage('parse'):
+                pass
+        timings = instrumentation.finish_request(token)
+        self.assertEqual([name for name, _ in timings], ['parse', 'fetch'])
+        header = instrumentation.server_timing([('fetch', 0.0123)], total=0.05)
+        self.assertEqual(header, 'fetch;dur=12.3, total;dur=50.0')
@@ -0,0 +1,157 @@
+from pathlib import Path
+from unittest import mock
+import asyncio
+import tempfile
+import threading
+
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path
+
+from weather import middleware, model_manager, prerender, views
+from weather.middleware import PrerenderedFiles
+from weather.models import Info
+from weather.tests import in_test_thread
+
+REQUESTS = 5  # concurrent requests of the concurrency tests, no more than the worker threads of asgiref on one cpu
+TIMEOUT = 5  # seconds a request waits for the others to be in flight
+
+
+class InFlight:
+    """
+    Counts the requests in flight in waiting_view, each waiting for all the REQUESTS to be in flight
+    """
+    def __init__(self):
+        self.active = self.peak = 0
+        self.all_in = None
+
+    async def wait(self):
+        if self.all_in is None:
+            self.all_in = asyncio.Event()  # created in the event loop of the test
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        if self.active == REQUESTS:
+            self.all_in.set()
+        try:
+            await asyncio.wait_for(self.all_in.wait(), TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.active -= 1
+
+
+in_flight = InFlight()
+
+
+async def waiting_view(request):
+    await in_flight.wait()
+    return HttpResponse('ok')
+
+
+urlpatterns = [path('wait/', waiting_view)]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class ConcurrencyTests(SimpleTestCase):
+    """ Under ASGI, concurrent requests to the async views must overlap through the whole middleware chain: a
+    sync-only middleware runs them one at a time in asgiref's thread for sync code."""
+
+    def setUp(self):
+        global in_flight
+        in_flight = InFlight()
+
+    async def get_concurrently(self):
+        responses = await asyncio.gather(*(self.async_client.get('/wait/') for _ in range(REQUESTS)))
+        self.assertEqual([response.status_code for response in responses], [200] * REQUESTS)
+
+    async def test_concurrent_requests_overlap(self):
+        with self.settings(WEATHER_PRERENDER_DIR=''):
+            await self.get_concurrently()
+        self.assertEqual(in_flight.peak, REQUESTS)
+
+    async def test_prerender_checks_overlap(self):
+        barrier = threading.Barrier(REQUESTS, timeout=TIMEOUT)
+
+        def check(files):
+            barrier.wait()  # the query of the weather tables, in a worker thread, only passes if all overlap
+
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(WEATHER_PRERENDER_DIR=directory, WEATHER_PRERENDER_CHECK=0), \
+                mock.patch.object(PrerenderedFiles, 'check', check):
+            await self.get_concurrently()
+        self.assertEqual(in_flight.peak, REQUESTS)
+
+
+@override_settings(WEATHER_PRERENDER_CHECK=0,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PrerenderMiddlewareTests(TestCase):
+    """ The pages of the published render are served while it is up to date with the weather tables, and the
+    content-hashed plot data files of the kept renders whether it is or not."""
+
+    def setUp(self):
+        model_manager.set_info()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        prerender_dir = self.settings(WEATHER_PRERENDER_DIR=directory.name)
+        prerender_dir.enable()
+        self.addCleanup(prerender_dir.disable)
+        patchers = [
+            mock.patch.object(prerender, 'get_plot_data', side_effect=lambda info, location, smoothed: {
+                'version': info.data_version}),
+            mock.patch.object(prerender, 'render_homepage_context', side_effect=lambda location, smoothed, data_url: {
+                'location': location, 'script': data_url}),
+            mock.patch.object(middleware, 'refresh_in_background', side_effect=lambda: Info.objects.get(pk=1)),
+            mock.patch.object(middleware, 'prerender_in_background'),
+            mock.patch.object(views, 'in_thread', in_test_thread),
+            mock.patch.object(views, 'get_homepage_context', return_value={})]
+        mocks = [patcher.start() for patcher in patchers]
+        self.prerender_in_background, self.get_homepage_context = mocks[-3], mocks[-1]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.data_url = self.publish()
+
+    def publish(self):
+        """
+        Publishes a render, returning the url of its plot data
+        """
+        data_path, = (self.directory / prerender.prerender()['renders'][-1] / 'yyc').glob('plot-data.*.json')
+        return f'/yyc/{data_path.name}'
+
+    def assert_served(self, response, path):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), path.read_bytes())
+        response.close()
+
+    def current_file(self, name):
+        return self.directory / prerender.read_manifest(self.directory)['renders'][-1] / name
+
+    def test_served_while_up_to_date(self):
+        self.assert_served(self.client.get('/yyc/'), self.current_file('yyc/index.html'))
+        response = self.client.get(self.data_url)
+        self.assert_served(response, self.current_file(self.data_url[1:]))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.get_homepage_context.assert_not_called()
+        self.prerender_in_background.assert_not_called()
+
+    def test_pages_left_to_views_while_stale(self):
+        model_manager.bump_data_version()
+        response = self.client.get('/yyc/')
+        self.assertFalse(response.streaming)
+        self.get_homepage_context.assert_called_once()
+        self.prerender_in_background.assert_called()
+        self.assert_served(self.client.get(self.data_url), self.current_file(self.data_url[1:]))
+
+    def test_previous_plot_data_kept(self):
+        model_manager.bump_data_version()
+        previous_data = self.current_file(self.data_url[1:])
+        data_url = self.publish()
+        self.assertNotEqual(data_url, self.data_url)
+        self.assert_served(self.client.get('/yyc/'), self.current_file('yyc/index.html'))
+        self.assert_served(self.client.get(self.data_url), previous_data)
+        self.assert_served(self.client.get(data_url), self.current_file(data_url[1:]))
+
+    def test_query_string_left_to_views(self):
+        self.assertFalse(self.client.get('/yyc/?smoothed=0').streaming)
+        self.get_homepage_context.assert_called_once()
@@ -0,0 +1,70 @@
+from datetime import date
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+from weather.weather_data import day_of_year
+
+
+class MigrationTestCase(TransactionTestCase):
+    """ Migrates the test database back to a migration, then forward again to the latest one"""
+    serialized_rollback = True  # restores the rows created by the migrations for the other tests
+
+    def migrate(self, name):
+        """
+        Migrates the weather app to a migration
+        @return: the historical models at that migration
+        """
+        executor = MigrationExecutor(connection)
+        target = [('weather', name)]
+        executor.migrate(target)
+        return MigrationExecutor(connection).loader.project_state(target).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('weather'))
+
+
+class LocationMigrationTests(MigrationTestCase):
+    def test_rows_kept_as_yyc(self):
+        apps = self.migrate('0003_info_refresh_started')
+        apps.get_model('weather', 'CurrentWx').objects.create(date=date(2020, 1, 1), month_day='01-01',
+                                                              min_temp=-10.5, max_temp=None)
+        apps.get_model('weather', 'WxStats').objects.create(month_day='02-29', last_date=date(2019, 2, 28),
+                                                            stats_count=30, record_min_temp=-40.0, avg_min_temp=-12.0,
+                                                            avg_max_temp=-1.0, record_max_temp=15.0)
+
+        apps = self.migrate('0004_location')
+        self.assertEqual(list(apps.get_model('weather', 'CurrentWx').objects.values_list(
+            'location__slug', 'date', 'month_day', 'min_temp', 'max_temp')),
+            [('yyc', date(2020, 1, 1), '01-01', -10.5, None)])
+        self.assertEqual(list(apps.get_model('weather', 'WxStats').objects.values_list(
+            'location__slug', 'month_day', 'last_date', 'stats_count', 'avg_max_temp')),
+            [('yyc', '02-29', date(2019, 2, 28), 30, -1.0)])
+
+
+class DayOfYearMigrationTests(MigrationTestCase):
+    DATES = [date(2019, 1, 1), date(2019, 2, 28), date(2019, 3, 1), date(2019, 12, 31), date(2020, 2, 28),
+             date(2020, 2, 29), date(2020, 3, 1), date(2020, 7, 15), date(2020, 12, 31)]
+
+    def test_backfill(self):
+        apps = self.migrate('0010_dailyweather')
+        location = apps.get_model('weather', 'Location').objects.get(slug='yyc')
+        for day in self.DATES:
+            apps.get_model('weather', 'DailyWeather').objects.create(location=location, date=day, min_temp=-1.0,
+                                                                     max_temp=1.0)
+            apps.get_model('weather', 'CurrentWx').objects.create(location=location, date=day,
+                                                                  month_day=f'{day:%m-%d}', min_temp=-1.0, max_temp=1.0)
+        for month_day in sorted({f'{day:%m-%d}' for day in self.DATES}):
+            apps.get_model('weather', 'WxStats').objects.create(
+                location=location, month_day=month_day, last_date=date(2019, 12, 31), stats_count=1,
+                record_min_temp=-1.0, avg_min_temp=-1.0, avg_max_temp=1.0, record_max_temp=1.0)
+
+        apps = self.migrate('0011_day_of_year')
+        expected = dict(zip(self.DATES, day_of_year(self.DATES).tolist()))
+        for model in ('DailyWeather', 'CurrentWx'):
+            self.assertEqual(dict(apps.get_model('weather', model).objects.values_list('date', 'day_of_year')),
+                             expected, model)
+        self.assertEqual(dict(apps.get_model('weather', 'WxStats').objects.values_list('month_day', 'day_of_year')),
+                         {f'{day:%m-%d}': doy for day, doy in expected.items()})
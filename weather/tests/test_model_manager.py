@@ -0,0 +1,275 @@
+from datetime import date, timedelta
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+
+from weather import model_manager
+from weather.models import CurrentWx, Info, Location, SmoothedAverages, WxStats
+from weather.tests import daily_weather
+from weather.weather_data import DailyStats, day_of_year
+
+
+@override_settings(WEATHER_HISTORY_DIR='', WEATHER_CACHE_DIR='', WEATHER_HOURLY_INGEST=False)
+class UpdateWeatherTablesTests(TestCase):
+    """ The daily update folds the fetched recent days into the stats, each day once, and corrections of the
+    days already counted by their difference."""
+
+    def setUp(self):
+        model_manager.set_info()
+        self.location = Location.objects.get(slug='yyc')
+        stats_df = DailyStats.from_weather_df(daily_weather('2000-01-01', '2019-12-31')).to_df()
+        model_manager.write_snapshot(WxStats, stats_df.assign(location_id=self.location.pk), [self.location],
+                                     'day_of_year', write_derived=model_manager.set_smoothed_averages)
+        yesterday = date.today() - timedelta(days=1)
+        self.recent_df = daily_weather(yesterday - timedelta(days=70), yesterday, seed=1)
+
+    def fetch(self, stations):
+        return {station['location_id']: [self.recent_df] for station in stations}
+
+    def stats(self):
+        return model_manager.table_to_df(WxStats, self.location).set_index('day_of_year')
+
+    def test_days_counted_once(self):
+        before = self.stats()
+        model_manager.update_weather_tables(self.fetch)
+        counted = self.stats()
+        days = day_of_year(model_manager.live_rows(CurrentWx, self.location).values_list('date', flat=True))
+        self.assertEqual(len(days), 56)
+        np.testing.assert_array_equal(counted['stats_count'] - before['stats_count'],
+                                      np.isin(counted.index, days).astype(int))
+        model_manager.update_weather_tables(self.fetch)
+        pd.testing.assert_frame_equal(self.stats()[DailyStats.SUM_COLUMNS], counted[DailyStats.SUM_COLUMNS])
+
+    def test_correction(self):
+        model_manager.update_weather_tables(self.fetch)
+        before = self.stats()
+        corrected = date.today() - timedelta(days=4)
+        self.recent_df.loc[str(corrected), 'max_temp'] += 1.5
+        model_manager.update_weather_tables(self.fetch)
+        after = self.stats()
+        doy = day_of_year([corrected])[0]
+        self.assertEqual(after.loc[doy, 'stats_count'], before.loc[doy, 'stats_count'])
+        self.assertAlmostEqual(after.loc[doy, 'sum_max_temp'] - before.loc[doy, 'sum_max_temp'], 1.5, places=9)
+        pd.testing.assert_frame_equal(after.drop(doy)[DailyStats.SUM_COLUMNS], before.drop(doy)[DailyStats.SUM_COLUMNS])
+
+    def test_overlapping_updates(self):
+        model_manager.update_weather_tables(self.fetch)
+        before = self.stats()
+        corrected = date.today() - timedelta(days=4)
+        self.recent_df.loc[str(corrected), 'max_temp'] += 1.5
+
+        def fetch_during_another_update(stations):
+            model_manager.update_weather_tables(self.fetch)  # commits the correction while this update fetches
+            return self.fetch(stations)
+
+        model_manager.update_weather_tables(fetch_during_another_update)
+        after = self.stats()
+        doy = day_of_year([corrected])[0]
+        self.assertEqual(after.loc[doy, 'stats_count'], before.loc[doy, 'stats_count'])
+        self.assertAlmostEqual(after.loc[doy, 'sum_max_temp'] - before.loc[doy, 'sum_max_temp'], 1.5, places=9)
+
+    def hourly_ingest(self):
+        """
+        Patches the retriever to return the recent days as daily data (with today's blank row, as the API), and the
+        hourly data to return them 2 degrees lower, as hourly samples understate the daily extremes
+        """
+        daily_df = self.recent_df.reindex(pd.date_range(self.recent_df.index[0], date.today(), name='date'))
+        hourly_df = pd.concat([self.recent_df, pd.DataFrame({'min_temp': [-1.0], 'max_temp': [5.0]},
+                                                            index=pd.DatetimeIndex([date.today()], name='date'))]) - 2
+        retriever = mock.Mock()
+        retriever.iter_weather_data.side_effect = lambda stations, drop_blanks: [
+            (station, station['start_yr'], daily_df) for station in stations]
+        return self.settings(WEATHER_HOURLY_INGEST=True), \
+            mock.patch.object(model_manager, 'get_retriever', return_value=retriever), \
+            mock.patch.object(model_manager, 'fetch_hourly_weather', side_effect=lambda stations: {
+                station['location_id']: [hourly_df[str(station['since']):]] for station in stations})
+
+    def test_hourly_ingest_leaves_stats_on_daily_data(self):
+        model_manager.update_weather_tables(self.fetch)
+        before = self.stats()
+        settings_override, retriever_patch, hourly_patch = self.hourly_ingest()
+        with settings_override, retriever_patch, hourly_patch:
+            model_manager.update_weather_tables()
+        pd.testing.assert_frame_equal(self.stats()[DailyStats.SUM_COLUMNS + ['stats_count']],
+                                      before[DailyStats.SUM_COLUMNS + ['stats_count']])
+
+    def test_hourly_ingest_keeps_today_so_far(self):
+        settings_override, retriever_patch, hourly_patch = self.hourly_ingest()
+        with settings_override, retriever_patch, hourly_patch:
+            model_manager.update_weather_tables()
+            self.assertEqual(model_manager.update_today_weather(), 1)
+            model_manager.update_weather_tables()
+        current_wx = model_manager.stored_weather(self.location.pk)
+        self.assertEqual(current_wx.index[-1], pd.Timestamp(date.today()))
+        self.assertEqual(list(current_wx.iloc[-1]), [-3.0, 3.0])
+        pd.testing.assert_frame_equal(current_wx.iloc[:-1], self.recent_df.loc[current_wx.index[0]:],
+                                      check_dtype=False, check_freq=False)
+
+
+class InitializeDbTests(TestCase):
+    def test_initializes_new_locations(self):
+        yyc = Location.objects.get(slug='yyc')
+        stats_df = DailyStats.from_weather_df(daily_weather('2000-01-01', '2001-12-31')).to_df()
+        model_manager.write_snapshot(WxStats, stats_df.assign(location_id=yyc.pk), [yyc], 'day_of_year')
+        yeg = Location.objects.create(slug='yeg', name='Edmonton, AB', station_name='YEG')
+        with mock.patch.object(model_manager, 'set_stats') as set_stats, \
+                mock.patch.object(model_manager, 'set_current_weather') as set_current_weather:
+            model_manager.initialize_db()
+        self.assertEqual(list(set_stats.call_args[1]['locations']), [yeg])
+        self.assertEqual(list(set_current_weather.call_args[1]['locations']), [yeg])
+        self.assertTrue(Info.objects.exists())
+
+
+class SmoothedAveragesTests(TestCase):
+    def setUp(self):
+        self.location = Location.objects.get(slug='yyc')
+        stats_df = DailyStats.from_weather_df(daily_weather('2000-01-01', '2009-12-31')).to_df()
+        model_manager.write_snapshot(WxStats, stats_df.assign(location_id=self.location.pk), [self.location],
+                                     'day_of_year', write_derived=model_manager.set_smoothed_averages)
+        self.wx_stats = model_manager.table_to_df(WxStats, self.location)
+
+    def test_variants_stored_with_stats(self):
+        self.assertEqual(sorted(model_manager.live_rows(SmoothedAverages, self.location)
+                                .values_list('variant', flat=True)), sorted(settings.WEATHER_SMOOTHING))
+        for variant, (window, order) in settings.WEATHER_SMOOTHING.items():
+            with mock.patch.object(model_manager, 'smoothed_averages') as smoothed_averages:
+                stored = model_manager.get_smoothed_averages(self.location, variant)
+            smoothed_averages.assert_not_called()
+            for stored_averages, averages in zip(stored, model_manager.smoothed_averages(self.wx_stats, window, order)):
+                np.testing.assert_array_equal(stored_averages, averages)
+
+    def test_variant_changed_in_settings(self):
+        with self.settings(WEATHER_SMOOTHING={'savgol31': (21, 3)}):
+            averages = model_manager.get_smoothed_averages(self.location, 'savgol31')
+        expected = model_manager.smoothed_averages(self.wx_stats, 21, 3)
+        np.testing.assert_array_equal(averages[1], expected[1])
+
+    def test_smoothing_changes_averages(self):
+        raw = self.wx_stats.set_index('day_of_year')['avg_max_temp'].to_numpy()
+        smoothed = model_manager.get_smoothed_averages(self.location, 'savgol31')[1]
+        self.assertEqual(len(smoothed), len(raw))
+        self.assertLess(np.abs(np.diff(smoothed)).mean(), np.abs(np.diff(raw)).mean() / 2)
+
+
+class QuerysetToDfTests(TestCase):
+    def setUp(self):
+        self.location = Location.objects.get(slug='yyc')
+        CurrentWx.objects.bulk_create([
+            CurrentWx(location=self.location, snapshot=0, date=date(2020, 1, 2), day_of_year=1, month_day='01-02',
+                      min_temp=None, max_temp=-1.5),
+            CurrentWx(location=self.location, snapshot=0, date=date(2020, 1, 1), day_of_year=0, month_day='01-01',
+                      min_temp=-12.0, max_temp=-2.0),
+            CurrentWx(location=self.location, snapshot=1, date=date(2020, 1, 3), day_of_year=2, month_day='01-03',
+                      min_temp=-11.0, max_temp=-3.0)])  # not live
+
+    def test_columns(self):
+        weather_df = model_manager.queryset_to_df(CurrentWx.objects.order_by('date'),
+                                                  ['date', 'location_id', 'min_temp', 'max_temp'])
+        self.assertEqual(list(weather_df.columns), ['date', 'location_id', 'min_temp', 'max_temp'])
+        self.assertEqual(list(weather_df['date']), [date(2020, 1, 1), date(2020, 1, 2), date(2020, 1, 3)])
+        self.assertEqual(list(weather_df['location_id']), [self.location.pk] * 3)
+        self.assertEqual(weather_df['min_temp'].dtype, np.float64)
+        np.testing.assert_array_equal(weather_df['min_temp'], [-12.0, np.nan, -11.0])
+
+    def test_empty(self):
+        weather_df = model_manager.queryset_to_df(CurrentWx.objects.none(), ['date', 'max_temp'])
+        self.assertTrue(weather_df.empty)
+        self.assertEqual(list(weather_df.columns), ['date', 'max_temp'])
+        self.assertEqual(weather_df['max_temp'].dtype, np.float64)
+
+    def test_table_to_df(self):
+        weather_df = model_manager.table_to_df(CurrentWx, self.location, fields=['day_of_year', 'max_temp'])
+        self.assertEqual(weather_df.to_dict('list'), {'day_of_year': [0, 1], 'max_temp': [-2.0, -1.5]})
+
+
+class SnapshotTests(TestCase):
+
+    def setUp(self):
+        model_manager.set_info()
+        self.location = Location.objects.get(slug='yyc')
+
+    def current_wx(self, start, end):
+        weather_df = daily_weather(start, end).rename_axis('date').reset_index()
+        return weather_df.assign(location_id=self.location.pk, day_of_year=day_of_year(weather_df['date']),
+                                 month_day=weather_df['date'].dt.strftime('%m-%d'))
+
+    def test_write_snapshot(self):
+        for start in ['2020-01-01', '2020-02-01', '2020-03-01']:
+            model_manager.write_snapshot(CurrentWx, self.current_wx(start, '2020-03-10'), [self.location], 'date')
+            live = model_manager.live_rows(CurrentWx, self.location)
+            self.assertEqual(live.earliest('date').date, date.fromisoformat(start))
+            self.assertEqual(live.count(), (date(2020, 3, 10) - date.fromisoformat(start)).days + 1)
+        self.location.refresh_from_db()
+        self.assertEqual(self.location.current_wx_snapshot, 3)
+        # the snapshot live before the last switch is kept for the requests still reading it
+        self.assertEqual(sorted(CurrentWx.objects.values_list('snapshot', flat=True).distinct()), [2, 3])
+        self.assertEqual(Info.objects.get(pk=1).data_version, 3)
+
+    def test_locations_locked_until_switch(self):
+        locked, original = [], QuerySet.select_for_update
+
+        def select_for_update(queryset, *args, **kwargs):
+            locked.append(queryset.model)
+            return original(queryset, *args, **kwargs)
+
+        def write_derived(snapshots):
+            self.assertEqual(locked, [Location])  # locked before the new snapshot was chosen
+            self.assertEqual(Location.objects.get(pk=self.location.pk).current_wx_snapshot, 0)
+
+        with mock.patch.object(QuerySet, 'select_for_update', select_for_update):
+            model_manager.write_snapshot(CurrentWx, self.current_wx('2020-01-01', '2020-01-10'), [self.location],
+                                         'date', write_derived=write_derived)
+        self.assertEqual(Location.objects.get(pk=self.location.pk).current_wx_snapshot, 1)
+
+
+class PlotRowsTests(TestCase):
+    """ The plot rows join the live weather of a location with its live stats of the same day of year."""
+
+    def setUp(self):
+        model_manager.set_info()
+        self.location = Location.objects.get(slug='yyc')
+        other = Location.objects.create(slug='yeg', name='Edmonton, AB', station_name='YEG')
+        self.stats_df = DailyStats.from_weather_df(daily_weather('2000-01-01', '2019-12-31')).to_df()
+        self.missing_day = day_of_year([date(2020, 1, 10)])[0]
+        without_missing_day = self.stats_df[self.stats_df['day_of_year'] != self.missing_day]
+        for location, shift, stats_df in [(other, 100, self.stats_df), (self.location, -100, self.stats_df),
+                                          (self.location, 0, without_missing_day)]:
+            model_manager.write_snapshot(WxStats, stats_df.assign(avg_max_temp=stats_df['avg_max_temp'] + shift,
+                                                                  location_id=location.pk), [location], 'day_of_year')
+        self.current_df = daily_weather('2020-01-01', '2020-03-10', seed=1)
+        for location, weather_df in [(other, self.current_df + 100), (self.location, self.current_df - 100),
+                                     (self.location, self.current_df)]:
+            weather_df = weather_df.rename_axis('date').reset_index()
+            model_manager.write_snapshot(CurrentWx, weather_df.assign(
+                location_id=location.pk, day_of_year=day_of_year(weather_df['date']),
+                month_day=weather_df['date'].dt.strftime('%m-%d')), [location], 'date')
+
+    def assert_rows(self, plot_df, weather_df):
+        weather_df = weather_df[day_of_year(weather_df.index) != self.missing_day]
+        self.assertEqual(list(plot_df.columns), ['date', 'min_temp', 'max_temp', 'day_of_year'] +
+                         model_manager.PLOT_STATS_FIELDS)
+        self.assertEqual(plot_df['date'].dtype, 'datetime64[ns]')
+        np.testing.assert_array_equal(plot_df['date'], weather_df.index)
+        np.testing.assert_array_equal(plot_df[['min_temp', 'max_temp']], weather_df[['min_temp', 'max_temp']])
+        np.testing.assert_array_equal(plot_df['day_of_year'], day_of_year(weather_df.index))
+        stats_df = self.stats_df.set_index('day_of_year')
+        np.testing.assert_array_equal(plot_df['avg_max_temp'], stats_df.loc[plot_df['day_of_year'], 'avg_max_temp'])
+
+    def test_current_weather(self):
+        self.assert_rows(model_manager.plot_rows(self.location), self.current_df)
+
+    def test_date_range(self):
+        daily_df = daily_weather('2019-06-01', '2020-06-30', seed=2)
+        model_manager.store_daily_weather([daily_df.assign(location_id=self.location.pk)])
+        plot_df = model_manager.plot_rows(self.location, (date(2019, 12, 25), date(2020, 1, 15)))
+        self.assert_rows(plot_df, daily_df['2019-12-25':'2020-01-15'])
+
+    def test_no_rows(self):
+        plot_df = model_manager.plot_rows(self.location, (date(1990, 1, 1), date(1990, 12, 31)))
+        self.assertTrue(plot_df.empty)
+        self.assertEqual(list(plot_df.columns), ['date', 'min_temp', 'max_temp', 'day_of_year'] +
+                         model_manager.PLOT_STATS_FIELDS)
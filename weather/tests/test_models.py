@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.test import TestCase
+
+from weather.models import Location
+
+
+class LocationTests(TestCase):
+    def setUp(self):
+        self.location = Location.objects.get(slug='yyc')
+
+    def test_station_years(self):
+        self.assertEqual(self.location.station_years(),
+                         [{'station_id': 2205, 'start_yr': 1881, 'end_yr': 2012, 'location_id': self.location.pk},
+                          {'station_id': 50430, 'start_yr': 2012, 'end_yr': date.today().year,
+                           'location_id': self.location.pk}])
+        self.assertEqual(self.location.first_year(), 1881)
+
+    def test_current_station_years(self):
+        self.assertEqual(self.location.current_station_years(),
+                         [{'station_id': 50430, 'start_yr': date.today().year - 1, 'end_yr': date.today().year,
+                           'location_id': self.location.pk}])
+
+    def test_new_location(self):
+        location = Location.objects.create(slug='yeg', name='Edmonton, AB', station_name='YEG')
+        self.assertEqual(location.station_years(), [])
+        self.assertIsNone(location.first_year())
+        location.stations.create(station_id=1865, start_yr=1959, end_yr=None)
+        self.assertEqual([station['station_id'] for station in location.current_station_years()], [1865])
@@ -0,0 +1,91 @@
+from unittest import mock
+
+import pandas as pd
+from django.test import TestCase, override_settings
+
+from weather import pipeline
+from weather.models import JobRun
+
+
+class RunJobTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(pipeline.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def failing(self, failures):
+        """
+        Returns a job function failing its first calls
+        """
+        calls = []
+
+        def func(value):
+            calls.append(value)
+            if len(calls) <= failures:
+                raise OSError(f"Failure {len(calls)}")
+            return value
+        return func
+
+    def test_retried_with_jittered_backoff(self):
+        with self.assertLogs(pipeline.logger, 'WARNING') as logs:
+            self.assertEqual(pipeline.run_job('fetch 1', self.failing(3), 'done', station_id=1, retries=3,
+                                              backoff=2.0), 'done')
+        self.assertEqual(len(logs.records), 3)
+        delays = [call.args[0] for call in self.sleep.call_args_list]
+        self.assertEqual(len(delays), 3)
+        for attempt, delay in enumerate(delays):
+            self.assertGreaterEqual(delay, 2.0 * 2 ** attempt * 0.5)
+            self.assertLess(delay, 2.0 * 2 ** attempt * 1.5)
+        run = JobRun.objects.get()
+        self.assertEqual((run.name, run.station_id, run.status, run.attempts, run.error),
+                         ('fetch 1', 1, JobRun.SUCCEEDED, 4, ''))
+        self.assertGreaterEqual(run.duration, 0)
+
+    def test_jitter(self):
+        with self.assertLogs(pipeline.logger, 'WARNING'):
+            for _ in range(5):
+                pipeline.run_job('job', self.failing(1), None, retries=1)
+        self.assertEqual(len({call.args[0] for call in self.sleep.call_args_list}), 5)
+
+    def test_failed(self):
+        with self.assertLogs(pipeline.logger, 'WARNING'), self.assertRaises(OSError):
+            pipeline.run_job('job', self.failing(3), None, retries=2)
+        run = JobRun.objects.get()
+        self.assertEqual((run.status, run.attempts, run.error), (JobRun.FAILED, 3, "OSError('Failure 3')"))
+        self.assertEqual(self.sleep.call_count, 2)
+
+
+@override_settings(WEATHER_JOB_WORKERS=2)
+class FetchInJobsTests(TestCase):
+    STATIONS = [{'station_id': 1, 'location_id': 10}, {'station_id': 2, 'location_id': 10},
+                {'station_id': 3, 'location_id': 20}]
+
+    def setUp(self):
+        # the jobs run on the pool threads, which would not see the test's transaction: no JobRun records here
+        patcher = mock.patch.object(pipeline, 'run_job', lambda name, func, *args, **kwargs: func(*args))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self, failed):
+        def fetch_current_weather(stations):
+            station, = stations
+            if station['station_id'] in failed:
+                raise OSError("Download failed")
+            return {station['location_id']: [pd.DataFrame({'max_temp': [float(station['station_id'])]})]}
+        return mock.patch.object(pipeline, 'fetch_current_weather', fetch_current_weather)
+
+    def test_failed_location_left_out(self):
+        with self.fetch(failed={2}), self.assertLogs(pipeline.logger, 'ERROR') as logs:
+            location_weather = pipeline.fetch_in_jobs(self.STATIONS)
+        self.assertIn("station 2 failed", logs.output[0])
+        self.assertEqual(list(location_weather), [20])
+
+    def test_all_fetched(self):
+        with self.fetch(failed=set()):
+            location_weather = pipeline.fetch_in_jobs(self.STATIONS)
+        self.assertEqual({location_id: [df['max_temp'].iloc[0] for df in dfs]
+                          for location_id, dfs in location_weather.items()}, {10: [1.0, 2.0], 20: [3.0]})
+
+    def test_all_failed(self):
+        with self.fetch(failed={1, 2, 3}), self.assertLogs(pipeline.logger, 'ERROR'), self.assertRaises(RuntimeError):
+            pipeline.fetch_in_jobs(self.STATIONS)
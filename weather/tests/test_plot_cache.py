@@ -0,0 +1,53 @@
+from datetime import date
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.test import TestCase
+
+from weather import model_manager, plot_cache
+from weather.models import Info, Location
+
+
+class PlotCacheTests(TestCase):
+    """ The cached plots are keyed on the version of the weather tables, so bumping it invalidates them."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        model_manager.set_info()
+        self.location = Location.objects.get(slug='yyc')
+        plot_df = pd.DataFrame({'date': pd.to_datetime(['2020-01-01', '2020-01-02']), 'max_temp': [1.234, -5.0]})
+        patcher = mock.patch.object(plot_cache, 'get_plot_df', side_effect=lambda *args: plot_df.copy())
+        self.get_plot_df = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def plot_data(self):
+        return plot_cache.get_plot_data(Info.objects.get(pk=1), self.location, True)
+
+    def test_cached_until_data_version_bumped(self):
+        data = self.plot_data()
+        self.assertEqual(data, {'date': [18262, 18263], 'max_temp': [1.23, -5.0]})
+        self.assertEqual(self.plot_data(), data)
+        self.assertEqual(self.get_plot_df.call_count, 1)
+
+        model_manager.bump_data_version()
+        self.assertEqual(self.plot_data(), data)
+        self.assertEqual(self.get_plot_df.call_count, 2)
+
+    def test_key_changes_with_date_and_version(self):
+        info = Info.objects.get(pk=1)
+        key = plot_cache.homepage_cache_key(info, self.location, True)
+        model_manager.bump_data_version()
+        bumped = Info.objects.get(pk=1)
+        self.assertNotEqual(plot_cache.homepage_cache_key(bumped, self.location, True), key)
+        bumped.last_update = date(2000, 1, 1)
+        self.assertNotEqual(plot_cache.homepage_cache_key(bumped, self.location, True),
+                            plot_cache.homepage_cache_key(Info.objects.get(pk=1), self.location, True))
+        self.assertNotEqual(plot_cache.homepage_cache_key(info, self.location, False), key)
+
+    def test_blanks_as_none(self):
+        self.get_plot_df.side_effect = lambda *args: pd.DataFrame({'date': pd.to_datetime(['2020-01-01']),
+                                                                   'min_temp': [np.nan], 'max_temp': [-3.456]})
+        self.assertEqual(self.plot_data(), {'date': [18262], 'min_temp': [None], 'max_temp': [-3.46]})
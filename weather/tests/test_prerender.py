@@ -0,0 +1,79 @@
+from pathlib import Path
+from unittest import mock
+import gzip
+import hashlib
+import json
+import tempfile
+
+from django.test import TestCase, override_settings
+
+from weather import model_manager, prerender
+from weather.models import Location
+
+
+@override_settings(WEATHER_DEFAULT_LOCATION='yyc',
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PrerenderTests(TestCase):
+    def setUp(self):
+        model_manager.set_info()
+        Location.objects.create(slug='yeg', name='Edmonton, AB', station_name='YEG')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        patchers = [
+            mock.patch.object(prerender, 'get_plot_data', side_effect=lambda info, location, smoothed: {
+                'slug': location.slug, 'version': info.data_version}),
+            mock.patch.object(prerender, 'render_homepage_context', side_effect=lambda location, smoothed, data_url: {
+                'location': location, 'script': data_url})]
+        self.get_plot_data, _ = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def render_dir(self, manifest):
+        return self.directory / manifest['renders'][-1]
+
+    def test_publish(self):
+        manifest = prerender.prerender(self.directory)
+        self.assertEqual(prerender.read_manifest(self.directory), manifest)
+        self.assertEqual(manifest['data_version'], 0)
+        self.assertEqual(len(manifest['renders']), 1)
+        render = self.render_dir(manifest)
+        data_path, = (render / 'yyc').glob('plot-data.*.json')
+        content = data_path.read_bytes()
+        self.assertEqual(json.loads(content), {'slug': 'yyc', 'version': 0})
+        self.assertEqual(data_path.name, f'plot-data.{hashlib.sha256(content).hexdigest()[:12]}.json')
+        self.assertTrue(prerender.IMMUTABLE_FILE.search(f'/yyc/{data_path.name}'))
+        self.assertEqual(gzip.decompress(Path(f'{data_path}.gz').read_bytes()), content)
+        page = (render / 'yyc' / 'index.html').read_bytes()
+        self.assertIn(f'/yyc/{data_path.name}'.encode(), page)
+        self.assertEqual((render / 'index.html').read_bytes(), page)
+        self.assertTrue((render / 'yeg' / 'index.html').is_file())
+
+    def test_same_content_same_render(self):
+        manifest = prerender.prerender(self.directory)
+        self.assertEqual(prerender.prerender(self.directory), manifest)
+
+    def test_kept_renders(self):
+        renders = []
+        for _ in range(prerender.KEPT_RENDERS + 2):
+            renders.append(prerender.prerender(self.directory)['renders'][-1])
+            model_manager.bump_data_version()
+        manifest = prerender.read_manifest(self.directory)
+        self.assertEqual(manifest['renders'], renders[-prerender.KEPT_RENDERS:])
+        self.assertEqual(sorted(path.name for path in self.directory.iterdir() if path.is_dir()),
+                         sorted(manifest['renders']))
+
+    def test_failing_location_left_out(self):
+        def get_plot_data(info, location, smoothed):
+            if location.slug == 'yeg':
+                raise ValueError("No stations")
+            return {}
+
+        self.get_plot_data.side_effect = get_plot_data
+        with self.assertLogs(prerender.logger, 'ERROR'):
+            render = self.render_dir(prerender.prerender(self.directory))
+        self.assertTrue((render / 'yyc' / 'index.html').is_file())
+        self.assertFalse((render / 'yeg').exists())
+
+    def test_no_manifest(self):
+        self.assertIsNone(prerender.read_manifest(self.directory))
@@ -0,0 +1,70 @@
+from datetime import datetime
+import os
+import tempfile
+import time
+
+from django.test import SimpleTestCase
+
+from weather.raw_data_cache import RawDataCache
+
+DAY = 86400
+
+
+class RawDataCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = RawDataCache(directory.name, max_bytes=25, max_age=3600, grace=3 * DAY)
+
+    def set_times(self, station, year, month, time_int, downloaded, used=None):
+        """
+        Sets the download and last use times of a cached file
+        """
+        path = self.cache.path(station, year, month, time_int)
+        os.utime(path, (used or downloaded, downloaded))
+
+    def test_is_final(self):
+        end_of_2020 = datetime(2021, 1, 1).timestamp()
+        for time_int, month in ((RawDataCache.DAILY, 1), (RawDataCache.HOURLY, 12)):
+            self.assertFalse(self.cache.is_final(2020, month, time_int, end_of_2020 + 3 * DAY - 1))
+            self.assertTrue(self.cache.is_final(2020, month, time_int, end_of_2020 + 3 * DAY))
+        self.assertFalse(self.cache.is_final(2020, 11, RawDataCache.HOURLY, datetime(2020, 12, 3).timestamp()))
+        self.assertTrue(self.cache.is_final(2020, 11, RawDataCache.HOURLY, datetime(2020, 12, 4).timestamp()))
+
+    def test_get_revalidates_files_downloaded_within_grace(self):
+        now = time.time()
+        self.cache.put(1, 2000, 1, RawDataCache.DAILY, b'final')
+        self.set_times(1, 2000, 1, RawDataCache.DAILY, now - 10 * DAY)
+        self.assertEqual(self.cache.get(1, 2000, 1, RawDataCache.DAILY), b'final')
+
+        # downloaded a day after the end of its year: may have been completed upstream since
+        self.cache.put(1, 2001, 1, RawDataCache.DAILY, b'open')
+        self.set_times(1, 2001, 1, RawDataCache.DAILY, datetime(2002, 1, 2).timestamp())
+        self.assertIsNone(self.cache.get(1, 2001, 1, RawDataCache.DAILY))
+        self.set_times(1, 2001, 1, RawDataCache.DAILY, now - 60)
+        self.assertEqual(self.cache.get(1, 2001, 1, RawDataCache.DAILY), b'open')
+
+    def test_get_keeps_download_time(self):
+        downloaded = time.time() - 60
+        self.cache.put(1, 2000, 1, RawDataCache.DAILY, b'data')
+        self.set_times(1, 2000, 1, RawDataCache.DAILY, downloaded, used=downloaded)
+        self.cache.get(1, 2000, 1, RawDataCache.DAILY)
+        stat = self.cache.path(1, 2000, 1, RawDataCache.DAILY).stat()
+        self.assertAlmostEqual(stat.st_mtime, downloaded, places=3)
+        self.assertGreater(stat.st_atime, downloaded + 30)
+
+    def test_evicts_least_recently_used(self):
+        now = time.time()
+        for station in (1, 2):
+            self.cache.put(station, 2000, 1, RawDataCache.DAILY, b'0123456789')
+            self.set_times(station, 2000, 1, RawDataCache.DAILY, now - 100 + station, used=now - 100 + station)
+        self.cache.get(1, 2000, 1, RawDataCache.DAILY)  # station 2 is now the least recently used
+
+        self.cache.put(3, 2000, 1, RawDataCache.DAILY, b'0123456789')
+        self.assertEqual(self.cache.get(1, 2000, 1, RawDataCache.DAILY), b'0123456789')
+        self.assertIsNone(self.cache.get(2, 2000, 1, RawDataCache.DAILY))
+        self.assertEqual(self.cache.get(3, 2000, 1, RawDataCache.DAILY), b'0123456789')
+
+    def test_keeps_file_just_written(self):
+        self.cache.put(1, 2000, 1, RawDataCache.DAILY, b'x' * 30)
+        self.assertEqual(self.cache.get(1, 2000, 1, RawDataCache.DAILY), b'x' * 30)
@@ -0,0 +1,39 @@
+from datetime import date, timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from weather.models import Info
+from weather.refresh import claim_refresh, renew_lease
+
+
+class ClaimRefreshTests(TestCase):
+
+    def setUp(self):
+        Info.objects.create(pk=1, last_update=date.today() - timedelta(days=1))
+
+    def test_single_claim(self):
+        self.assertTrue(claim_refresh())
+        self.assertFalse(claim_refresh())  # lease held
+
+    @override_settings(WEATHER_REFRESH_TIMEOUT=60)
+    def test_expired_lease(self):
+        Info.objects.update(refresh_started=timezone.now() - timedelta(seconds=61))
+        self.assertTrue(claim_refresh())
+
+    def test_up_to_date(self):
+        Info.objects.update(last_update=date.today())
+        self.assertFalse(claim_refresh())
+
+
+    @override_settings(WEATHER_REFRESH_TIMEOUT=60)
+    def test_renewed_lease(self):
+        self.assertTrue(claim_refresh())
+        Info.objects.update(refresh_started=timezone.now() - timedelta(seconds=59))
+        self.assertTrue(renew_lease())
+        Info.objects.update(refresh_started=Info.objects.get(pk=1).refresh_started - timedelta(seconds=30))
+        self.assertFalse(claim_refresh())  # would have expired without the renewal
+
+    def test_no_lease_to_renew(self):
+        self.assertFalse(renew_lease())
+        self.assertTrue(claim_refresh())
@@ -0,0 +1,190 @@
+import gzip
+import json
+import re
+from datetime import date
+from unittest import mock
+
+import pandas as pd
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from weather import instrumentation, model_manager, plot_cache, views
+from weather.models import Location
+from weather.tests import in_test_thread
+
+
+@override_settings(WEATHER_PRERENDER_DIR='',
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class ViewTestCase(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(views, 'in_thread', in_test_thread)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class LocationRoutesTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        Location.objects.create(slug='yeg', name='Edmonton, AB', station_name='YEG Edmonton International Airport')
+        patcher = mock.patch.object(views, 'get_homepage_context', return_value={})
+        self.get_homepage_context = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_location_pages(self):
+        for url, slug in [('/', 'yyc'), ('/yyc/', 'yyc'), ('/yeg/', 'yeg')]:
+            self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(self.get_homepage_context.call_args[0][0].slug, slug)
+
+    def test_unknown_location(self):
+        self.assertEqual(self.client.get('/yvr/').status_code, 404)
+        self.assertEqual(self.client.get('/yvr/plot-data.json').status_code, 404)
+        self.get_homepage_context.assert_not_called()
+
+    @override_settings(WEATHER_DEFAULT_LOCATION='yeg')
+    def test_default_location(self):
+        self.client.get('/')
+        self.assertEqual(self.get_homepage_context.call_args[0][0].slug, 'yeg')
+
+    def test_smoothed_sentence(self):
+        for smoothed, shown in [(True, True), ('savgol61', True), (False, False)]:
+            self.get_homepage_context.return_value = {'smoothed': smoothed, 'max_years': 10}
+            response = self.client.get('/yyc/')
+            self.assertEqual('Averages have been smoothed.' in response.content.decode(), shown, smoothed)
+
+
+class DateRangeTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        model_manager.set_info()
+        patchers = [mock.patch.object(views, 'get_homepage_context', return_value={}),
+                    mock.patch.object(views, 'get_plot_data', return_value={})]
+        self.get_homepage_context, self.get_plot_data = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def test_range(self):
+        self.assertEqual(self.client.get('/yyc/?start=2020-01-01&end=2020-12-31').status_code, 200)
+        self.assertEqual(self.get_homepage_context.call_args[1]['date_range'], (date(2020, 1, 1), date(2020, 12, 31)))
+        self.client.get('/yyc/plot-data.json?end=2020-12-31')
+        self.assertEqual(self.get_plot_data.call_args[0][3], (date(2020, 1, 1), date(2020, 12, 31)))
+        self.client.get('/yyc/plot-data.json?start=2020-01-01&end=2999-01-01')
+        self.assertEqual(self.get_plot_data.call_args[0][3], (date(2020, 1, 1), date.today()))
+
+    def test_latest_weeks(self):
+        self.client.get('/yyc/')
+        self.assertIsNone(self.get_homepage_context.call_args[1]['date_range'])
+
+    def test_bad_range(self):
+        for query in ['start=2020-13-01', 'start=2020-01-01&end=yesterday', 'start=2020-12-31&end=2020-01-01']:
+            for url in ['/yyc/', '/yyc/plot-data.json']:
+                self.assertEqual(self.client.get(f'{url}?{query}').status_code, 400, (url, query))
+        self.get_homepage_context.assert_not_called()
+        self.get_plot_data.assert_not_called()
+
+    def test_form_keeps_smoothing(self):
+        self.get_homepage_context.return_value = {'start': date(2020, 1, 1), 'end': date(2020, 12, 31),
+                                                  'smoothing_param': ('smoothing', 'savgol61')}
+        content = self.client.get('/yyc/?start=2020-01-01&end=2020-12-31&smoothing=savgol61').content.decode()
+        self.assertIn('<input type="hidden" name="smoothing" value="savgol61">', content)
+        self.assertIn('href="?smoothing=savgol61"', content)
+
+
+class PlotDataTests(ViewTestCase):
+    URL = '/yyc/plot-data.json'
+    DATA = {'date': list(range(18262, 18322)), 'min_temp': [-10.5] * 60, 'max_temp': [None] * 60}
+
+    def setUp(self):
+        super().setUp()
+        model_manager.set_info()
+        patcher = mock.patch.object(views, 'get_plot_data', return_value=self.DATA)
+        self.get_plot_data = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get(self):
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), self.DATA)
+        self.assertTrue(response['ETag'])
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_not_modified(self):
+        etag = self.client.get(self.URL)['ETag']
+        response = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.get_plot_data.call_count, 1)
+
+    def test_modified_after_update(self):
+        etag = self.client.get(self.URL)['ETag']
+        model_manager.bump_data_version()
+        response = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_per_variant(self):
+        etags = {self.client.get(url)['ETag'] for url in
+                 [self.URL, self.URL + '?smoothed=0', self.URL + '?start=2020-01-01&end=2020-12-31']}
+        self.assertEqual(len(etags), 3)
+
+    def test_head(self):
+        response = self.client.head(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        self.assertTrue(response['ETag'])
+
+    def test_unsafe_method(self):
+        self.assertEqual(self.client.post(self.URL).status_code, 405)
+
+    def test_gzip(self):
+        response = self.client.get(self.URL, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.DATA)
+        # the ETag of the compressed response is weak, and still matches
+        self.assertTrue(response['ETag'].startswith('W/'))
+        response = self.client.get(self.URL, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class MetricsTests(ViewTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        model_manager.set_info()
+        plot_df = pd.DataFrame({'date': pd.to_datetime(['2020-01-01']), 'max_temp': [1.0]})
+        patcher = mock.patch.object(plot_cache, 'get_plot_df', return_value=plot_df)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enable(self):
+        instrumentation.configure(True)
+        self.addCleanup(instrumentation.configure, False)
+
+    def metric(self, name):
+        """
+        Returns the value of a metric sample at /metrics, or 0 if it is not exported yet
+        """
+        match = re.search(f'^{re.escape(name)} (.+)$', self.client.get('/metrics').content.decode(), re.MULTILINE)
+        return float(match.group(1)) if match else 0
+
+    def test_server_timing(self):
+        self.enable()
+        timing = self.client.get('/yyc/plot-data.json')['Server-Timing']
+        self.assertRegex(timing, r'^cache_get;dur=[\d.]+, to_columns;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_metrics(self):
+        self.enable()
+        requests = 'weather_request_seconds_count{view="location_plot_data"}'
+        misses, hits = ('weather_cache_requests_total{cache="plot_data",result="%s"}' % result
+                        for result in ('miss', 'hit'))
+        before = {name: self.metric(name) for name in (requests, misses, hits)}
+        self.client.get('/yyc/plot-data.json')
+        self.client.get('/yyc/plot-data.json')
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertEqual({name: self.metric(name) - value for name, value in before.items()},
+                         {requests: 2, misses: 1, hits: 1})
+
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertNotIn('Server-Timing', self.client.get('/yyc/plot-data.json'))
@@ -0,0 +1,256 @@
+from datetime import date
+from io import BytesIO
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+import threading
+
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase, override_settings
+
+from weather.model_manager import get_retriever
+from weather.synthetic_data import synthetic_daily_csv, synthetic_hourly_csv
+from weather.tests import daily_weather
+from weather.weather_data import SKETCH_BIN_WIDTH, WEATHER_QUERY, DailyStats, HourlyDownsampler, \
+    WeatherDataRetriever, changed_observations, day_of_year, downsample, downsample_freq
+
+
+class DailyStatsTests(SimpleTestCase):
+    """ The stats are sufficient statistics: adding, retracting and merging observations must give the stats
+    computed from scratch."""
+
+    def setUp(self):
+        self.weather_df = daily_weather('2000-01-01', '2004-12-31')
+
+    def assertStatsEqual(self, stats, expected):
+        for col in DailyStats.SUM_COLUMNS:
+            np.testing.assert_allclose(getattr(stats, col), getattr(expected, col), atol=1e-9, err_msg=col)
+        for col in DailyStats.HISTOGRAMS + ['record_min_temp', 'record_max_temp', 'last_date']:
+            np.testing.assert_array_equal(getattr(stats, col), getattr(expected, col), err_msg=col)
+
+    def test_retract_and_add_again(self):
+        stats = DailyStats.from_weather_df(self.weather_df)
+        year = self.weather_df.loc['2003']
+        stats.retract_days(year)
+        self.assertEqual(stats.stats_count.sum(), len(self.weather_df) - len(year))
+        stats.add_days(year)
+        self.assertStatsEqual(stats, DailyStats.from_weather_df(self.weather_df))
+
+    def test_correction_shifts_sums_by_delta(self):
+        stats = DailyStats.from_weather_df(self.weather_df)
+        before = DailyStats.from_weather_df(self.weather_df)
+        observed = self.weather_df.loc[['2003-05-10']]
+        corrected = observed.assign(max_temp=observed['max_temp'] + 2.5)
+        stats.retract_days(observed)
+        stats.add_days(corrected)
+        doy = day_of_year(observed.index)[0]
+        old, new = observed['max_temp'].iloc[0], corrected['max_temp'].iloc[0]
+        self.assertEqual(stats.stats_count[doy], before.stats_count[doy])
+        self.assertAlmostEqual(stats.sum_max_temp[doy] - before.sum_max_temp[doy], 2.5, places=9)
+        self.assertAlmostEqual(stats.sumsq_max_temp[doy] - before.sumsq_max_temp[doy], new ** 2 - old ** 2, places=9)
+        np.testing.assert_array_equal(np.delete(stats.sum_max_temp, doy), np.delete(before.sum_max_temp, doy))
+
+    def test_add_only_new_days(self):
+        stats = DailyStats.from_weather_df(self.weather_df[:'2003'])
+        days = stats.add_days(self.weather_df['2003':], only_new=True)  # 2003 is already counted
+        self.assertEqual(len(days), 366)
+        self.assertStatsEqual(stats, DailyStats.from_weather_df(self.weather_df))
+        self.assertEqual(len(stats.add_days(self.weather_df, only_new=True)), 0)
+
+    def test_merge(self):
+        parts = [self.weather_df[:'2002'], self.weather_df['2003':]]
+        expected = DailyStats.from_weather_df(self.weather_df)
+        self.assertStatsEqual(DailyStats.from_weather_df(parts[0]).merge(DailyStats.from_weather_df(parts[1])),
+                              expected)
+        self.assertStatsEqual(DailyStats.combine([DailyStats.from_weather_df(part) for part in parts]), expected)
+
+    def test_rows_round_trip(self):
+        stats = DailyStats.from_weather_df(self.weather_df['2002':'2003'])  # Feb 29 without stats
+        stats_df = stats.to_df()
+        self.assertEqual(len(stats_df), 365)
+        self.assertStatsEqual(DailyStats.from_df(stats_df), stats)
+
+
+
+class PercentileTests(SimpleTestCase):
+    """ The percentiles estimated from the sketches are within a bin width of the observations around the exact
+    ones."""
+
+    def setUp(self):
+        self.weather_df = daily_weather('1900-01-01', '1999-12-31')
+        self.stats = DailyStats.from_weather_df(self.weather_df)
+
+    def test_close_to_exact(self):
+        doy = day_of_year(self.weather_df.index)
+        for temp, q in [('min_temp', 10), ('max_temp', 50), ('max_temp', 90)]:
+            temps = self.weather_df[temp].groupby(doy)
+            lower = temps.quantile(q / 100, interpolation='lower')
+            higher = temps.quantile(q / 100, interpolation='higher')
+            estimated = self.stats.percentile(temp, q)[lower.index]
+            self.assertTrue((estimated >= lower - SKETCH_BIN_WIDTH).all(), f'{temp} p{q}')
+            self.assertTrue((estimated <= higher + SKETCH_BIN_WIDTH).all(), f'{temp} p{q}')
+
+    def test_monotonic_in_q(self):
+        percentiles = np.array([self.stats.percentile('max_temp', q) for q in (1, 10, 50, 90, 99)])
+        self.assertTrue((np.diff(percentiles, axis=0) >= 0).all())
+
+    def test_days_without_data(self):
+        stats = DailyStats.from_weather_df(daily_weather('2001-01-01', '2001-01-31'))
+        p90 = stats.percentile('max_temp', 90)
+        self.assertFalse(np.isnan(p90[:31]).any())
+        self.assertTrue(np.isnan(p90[31:]).all())
+
+    def test_sketch_round_trip(self):
+        stats = DailyStats.from_df(self.stats.to_df())
+        np.testing.assert_array_equal(stats.percentile('min_temp', 10), self.stats.percentile('min_temp', 10))
+
+
+class ChangedObservationsTests(SimpleTestCase):
+
+    def test_corrections(self):
+        dates = pd.date_range('2020-03-01', periods=5)
+        previous = pd.DataFrame({'date': dates, 'min_temp': [1.0, 2.0, 3.0, np.nan, 5.0],
+                                 'max_temp': [11.0, 12.0, 13.0, 14.0, 15.0]})
+        current = pd.DataFrame({'date': dates, 'min_temp': [1.0, 2.5, 3.0, 4.0, 5.5],
+                                'max_temp': [11.0, 12.0, np.nan, 14.0, 15.0]})
+        last_date = np.full(366, np.datetime64('NaT'), dtype='datetime64[D]')
+        last_date[day_of_year(dates)] = np.datetime64('2020-03-04')  # Mar 5 is not counted yet
+        retract, add = changed_observations(previous, current, last_date)
+        # corrected Mar 2, blanked Mar 3, backfilled Mar 4
+        self.assertEqual(list(retract['date'].dt.day), [2, 3])
+        self.assertEqual(list(retract['min_temp']), [2.0, 3.0])
+        self.assertEqual(list(add['date'].dt.day), [2, 4])
+        self.assertEqual(list(add['min_temp']), [2.5, 4.0])
+
+
+class HourlyDownsamplerTests(SimpleTestCase):
+
+    def setUp(self):
+        times = pd.date_range('2020-01-01', periods=48, freq='H', name='time')
+        self.hourly_df = pd.DataFrame({'temp': np.sin(np.arange(48) / 4) * 10}, index=times)
+
+    def downsample_in_chunks(self, *chunks, keep_extremes=False):
+        downsampler = HourlyDownsampler(keep_extremes=keep_extremes)
+        for chunk in chunks:
+            downsampler.add(chunk)
+        return downsampler.to_df()
+
+    def test_days_split_across_chunks(self):
+        whole = self.downsample_in_chunks(self.hourly_df, keep_extremes=True)
+        split = self.downsample_in_chunks(self.hourly_df[:30], self.hourly_df[30:40], self.hourly_df[40:],
+                                          keep_extremes=True)
+        pd.testing.assert_frame_equal(split, whole)
+        day = self.hourly_df.loc['2020-01-02', 'temp']
+        self.assertEqual(list(split['hours']), [24, 24])
+        self.assertEqual(split.loc['2020-01-02', 'min_temp'], day.min())
+        self.assertEqual(split.loc['2020-01-02', 'max_temp_time'], day.idxmax())
+        self.assertAlmostEqual(split.loc['2020-01-02', 'mean_temp'], day.mean())
+
+    def test_incomplete_days_are_blank(self):
+        daily_df = self.downsample_in_chunks(self.hourly_df[:30])
+        self.assertFalse(np.isnan(daily_df.loc['2020-01-01', 'max_temp']))
+        self.assertTrue(np.isnan(daily_df.loc['2020-01-02', 'max_temp']))  # 6 hours
+
+
+class DownsampleTests(SimpleTestCase):
+
+    def test_freq(self):
+        self.assertEqual(downsample_freq(date(2020, 1, 1), date(2020, 12, 31), 400), 'D')
+        self.assertEqual(downsample_freq(date(2020, 1, 1), date(2025, 12, 31), 400), 'W-MON')
+        self.assertEqual(downsample_freq(date(1995, 1, 1), date(2025, 12, 31), 400), 'MS')
+        self.assertEqual(downsample_freq(date(1930, 1, 1), date(2025, 12, 31), 400), 'QS')
+        self.assertEqual(downsample_freq(date(1900, 1, 1), date(2025, 12, 31), 100), '2AS')
+
+    def test_bins(self):
+        plot_df = daily_weather('2020-01-01', '2020-02-29').rename_axis('date').reset_index()
+        plot_df['record_min_temp'] = plot_df['min_temp'] - 10
+        plot_df['record_max_temp'] = plot_df['max_temp'] + 10
+        self.assertEqual(list(downsample(plot_df, 'D')['width'].unique()), [1])
+        bins = downsample(plot_df, 'MS')
+        self.assertEqual(list(bins['width']), [31, 29])
+        february = plot_df[plot_df['date'].dt.month == 2]
+        self.assertAlmostEqual(bins['max_temp'].iloc[1], february['max_temp'].mean())
+        self.assertEqual(bins['record_min_temp'].iloc[1], february['record_min_temp'].min())
+        self.assertEqual(bins['record_max_temp'].iloc[1], february['record_max_temp'].max())
+
+
+class ConcurrencyProbe:
+    """
+    Fake download recording the peak number of concurrent downloads. Each download waits at a barrier for
+    `parties` downloads in flight, so the test fails (BrokenBarrierError) unless they actually overlap.
+    """
+    def __init__(self, parties):
+        self.barrier = threading.Barrier(parties, timeout=10)
+        self.lock = threading.Lock()
+        self.active = self.peak = 0
+
+    def __call__(self, url):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            self.barrier.wait()
+            query = parse_qs(urlsplit(url).query)
+            return synthetic_daily_csv(int(query['stationID'][0]), int(query['Year'][0]))
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class WeatherDataRetrieverTests(SimpleTestCase):
+    STATIONS = [{'station_id': 1, 'start_yr': 2001, 'end_yr': 2004},
+                {'station_id': 2, 'start_yr': 2003, 'end_yr': 2004}]
+
+    def retriever(self, **kwargs):
+        return WeatherDataRetriever('http://api.test/' + WEATHER_QUERY, backoff=0, **kwargs)
+
+    def test_bounded_concurrency_in_order(self):
+        probe = ConcurrencyProbe(parties=2)
+        with mock.patch.object(WeatherDataRetriever, '_download', staticmethod(probe)):
+            results = list(self.retriever(max_workers=4, max_per_host=2).iter_weather_data(self.STATIONS))
+        self.assertEqual(probe.peak, 2)
+        self.assertEqual([(station['station_id'], year) for station, year, _ in results],
+                         [(1, 2001), (1, 2002), (1, 2003), (1, 2004), (2, 2003), (2, 2004)])
+        self.assertTrue(all(weather_df.index.year.unique().tolist() == [year] for _, year, weather_df in results))
+
+    def test_connection_limit_per_retriever(self):
+        # a retriever with a lower limit for the same host, created first, must not cap the others
+        with mock.patch.object(WeatherDataRetriever, '_download', staticmethod(ConcurrencyProbe(parties=1))):
+            list(self.retriever(max_workers=2, max_per_host=1).iter_weather_data(self.STATIONS[:1]))
+        probe = ConcurrencyProbe(parties=3)
+        with mock.patch.object(WeatherDataRetriever, '_download', staticmethod(probe)):
+            list(self.retriever(max_workers=3, max_per_host=3).iter_weather_data(
+                [{'station_id': 1, 'start_yr': 2001, 'end_yr': 2003}]))
+        self.assertEqual(probe.peak, 3)
+
+    def test_retries(self):
+        failures = []
+
+        def download(url):
+            if len(failures) < 2:
+                failures.append(url)
+                raise OSError("Connection reset")
+            return synthetic_daily_csv(1, 2001)
+
+        with mock.patch.object(WeatherDataRetriever, '_download', staticmethod(download)):
+            weather_df = self.retriever(retries=2)._fetch(1, 2001)
+            self.assertEqual(len(failures), 2)
+            self.assertEqual(len(weather_df), 365)
+            failures.clear()
+            with self.assertRaises(OSError):
+                self.retriever(retries=1)._fetch(1, 2001)
+
+    def test_chunked_csv_reading(self):
+        whole, chunked = self.retriever(), self.retriever(chunksize=50)
+        daily_csv, hourly_csv = synthetic_daily_csv(1, 2001), synthetic_hourly_csv(1, 2001, 1)
+        pd.testing.assert_frame_equal(chunked._read_daily_csv(BytesIO(daily_csv)),
+                                      whole._read_daily_csv(BytesIO(daily_csv)))
+        pd.testing.assert_frame_equal(chunked._read_hourly_csv(BytesIO(hourly_csv)),
+                                      whole._read_hourly_csv(BytesIO(hourly_csv)))
+
+    @override_settings(WEATHER_CACHE_DIR='')
+    def test_chunksize_setting(self):
+        with self.settings(WEATHER_API_CHUNKSIZE=0):
+            self.assertIsNone(get_retriever().chunksize)
+        with self.settings(WEATHER_API_CHUNKSIZE=1000):
+            self.assertEqual(get_retriever().chunksize, 1000)
@@ -1,52 +1,83 @@
 import datetime
 import pandas as pd
-from bokeh.models import ColumnDataSource, DataRange1d, HoverTool, Legend
+from bokeh.models import AjaxDataSource, ColumnDataSource, CustomJS, DataRange1d, HoverTool, Legend
 from bokeh.palettes import BuGn4
 from bokeh.plotting import figure
-from weather.model_manager import get_plot_df
+from weather.instrumentation import stage
+from weather.model_manager import get_plot_df, PLOT_STATS_FIELDS
+
+# Converts the plot data JSON (dates as days since the epoch, and the days covered by each row of downsampled
+# date ranges) into the plot columns
+PLOT_DATA_ADAPTER = """
+const data = cb_data.response
+const day = 86400000
+const width = data.width || data.date.map(() => 1)
+data.date = data.date.map(d => d * day)
+data.left = data.date.map(t => t - day / 2)
+data.right = data.date.map((t, i) => t + (width[i] - 0.5) * day)
+return data
+"""
 
 
 class TrendPlotBuilder:
 
-    def __init__(self, smoothed=False):
+    def __init__(self, location, smoothed=False, data_url=None, date_range=None):
+        self.location = location
+        self.date_range = date_range  # (start, end) dates plotted, or None for the latest weeks
         self.weather_df = None
         self.source = None  # a ColumnDataSource object
         self.plot = None  # a Figure object
         self.smoothed = smoothed
+        self.data_url = data_url  # if set, the browser loads the data from this url instead of embedding it
         self.build_trend_plot()
 
     def build_trend_plot(self):
 
-        self.create_df_from_db()
-        self.process_dataset()
-        self.make_plot()
+        if self.data_url is None:
+            self.create_df_from_db()
+            self.process_dataset()
+        else:
+            self.create_ajax_source()
+        with stage('make_plot'):
+            self.make_plot()
 
     def create_df_from_db(self):
-        self.weather_df = get_plot_df(self.smoothed)
+        self.weather_df = get_plot_df(self.smoothed, self.location, self.date_range)
 
     def process_dataset(self):
         df = self.weather_df
         df['date'] = pd.to_datetime(df.date)
         df['left'] = df.date - datetime.timedelta(days=0.5)
-        df['right'] = df.date + datetime.timedelta(days=0.5)
+        df['right'] = df.date + pd.to_timedelta(df.pop('width') if 'width' in df else 1, unit='D') - \
+            datetime.timedelta(days=0.5)
         df = df.set_index(['date'])
         self.source = ColumnDataSource(data=df)
 
+    def create_ajax_source(self):
+        columns = ['date', 'left', 'right', 'min_temp', 'max_temp'] + PLOT_STATS_FIELDS
+        self.source = AjaxDataSource(data_url=self.data_url, method='GET', polling_interval=None,
+                                     data={col: [] for col in columns},
+                                     adapter=CustomJS(code=PLOT_DATA_ADAPTER))
+
     def make_plot(self):
         self.plot = figure(x_axis_type="datetime", tools='', sizing_mode='scale_width',
                            max_width=650, toolbar_location=None)
         r1 = self.plot.quad(top='record_max_temp', bottom='record_min_temp', left='left', right='right',
                             color=BuGn4[2], source=self.source)
+        r_band = self.plot.quad(top='p90_max_temp', bottom='p10_min_temp', left='left', right='right',
+                                color=BuGn4[1], alpha=0.5, source=self.source)
         r2 = self.plot.quad(top='avg_max_temp', bottom='avg_min_temp', left='left', right='right',
                             color=BuGn4[1], source=self.source)
         r3 = self.plot.quad(top='max_temp', bottom='min_temp', left='left', right='right',
                             color=BuGn4[0], alpha=0.7, line_color="black", source=self.source)
-        legend = Legend(items=[("Record", [r1]), ("Average", [r2]), ("Actual", [r3]), ],
+        legend = Legend(items=[("Record", [r1]), ("10th-90th %ile", [r_band]), ("Average", [r2]),
+                               ("Actual", [r3]), ],
                         location="center", orientation="horizontal", label_text_font_size="7pt",
                         border_line_color="lightgrey", label_standoff=3, spacing=10, padding=5)
         self.plot.add_layout(legend, 'below')
         # hover tool
-        hover_tool = HoverTool(tooltips=[('Actuals', ''), ('date', '@date{%a %b %d}'),
+        date_format = '@date{%a %b %d}' if self.date_range is None else '@date{%b %d %Y}'
+        hover_tool = HoverTool(tooltips=[('Actuals', ''), ('date', date_format),
                                          ('min', '@min_temp{0.0}\xb0C'),
                                          ('max', '@max_temp{0.0}\xb0C')],
                                formatters={'@date': 'datetime'},
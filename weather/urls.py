@@ -3,4 +3,8 @@ from . import views
 
 urlpatterns = [
     path('', views.homepage, name='homepage'),
+    path('metrics', views.metrics, name='metrics'),
+    path('<slug:location>/', views.homepage, name='location_homepage'),
+    path('plot-data.json', views.plot_data, name='plot_data'),
+    path('<slug:location>/plot-data.json', views.plot_data, name='location_plot_data'),
 ]
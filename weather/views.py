@@ -1,21 +1,138 @@
-from django.shortcuts import render
-from bokeh.embed import components
+from datetime import date, timedelta
 
-from weather.trend_plot_builder import TrendPlotBuilder
-from weather.models import WxStats
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.utils.cache import patch_cache_control
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_safe
+
+from weather import instrumentation
+from weather.models import Location
+from weather.plot_cache import get_homepage_context, get_plot_data, plot_data_etag
+from weather.refresh import refresh_in_background
 
 
 # Create your views here.
+# The views are async: their database, cache and plot work runs in a pool of worker threads, so under ASGI
+# (uvicorn workers) the event loop keeps accepting requests meanwhile, including while a refresh is running.
+
+
+def in_thread(func):
+    """
+    Returns an async function running func in a worker thread, closing the thread's database connection when it
+    has errored or outlived CONN_MAX_AGE, as Django does around each request
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
 
 
-def homepage(request):
+async def homepage(request, location=None):
+    try:
+        _date_range(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return await in_thread(_homepage)(request, location)
 
-    builder = TrendPlotBuilder(smoothed=True)
-    plot = builder.get_plot()
-    script, div = components(plot)
-    max_years = WxStats.objects.order_by("-stats_count")[0].stats_count
-    context = {'script': script,
-               'div': div,
-               'max_years': max_years}
+
+def _homepage(request, location=None):
+
+    location = get_object_or_404(Location, slug=location or settings.WEATHER_DEFAULT_LOCATION)
+    context = get_homepage_context(location, smoothed=_smoothing(request), date_range=_date_range(request))
 
     return render(request, "weather/base.html", context=context)
+
+
+def _plot_data_args(request, location):
+    location = get_object_or_404(Location, slug=location or settings.WEATHER_DEFAULT_LOCATION)
+    return location, _smoothing(request), _date_range(request)
+
+
+def _smoothing(request):
+    """
+    Returns the smoothing of the averages selected by the request: the name of a smoothing variant
+    (?smoothing=<name>), True for the default one, or False for the raw averages (?smoothed=0)
+    """
+    smoothing = request.GET.get('smoothing')
+    if smoothing is None:
+        return request.GET.get('smoothed', '1') != '0'
+    if smoothing not in settings.WEATHER_SMOOTHING:
+        raise Http404(f"Unknown smoothing {smoothing}")
+    return smoothing
+
+
+def _date_range(request):
+    """
+    Returns the (start, end) dates selected by the request (?start=YYYY-MM-DD&end=YYYY-MM-DD, end defaulting to
+    today and start to a year before end), or None for the latest weeks, parsed once per request.
+    Raises ValueError for malformed dates or a start after the end, answered by the views with a 400.
+    """
+    if not hasattr(request, 'weather_date_range'):
+        request.weather_date_range = _parse_date_range(request.GET.get('start'), request.GET.get('end'))
+    return request.weather_date_range
+
+
+def _parse_date_range(start, end):
+    if not start and not end:
+        return None
+    try:
+        end = min(date.fromisoformat(end), date.today()) if end else date.today()
+        start = date.fromisoformat(start) if start else end - timedelta(days=365)
+    except ValueError:
+        raise ValueError(f"Invalid date range {start} - {end}")
+    if start > end:
+        raise ValueError(f"Empty date range {start} - {end}")
+    return start, end
+
+
+def _info(request):
+    """
+    Returns the Info record (starting a background refresh if stale), looked up once per request
+    """
+    if not hasattr(request, 'weather_info'):
+        request.weather_info = refresh_in_background()
+    return request.weather_info
+
+
+def _plot_data_etag(request, location=None):
+    location, smoothed, date_range = _plot_data_args(request, location)
+    return plot_data_etag(_info(request), location, smoothed, date_range)
+
+
+async def plot_data(request, location=None):
+    """
+    Plot data of a location as JSON columns, loaded by the page's plot. Supports conditional GET (304) and gzip,
+    so browsers and proxies can cache the data separately from the page.
+    """
+    try:
+        _date_range(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return await in_thread(_plot_data)(request, location)
+
+
+@require_safe
+@gzip_page
+@condition(etag_func=_plot_data_etag)
+def _plot_data(request, location=None):
+    location, smoothed, date_range = _plot_data_args(request, location)
+    response = JsonResponse(get_plot_data(_info(request), location, smoothed, date_range))
+    patch_cache_control(response, public=True, max_age=settings.WEATHER_PLOT_DATA_MAX_AGE)
+    return response
+
+
+@require_safe
+def metrics(request):
+    """
+    Metrics of this process in the Prometheus text format, when WEATHER_METRICS_ENABLED is set
+    """
+    if not instrumentation.is_enabled():
+        raise Http404("Metrics are disabled")
+    return HttpResponse(instrumentation.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
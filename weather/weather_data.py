@@ -1,13 +1,72 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 from datetime import date, timedelta
+from io import BytesIO
 from pathlib import Path
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+import logging
+import random
+import threading
+import time
+import httpx
+import numpy as np
 import pandas as pd
 
-WEATHER_URL = 'https://climate.weather.gc.ca/climate_data/bulk_data_e.html?format=csv' \
-              '&stationID={station}&Year={year}&Month={month}&timeframe={time_int}' \
-              '&submit=Download+Data'
+from weather.instrumentation import UPSTREAM_BYTES, UPSTREAM_ERRORS, cache_lookup
+
+WEATHER_API_URL = 'https://climate.weather.gc.ca/climate_data/bulk_data_e.html'
+WEATHER_QUERY = '?format=csv&stationID={station}&Year={year}&Month={month}&timeframe={time_int}' \
+                '&submit=Download+Data'
+WEATHER_URL = WEATHER_API_URL + WEATHER_QUERY
 
 CSV_FILE_LOC = Path.cwd()
 
+API_TIMEOUT = 60  # seconds
+
+# Columns of the daily API CSV needed for the stats, read with compact dtypes. The API names the temperature
+# columns with a degree symbol, both spellings are accepted.
+DATE_COL = 'Date/Time'
+TEMP_COLS = ('Min Temp (C)', 'Max Temp (C)')
+DAILY_DTYPES = {name: 'float32' for col in TEMP_COLS for name in (col, col.replace('(C)', '(\xb0C)'))}
+DATE_FORMAT = '%Y-%m-%d'
+# Columns of the hourly API CSV (timeframe=1, one station-month per file)
+HOURLY_DATE_COL = 'Date/Time (LST)'
+HOURLY_TEMP_COL = 'Temp (C)'
+HOURLY_DTYPES = {HOURLY_TEMP_COL: 'float32', HOURLY_TEMP_COL.replace('(C)', '(\xb0C)'): 'float32'}
+HOURLY_DATE_FORMAT = '%Y-%m-%d %H:%M'
+MIN_HOURS = 18  # hourly observations below which a past day's min and max are left blank
+TEMP_DECIMALS = 1  # resolution of the API temperatures, used to restore exact values from float32
+
+# Days of year are numbered 0-365 on a leap year calendar, so Feb 29 always has its own day and every other
+# date maps to the same day in leap and non-leap years
+DAYS_IN_YEAR = 366
+_MONTH_OFFSETS = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+# Per-day temperature quantile sketches: fixed-width histograms covering the Canadian temperature range.
+# Unlike t-digest or KLL they are exactly mergeable and also support retraction, and at the API resolution of
+# 0.1°C the quantile error is bounded by the bin width.
+SKETCH_LOW, SKETCH_BIN_WIDTH, SKETCH_BINS = -70.0, 0.5, 250  # bins cover -70°C to +55°C
+SKETCH_DTYPE = np.dtype('<u2')  # serialized bin counts (per day of year, well below 65535)
+MONTH_DAY_KEYS = pd.date_range('2000-01-01', '2000-12-31').strftime('%m-%d').to_numpy()  # day of year -> 'MM-DD'
+
+logger = logging.getLogger(__name__)
+
+# One semaphore per API host and connection limit, shared by the retrievers of the process with that limit
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def _host_semaphore(url, max_per_host):
+    """
+    Returns the semaphore limiting concurrent connections to the host of url to max_per_host
+    """
+    key = (urlsplit(url).netloc, max_per_host)
+    with _host_semaphores_lock:
+        if key not in _host_semaphores:
+            _host_semaphores[key] = threading.BoundedSemaphore(max_per_host)
+        return _host_semaphores[key]
+
 
 class WeatherDataRetriever:
     """
@@ -17,30 +76,114 @@ class WeatherDataRetriever:
         min_temp
         max_temp
         month_day
+        day_of_year
     """
-    def __init__(self, url):
+    def __init__(self, url, max_workers=1, max_per_host=4, retries=3, backoff=1.0, cache=None, chunksize=None,
+                 use_async=False):
+        """
+        @param url: API url template
+        @param max_workers: number of station-years downloaded concurrently (1 for sequential downloads)
+        @param max_per_host: maximum number of concurrent connections to the API host
+        @param retries: number of times a failed download is retried
+        @param backoff: base delay in seconds between retries, doubled on each attempt
+        @param cache: optional RawDataCache the downloaded CSV files are read from and saved to
+        @param chunksize: optional number of CSV rows parsed at a time
+        @param use_async: whether to download the station-years concurrently on an event loop with a non-blocking
+        HTTP client, instead of on a pool of max_workers threads
+        """
         self.weather_api_url = url
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+        self.chunksize = chunksize
+        self.use_async = use_async
 
     def create_weather_df(self, stations, drop_blanks):
         """
         Returns a cleaned DataFrame of min and max temperatures for all years
         """
-        weather_df = self._get_weather_data(stations)
-        weather_df = self._clean_data(weather_df, drop_blanks)
+        weather_df = self._get_weather_data(stations, drop_blanks)
         weather_df = self._add_month_day(weather_df)
         return weather_df
 
-    def _get_weather_data(self, stations) -> pd.DataFrame:
+    def iter_weather_data(self, stations, drop_blanks=True):
+        """
+        Yields a (station, year, cleaned DataFrame) tuple for each station-year, in order. Each raw CSV is cleaned
+        as soon as it is read, so only the few cleaned columns of the station-years are held in memory.
+        The stations of many locations can be passed at once to share the download pool.
+        """
+        station_years = [(station, yr) for station in stations
+                         for yr in range(station['start_yr'], station['end_yr'] + 1)]
+
+        def fetch(station_year):
+            station, yr = station_year
+            return station, yr, self._clean_data(self._fetch(station['station_id'], yr), drop_blanks)
+
+        if self.use_async and len(station_years) > 1:
+            yield from asyncio.run(self._fetch_all_async(station_years, drop_blanks))
+        elif self.max_workers > 1 and len(station_years) > 1:
+            # executor.map yields results in submission order, so the frames are reassembled in order
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                yield from executor.map(fetch, station_years)
+        else:
+            for station_year in station_years:
+                yield fetch(station_year)
+
+    def iter_hourly_data(self, stations, start, end=None):
+        """
+        Yields a (station, month, hourly DataFrame) tuple for each station-month from the month of start to the
+        month of end, in order. At most max_workers months are downloaded ahead of the consumer, so only a few
+        months of hourly rows are held in memory whatever the length of the period.
+        @param start: first date of the period (the whole month is fetched)
+        @param end: last date of the period (defaults to today)
+        @return: months as pandas Periods, DataFrames as returned by _read_hourly_csv
+        """
+        months = pd.period_range(start, end or date.today(), freq='M')
+        station_months = [(station, month) for station in stations for month in months]
+
+        def fetch(station_month):
+            station, month = station_month
+            return station, month, self._fetch(station['station_id'], month.year, month.month, daily=False)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            for station_month in station_months:
+                pending.append(executor.submit(fetch, station_month))
+                if len(pending) >= self.max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def _get_weather_data(self, stations, drop_blanks=True) -> pd.DataFrame:
         """
         Helper function for retrieving all the data from the API and concatenating the resulting dataframes
+        @return: cleaned weather dataframe
+        """
+        weather_df = pd.concat([df for _, _, df in self.iter_weather_data(stations, drop_blanks)])
+        weather_df.sort_index(inplace=True)
+        return weather_df
+
+    def _fetch(self, station, year, month=1, daily=True) -> pd.DataFrame:
+        """
+        Calls the API within the per-host connection limit, retrying failed downloads with
+        exponential backoff and jitter
         @return: weather dataframe
         """
-        df_list = []
-        for station in stations:
-            for yr in range(station['start_yr'], station['end_yr'] + 1):
-                df = self._call_api(station['station_id'], yr)
-                df_list.append(df)
-        return pd.concat(df_list)
+        semaphore = _host_semaphore(self.weather_api_url, self.max_per_host)
+        for attempt in range(self.retries + 1):
+            try:
+                with semaphore:
+                    return self._call_api(station, year, month, daily)
+            except OSError as e:  # includes URLError and HTTPError
+                UPSTREAM_ERRORS.inc()
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+                logger.warning(f"Download of station {station} year {year} failed ({e}), "
+                               f"retrying in {delay:.1f}s")
+                time.sleep(delay)
 
     def _call_api(self, station, year, month=1, daily=True) -> pd.DataFrame:
         """
@@ -51,13 +194,108 @@ class WeatherDataRetriever:
         @param daily: boolean for whether data should be in daily format
         @return: weather dataframe
         """
-        if daily:
-            url = self.weather_api_url.format(station=station, year=year, month=month, time_int=2)
-        else:
-            url = self.weather_api_url.format(station=station, year=year, month=month, time_int=1)
-        weather_data = pd.read_csv(url, index_col='Date/Time', parse_dates=True)
+        time_int = 2 if daily else 1
+        url = self.weather_api_url.format(station=station, year=year, month=month, time_int=time_int)
+        data = self._cache_get(station, year, month, time_int)
+        if data is None:
+            data = self._download(url)
+            if self.cache is not None:
+                self.cache.put(station, year, month, time_int, data)
+        source = BytesIO(data)
+        if not daily:
+            return self._read_hourly_csv(source)
+        return self._read_daily_csv(source)
+
+    def _cache_get(self, station, year, month, time_int):
+        """
+        Returns the cached raw CSV data, or None if not cached
+        """
+        if self.cache is None:
+            return None
+        data = self.cache.get(station, year, month, time_int)
+        cache_lookup('raw_data', data is not None)
+        return data
+
+    async def _fetch_all_async(self, station_years, drop_blanks):
+        """
+        Downloads the daily data of the station-years concurrently with a non-blocking HTTP client, at most
+        max_workers at a time and within max_per_host connections
+        @return: list of (station, year, cleaned DataFrame), in order
+        """
+        semaphore = asyncio.Semaphore(min(self.max_workers, self.max_per_host))
+        limits = httpx.Limits(max_connections=self.max_per_host)
+        async with httpx.AsyncClient(timeout=API_TIMEOUT, limits=limits) as client:
+            frames = await asyncio.gather(*[self._fetch_async(client, semaphore, station['station_id'], yr, drop_blanks)
+                                            for station, yr in station_years])
+        return [(station, yr, df) for (station, yr), df in zip(station_years, frames)]
+
+    async def _fetch_async(self, client, semaphore, station, year, drop_blanks) -> pd.DataFrame:
+        """
+        Async counterpart of _fetch for daily data, with the same cache, retries and backoff. The CSV is parsed
+        in a worker thread, so the event loop keeps downloading meanwhile.
+        @return: cleaned weather dataframe
+        """
+        data = self._cache_get(station, year, 1, 2)
+        if data is None:
+            url = self.weather_api_url.format(station=station, year=year, month=1, time_int=2)
+            for attempt in range(self.retries + 1):
+                try:
+                    async with semaphore:
+                        response = await client.get(url)
+                    response.raise_for_status()
+                    data = response.content
+                    break
+                except (httpx.HTTPError, OSError) as e:
+                    UPSTREAM_ERRORS.inc()
+                    if attempt == self.retries:
+                        raise
+                    delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+                    logger.warning(f"Download of station {station} year {year} failed ({e}), "
+                                   f"retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+            UPSTREAM_BYTES.inc(len(data))
+            if self.cache is not None:
+                self.cache.put(station, year, 1, 2, data)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, lambda: self._clean_data(self._read_daily_csv(BytesIO(data)), drop_blanks))
+
+    def _read_daily_csv(self, source) -> pd.DataFrame:
+        """
+        Reads only the date and temperature columns of a daily CSV, as float32 temperatures indexed by date,
+        parsing chunksize rows at a time if set
+        """
+        reader = pd.read_csv(source, usecols=lambda col: col.replace('\xb0', '') in (DATE_COL,) + TEMP_COLS,
+                             dtype=DAILY_DTYPES, chunksize=self.chunksize)
+        chunks = [reader] if self.chunksize is None else reader
+        weather_data = pd.concat([chunk.set_index(pd.DatetimeIndex(pd.to_datetime(chunk.pop(DATE_COL),
+                                                                                   format=DATE_FORMAT)))
+                                  for chunk in chunks])
         return weather_data
 
+    def _read_hourly_csv(self, source) -> pd.DataFrame:
+        """
+        Reads only the time and temperature columns of an hourly CSV, as float32 temperatures (column temp)
+        indexed by local standard time, parsing chunksize rows at a time if set
+        """
+        reader = pd.read_csv(source, usecols=lambda col: col.replace('\xb0', '') in (HOURLY_DATE_COL, HOURLY_TEMP_COL),
+                             dtype=HOURLY_DTYPES, chunksize=self.chunksize)
+        chunks = [reader] if self.chunksize is None else reader
+        frames = []
+        for chunk in chunks:
+            times = pd.DatetimeIndex(pd.to_datetime(chunk.pop(HOURLY_DATE_COL), format=HOURLY_DATE_FORMAT), name='time')
+            frames.append(pd.DataFrame({'temp': chunk.iloc[:, 0].to_numpy()}, index=times))  # the temperature column
+        return pd.concat(frames)
+
+    @staticmethod
+    def _download(url) -> bytes:
+        """
+        Downloads the raw CSV data from the API
+        """
+        with urlopen(url, timeout=API_TIMEOUT) as response:
+            data = response.read()
+        UPSTREAM_BYTES.inc(len(data))
+        return data
+
     @staticmethod
     def _clean_data(weather_df, drop_blanks=True) -> pd.DataFrame:
         """
@@ -77,81 +315,444 @@ class WeatherDataRetriever:
     @staticmethod
     def _add_month_day(weather_df):
         """
-        Adds the month_day column to the DataFrame
+        Adds the day_of_year and month_day columns to the DataFrame
         """
-        month = weather_df.index.month.astype(str)
-        month = month.map(lambda x: str(x) if len(x) == 2 else '0' + str(x))
-        day = weather_df.index.day.astype(str)
-        day = day.map(lambda x: str(x) if len(x) == 2 else '0' + str(x))
-        weather_df['month_day'] = month + "-" + day
+        doy = day_of_year(weather_df.index)
+        weather_df['day_of_year'] = doy
+        weather_df['month_day'] = MONTH_DAY_KEYS[doy]
         return weather_df
 
 
-class WeatherStatsCreator:
+class DailyStats:
     """
-    Used for creating the stats for the WxStats model.
+    Array-backed temperature stats with one element per day of year (0-365), so a day's stats are looked up by
+    direct indexing. Days without data have a zero stats_count.
+    The stats are kept as mergeable sufficient statistics (count, sums, sums of squares, extremes, histogram
+    sketches): partial stats of separate stations or periods can be merged, and observations can be added or
+    retracted in O(days changed). Averages, standard deviations and percentiles are derived from them.
     """
-    def __init__(self, weather_df):
-        self.weather_df = weather_df  # DataFrame of entire history of daily min and max temperatures
-        # weather_df must have columns: date, min_temp, max_temp
+    COLUMNS = ['day_of_year', 'month_day', 'last_date', 'stats_count', 'record_min_temp', 'avg_min_temp',
+               'avg_max_temp', 'record_max_temp', 'sum_min_temp', 'sum_max_temp', 'sumsq_min_temp', 'sumsq_max_temp',
+               'min_temp_sketch', 'max_temp_sketch', 'p10_min_temp', 'p90_max_temp']
+    SUM_COLUMNS = ['stats_count', 'sum_min_temp', 'sum_max_temp', 'sumsq_min_temp', 'sumsq_max_temp']
+    HISTOGRAMS = ['min_temp_hist', 'max_temp_hist']
 
-    def create_weather_stats(self):
+    def __init__(self, last_date, stats_count, sum_min_temp, sum_max_temp, sumsq_min_temp, sumsq_max_temp,
+                 record_min_temp, record_max_temp, min_temp_hist, max_temp_hist):
+        self.last_date = last_date  # datetime64[D]
+        self.stats_count = stats_count
+        self.sum_min_temp = sum_min_temp
+        self.sum_max_temp = sum_max_temp
+        self.sumsq_min_temp = sumsq_min_temp
+        self.sumsq_max_temp = sumsq_max_temp
+        self.record_min_temp = record_min_temp
+        self.record_max_temp = record_max_temp
+        self.min_temp_hist = min_temp_hist  # (DAYS_IN_YEAR, SKETCH_BINS) bin counts
+        self.max_temp_hist = max_temp_hist
+
+    @classmethod
+    def empty(cls):
+        return cls(last_date=np.full(DAYS_IN_YEAR, np.datetime64('NaT'), dtype='datetime64[D]'),
+                   stats_count=np.zeros(DAYS_IN_YEAR, dtype=np.int64),
+                   sum_min_temp=np.zeros(DAYS_IN_YEAR),
+                   sum_max_temp=np.zeros(DAYS_IN_YEAR),
+                   sumsq_min_temp=np.zeros(DAYS_IN_YEAR),
+                   sumsq_max_temp=np.zeros(DAYS_IN_YEAR),
+                   record_min_temp=np.full(DAYS_IN_YEAR, np.inf),
+                   record_max_temp=np.full(DAYS_IN_YEAR, -np.inf),
+                   min_temp_hist=np.zeros((DAYS_IN_YEAR, SKETCH_BINS), dtype=np.int64),
+                   max_temp_hist=np.zeros((DAYS_IN_YEAR, SKETCH_BINS), dtype=np.int64))
+
+    @classmethod
+    def from_weather_df(cls, weather_df):
         """
-        Creates the weather stats DataFrame in two steps, first creating the template, then creating the stats.
+        Computes the stats of a DataFrame of daily temperatures indexed by date (rows with blanks are ignored)
         """
-        weather_stats = self._create_template()
-        weather_stats_df = self._compute_stats(weather_stats)
-        weather_stats_df = weather_stats_df.reset_index()
-        return weather_stats_df
+        stats = cls.empty()
+        stats.add_days(weather_df)
+        return stats
 
-    def _create_template(self):
+    @classmethod
+    def from_df(cls, stats_df):
         """
-        Helper that uses the weather_df as a starting point to put together the weather_stats_df
+        Returns the stats from a DataFrame of WxStats rows
         """
-        month_day_series = self.weather_df.drop_duplicates(subset=['month_day'], keep='last')['month_day']
-        weather_stats = pd.DataFrame()
-        weather_stats['month_day'] = month_day_series
-        weather_stats['last_date'] = month_day_series.index  # last date this day-of-year has temperature data for
-        weather_stats.set_index(['month_day'], inplace=True)
-        weather_stats.sort_index(inplace=True)
-        return weather_stats
+        stats = cls.empty()
+        doy = stats_df['day_of_year'].to_numpy()
+        stats.last_date[doy] = pd.to_datetime(stats_df['last_date']).to_numpy(dtype='datetime64[D]')
+        for col in cls.SUM_COLUMNS + ['record_min_temp', 'record_max_temp']:
+            getattr(stats, col)[doy] = stats_df[col].to_numpy()
+        for temp in ['min_temp', 'max_temp']:
+            if f'{temp}_sketch' in stats_df:  # rows without a sketch (saved before sketches) keep empty ones
+                sketches = [bytes(sketch or b'') for sketch in stats_df[f'{temp}_sketch']]
+                has_sketch = np.array([len(sketch) > 0 for sketch in sketches])
+                if has_sketch.any():
+                    getattr(stats, f'{temp}_hist')[doy[has_sketch]] = np.frombuffer(
+                        b''.join(sketch for sketch in sketches if sketch), dtype=SKETCH_DTYPE).reshape(-1, SKETCH_BINS)
+        return stats
 
-    def _compute_stats(self, weather_stats):
+    @classmethod
+    def combine(cls, stats_list):
+        """
+        Returns the merge of partial stats, e.g. computed separately for each station
         """
-        Creates the temperature stats for each day of year (366 total):
+        stats = cls.empty()
+        for partial in stats_list:
+            stats.merge(partial)
+        return stats
+
+    @property
+    def avg_min_temp(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum_min_temp / self.stats_count
+
+    @property
+    def avg_max_temp(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum_max_temp / self.stats_count
+
+    @property
+    def std_min_temp(self):
+        return self._std(self.sum_min_temp, self.sumsq_min_temp)
+
+    @property
+    def std_max_temp(self):
+        return self._std(self.sum_max_temp, self.sumsq_max_temp)
+
+    def percentile(self, temp, q):
+        """
+        Returns the q-th percentile of the min_temp or max_temp of each day, estimated from its sketch by linear
+        interpolation within the histogram bin (NaN for days without a sketch)
+        """
+        hist = getattr(self, f'{temp}_hist')
+        cumulative = hist.cumsum(axis=1)
+        target = cumulative[:, -1] * q / 100
+        bin_idx = np.minimum((cumulative < target[:, None]).sum(axis=1), SKETCH_BINS - 1)
+        rows = np.arange(DAYS_IN_YEAR)
+        below = cumulative[rows, bin_idx] - hist[rows, bin_idx]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.clip((target - below) / hist[rows, bin_idx], 0, 1)
+        value = SKETCH_LOW + (bin_idx + fraction) * SKETCH_BIN_WIDTH
+        return np.where(cumulative[:, -1] > 0, value, np.nan)
+
+    def _std(self, sums, sumsq):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (sumsq - sums ** 2 / self.stats_count) / (self.stats_count - 1)
+        return np.sqrt(np.maximum(variance, 0))
+
+    def to_df(self, days=None):
+        """
+        Returns the stats as a DataFrame with the WxStats columns
+        @param days: days of year to include (defaults to all days with data)
+        """
+        days = np.flatnonzero(self.stats_count > 0) if days is None else days
+        df = pd.DataFrame({'day_of_year': days,
+                           'month_day': MONTH_DAY_KEYS[days],
+                           'last_date': pd.to_datetime(self.last_date[days]),
+                           'avg_min_temp': self.avg_min_temp[days],
+                           'avg_max_temp': self.avg_max_temp[days],
+                           'p10_min_temp': self.percentile('min_temp', 10)[days],
+                           'p90_max_temp': self.percentile('max_temp', 90)[days]}, columns=self.COLUMNS)
+        for col in self.SUM_COLUMNS + ['record_min_temp', 'record_max_temp']:
+            df[col] = getattr(self, col)[days]
+        for temp in ['min_temp', 'max_temp']:
+            df[f'{temp}_sketch'] = [hist.astype(SKETCH_DTYPE).tobytes() for hist in getattr(self, f'{temp}_hist')[days]]
+        return df
+
+    def merge(self, other):
+        """
+        Merges other partial stats into these stats
+        @return: these stats
+        """
+        for col in self.SUM_COLUMNS + self.HISTOGRAMS:
+            setattr(self, col, getattr(self, col) + getattr(other, col))
+        self.record_min_temp = np.minimum(self.record_min_temp, other.record_min_temp)
+        self.record_max_temp = np.maximum(self.record_max_temp, other.record_max_temp)
+        self.last_date = np.fmax(self.last_date, other.last_date)
+        return self
+
+    def add_days(self, weather_df, only_new=False):
+        """
+        Folds daily temperatures into the stats (rows with blanks are ignored)
+        @param weather_df: DataFrame with columns min_temp and max_temp, indexed by date or with a date column
+        @param only_new: only add the dates more recent than the last_date of days that already have stats
+        @return: the days of year that were updated
+        """
+        weather_df, dates, doy = self._observations(weather_df)
+        if only_new:
+            new = (self.stats_count[doy] > 0) & (dates > self.last_date[doy])
+            weather_df, dates, doy = weather_df[new], dates[new], doy[new]
+        if not len(doy):
+            return np.array([], dtype=np.int64)
+        days = self._accumulate(weather_df, doy, sign=1)
+        # grouped extremes: sort by day of year, then reduce each day's run of values
+        order = np.argsort(doy, kind='stable')
+        starts = np.flatnonzero(np.r_[True, np.diff(doy[order]) != 0])
+        self.record_min_temp[days] = np.minimum(self.record_min_temp[days],
+                                                np.minimum.reduceat(weather_df['min_temp'].to_numpy()[order], starts))
+        self.record_max_temp[days] = np.maximum(self.record_max_temp[days],
+                                                np.maximum.reduceat(weather_df['max_temp'].to_numpy()[order], starts))
+        self.last_date[days] = np.fmax(self.last_date[days], np.maximum.reduceat(dates[order], starts))
+        return days
+
+    def retract_days(self, weather_df):
+        """
+        Removes previously added daily temperatures from the stats (rows with blanks are ignored)
+        Records cannot be retracted from the sufficient statistics: a day whose record was set by a retracted
+        temperature keeps that record until the day is recomputed from its history.
+        @return: (the days of year that were updated, the days whose record was set by a retracted temperature)
+        """
+        weather_df, dates, doy = self._observations(weather_df)
+        if not len(doy):
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        days = self._accumulate(weather_df, doy, sign=-1)
+        stale = (weather_df['min_temp'].to_numpy() <= self.record_min_temp[doy]) | \
+                (weather_df['max_temp'].to_numpy() >= self.record_max_temp[doy])
+        return days, np.unique(doy[stale])
+
+    def recompute_records(self, weather_df, days):
+        """
+        Recomputes the records of days of year from their full history, e.g. the stale records of retract_days
+        @param weather_df: DataFrame of all the daily temperatures, indexed by date or with a date column
+        @param days: days of year to recompute, only their dates up to the day's last_date are counted
+        """
+        weather_df, dates, doy = self._observations(weather_df)
+        counted = np.isin(doy, days) & (dates <= self.last_date[doy])
+        self.record_min_temp[days] = np.inf
+        self.record_max_temp[days] = -np.inf
+        np.minimum.at(self.record_min_temp, doy[counted], weather_df['min_temp'].to_numpy()[counted])
+        np.maximum.at(self.record_max_temp, doy[counted], weather_df['max_temp'].to_numpy()[counted])
+
+    @staticmethod
+    def _observations(weather_df):
+        """
+        Returns the complete rows of weather_df with exact float64 temperatures, their dates and days of year
+        """
+        weather_df = to_float64(weather_df.dropna(subset=['min_temp', 'max_temp']))
+        dates = weather_df['date'] if 'date' in weather_df else weather_df.index
+        dates = pd.DatetimeIndex(dates).to_numpy(dtype='datetime64[D]')
+        return weather_df, dates, day_of_year(dates)
+
+    def _accumulate(self, weather_df, doy, sign):
+        """
+        Adds (sign=1) or subtracts (sign=-1) the observations to the count, sums and sums of squares
+        @return: the days of year changed
+        """
+        min_temp, max_temp = weather_df['min_temp'].to_numpy(), weather_df['max_temp'].to_numpy()
+        self.stats_count = self.stats_count + sign * np.bincount(doy, minlength=DAYS_IN_YEAR)
+        self.sum_min_temp = self.sum_min_temp + sign * np.bincount(doy, min_temp, DAYS_IN_YEAR)
+        self.sum_max_temp = self.sum_max_temp + sign * np.bincount(doy, max_temp, DAYS_IN_YEAR)
+        self.sumsq_min_temp = self.sumsq_min_temp + sign * np.bincount(doy, min_temp ** 2, DAYS_IN_YEAR)
+        self.sumsq_max_temp = self.sumsq_max_temp + sign * np.bincount(doy, max_temp ** 2, DAYS_IN_YEAR)
+        for temp, values in [('min_temp', min_temp), ('max_temp', max_temp)]:
+            bins = np.clip(((values - SKETCH_LOW) // SKETCH_BIN_WIDTH).astype(np.int64), 0, SKETCH_BINS - 1)
+            counts = np.bincount(doy * SKETCH_BINS + bins, minlength=DAYS_IN_YEAR * SKETCH_BINS)
+            setattr(self, f'{temp}_hist', getattr(self, f'{temp}_hist') + sign * counts.reshape(DAYS_IN_YEAR, -1))
+        return np.unique(doy)
+
+
+class HourlyDownsampler:
+    """
+    Streaming downsampling of hourly temperatures to daily min, max and mean temperatures: each chunk of hourly
+    rows is folded into per-day partial aggregates as it arrives, so only the daily aggregates are kept, however
+    many hourly rows go through. Days split across chunks are merged.
+    """
+    def __init__(self, keep_extremes=False):
+        """
+        @param keep_extremes: whether to also keep the times of the daily min and max temperatures
+        """
+        self.keep_extremes = keep_extremes
+        self._days = None  # partial aggregates indexed by date
+
+    def add(self, hourly_df):
+        """
+        Folds hourly rows into the daily aggregates
+        @param hourly_df: DataFrame with a temp column, indexed by time (see WeatherDataRetriever._read_hourly_csv)
+        """
+        temps = hourly_df['temp']
+        by_day = temps.groupby(temps.index.normalize().rename('date'))
+        days = pd.DataFrame({'min_temp': by_day.min(), 'max_temp': by_day.max(), 'sum_temp': by_day.sum(),
+                             'hours': by_day.count()})
+        if self.keep_extremes:
+            observed = temps.dropna()
+            by_observed_day = observed.groupby(observed.index.normalize().rename('date'))
+            days['min_temp_time'] = by_observed_day.idxmin()
+            days['max_temp_time'] = by_observed_day.idxmax()
+        if self._days is not None:
+            days = pd.concat([self._days, days])
+            if days.index.has_duplicates:
+                days = self._merge(days)
+        self._days = days
+
+    def _merge(self, days):
+        """
+        Merges the partial aggregates of the same dates
+        """
+        by_day = days.groupby(level=0)
+        merged = pd.DataFrame({'min_temp': by_day['min_temp'].min(), 'max_temp': by_day['max_temp'].max(),
+                               'sum_temp': by_day['sum_temp'].sum(), 'hours': by_day['hours'].sum()})
+        if self.keep_extremes:
+            for temp, ascending in [('min_temp', True), ('max_temp', False)]:
+                merged[f'{temp}_time'] = days.sort_values(temp, ascending=ascending, kind='mergesort') \
+                    .groupby(level=0)[f'{temp}_time'].first()
+        return merged
+
+    def to_df(self, min_hours=MIN_HOURS):
+        """
+        Returns the daily weather: min_temp, max_temp, mean_temp and hours (number of hourly observations),
+        and min_temp_time and max_temp_time if keeping extremes, indexed by date. Today's values are so far today.
+        @param min_hours: hourly observations below which the temperatures of a day before today are left blank,
+        as its extremes were likely missed
+        """
+        if self._days is None:
+            return pd.DataFrame({'min_temp': np.empty(0, 'f4'), 'max_temp': np.empty(0, 'f4')},
+                                index=pd.DatetimeIndex([], name='date'))
+        days = self._days.sort_index()
+        days['mean_temp'] = days.pop('sum_temp') / days['hours'].where(days['hours'] > 0)
+        incomplete = (days['hours'] < min_hours) & (days.index < pd.Timestamp(date.today()))
+        days.loc[incomplete, ['min_temp', 'max_temp', 'mean_temp']] = np.nan
+        return days
+
+
+class WeatherStatsCreator:
+    """
+    Used for creating the stats for the WxStats model.
+    """
+    def __init__(self, weather_df):
+        self.weather_df = weather_df  # DataFrame of entire history of daily min and max temperatures
+        # weather_df must have columns: date, min_temp, max_temp
+
+    def create_weather_stats(self):
+        """
+        Creates the weather stats DataFrame, with the temperature stats for each day of year (366 total):
             record minimum temperature
             average minimum temperature
             record maximum temperature
             average maximum temperature
-        @param weather_stats: the weather stats template DataFrame
-        @return: weather stats DataFrame
         """
-        groupby = self.weather_df.groupby('month_day')[f'min_temp']
-        weather_stats[f'record_min_temp'] = groupby.min()
-        weather_stats[f'avg_min_temp'] = groupby.mean()
-        groupby = self.weather_df.groupby('month_day')[f'max_temp']
-        weather_stats[f'avg_max_temp'] = groupby.mean()
-        weather_stats[f'record_max_temp'] = groupby.max()
-        weather_stats[f'stats_count'] = groupby.count()
-        return weather_stats
+        return self.create_daily_stats().to_df()
+
+    def create_daily_stats(self):
+        """
+        Creates the array-backed weather stats
+        """
+        return DailyStats.from_weather_df(self.weather_df)
 
 
-def get_latest_weather(stations, num_weeks=8):
+def changed_observations(previous_df, current_df, last_date):
+    """
+    Compares two fetches of the recent days and returns the corrections for stats counting every complete
+    observation up to the last_date of its day of year: the observations that changed, became blank or
+    were backfilled since the previous fetch
+    @param previous_df: previously fetched DataFrame with columns date, min_temp and max_temp
+    @param current_df: newly fetched DataFrame with columns date, min_temp and max_temp
+    @param last_date: the stats' last_date array, indexed by day of year
+    @return: (observations to retract, observations to add) DataFrames with columns date, min_temp and max_temp
+    """
+    cols = ['date', 'min_temp', 'max_temp']
+    previous_df = previous_df[cols].assign(date=pd.to_datetime(previous_df['date']))
+    current_df = to_float64(current_df[cols].assign(date=pd.to_datetime(current_df['date'])))
+    both = current_df.merge(previous_df, on='date', suffixes=('', '_previous'))
+    dates = both['date'].to_numpy(dtype='datetime64[D]')
+    both = both[dates <= last_date[day_of_year(dates)]]  # days already counted
+    complete = both[['min_temp', 'max_temp']].notna().all(axis=1)
+    was_complete = both[['min_temp_previous', 'max_temp_previous']].notna().all(axis=1)
+    changed = (complete != was_complete) | (complete & was_complete & (
+        (both['min_temp'] != both['min_temp_previous']) | (both['max_temp'] != both['max_temp_previous'])))
+    retract = both[changed & was_complete][['date', 'min_temp_previous', 'max_temp_previous']]
+    retract.columns = cols
+    return retract, both[changed & complete][cols]
+
+
+def day_of_year(dates):
+    """
+    Returns the day of year (0-365, leap year calendar) of each date
+    """
+    dates = pd.DatetimeIndex(dates)
+    return _MONTH_OFFSETS[dates.month - 1] + dates.day - 1
+
+
+def day_of_year_from_keys(month_day):
+    """
+    Returns the day of year (0-365) of each 'MM-DD' key
+    """
+    month_day = pd.Series(month_day, dtype=str)
+    month = month_day.str.slice(0, 2).astype(int).to_numpy()
+    day = month_day.str.slice(3, 5).astype(int).to_numpy()
+    return _MONTH_OFFSETS[month - 1] + day - 1
+
+
+def get_latest_weather(stations, num_weeks=8, retriever=None):
     """
     Returns a DataFrame of min and max temperatures for the most recent num_weeks
     @param stations: weather station IDs
     @param num_weeks: number of weeks to show in the plot
+    @param retriever: WeatherDataRetriever to use (defaults to a sequential retriever for WEATHER_URL)
     @return: DataFrame of min and max temperatures for the most recent num_weeks
     """
-    ret = WeatherDataRetriever(WEATHER_URL)
+    ret = retriever or WeatherDataRetriever(WEATHER_URL)
     curr_weather = ret.create_weather_df(stations, drop_blanks=False)
-    end = date.today() - timedelta(days=1)
-    start = end - timedelta(days=(7 * num_weeks) - 1)
-    most_recent = curr_weather[str(start):str(end)]
+    return latest_weeks(curr_weather, num_weeks)
+
+
+def latest_weeks_start(num_weeks=8):
+    """
+    Returns the first day of the num_weeks ending yesterday
+    """
+    return date.today() - timedelta(days=7 * num_weeks)
+
+
+def latest_weeks(weather_df, num_weeks=8, through_today=False):
+    """
+    Returns the rows of a weather DataFrame sorted by date for the num_weeks ending yesterday, with a date column
+    @param through_today: whether to also return today's row (so far today values of hourly data)
+    """
+    end = date.today() - timedelta(days=0 if through_today else 1)
+    most_recent = to_float64(weather_df[str(latest_weeks_start(num_weeks)):str(end)])
     most_recent = most_recent.reset_index()
     return most_recent
 
 
+def to_float64(weather_df):
+    """
+    Returns a copy of the weather DataFrame with the float32 temperatures converted to exact float64 values
+    """
+    return weather_df.astype({'min_temp': 'float64', 'max_temp': 'float64'}).round({'min_temp': TEMP_DECIMALS,
+                                                                                    'max_temp': TEMP_DECIMALS})
+
+
+def downsample_freq(start, end, max_bars):
+    """
+    Returns the pandas frequency of the bins a date range is plotted with: days, weeks (from Monday), months,
+    quarters or a number of years, whichever is the finest giving at most max_bars bins
+    """
+    days = (end - start).days + 1
+    months = (end.year - start.year) * 12 + end.month - start.month + 1
+    for freq, bins in [('D', days), ('W-MON', days // 7 + 2), ('MS', months), ('QS', months // 3 + 2)]:
+        if bins <= max_bars:
+            return freq
+    return f'{-(-(end.year - start.year + 1) // max_bars)}AS'
+
+
+def downsample(plot_df, freq):
+    """
+    Aggregates the rows of a daily plot DataFrame into bins starting on their date, with a width column giving
+    the days covered by each bin. Records are the extremes of the bin, the other temperatures their means, so
+    the actual temperatures compare with the averages and percentiles as they do day by day.
+    @param plot_df: DataFrame with a date column and temperature columns, sorted by date
+    @param freq: pandas frequency of the bins (see downsample_freq)
+    """
+    plot_df = plot_df.assign(date=pd.to_datetime(plot_df['date']))
+    if freq == 'D':
+        return plot_df.assign(width=1)
+    aggregates = {col: {'record_min_temp': 'min', 'record_max_temp': 'max'}.get(col, 'mean')
+                  for col in plot_df.columns if col != 'date'}
+    bins = plot_df.resample(freq, on='date', closed='left', label='left').agg(aggregates)
+    bins = bins.dropna(how='all').reset_index()
+    bins['width'] = ((bins['date'] + pd.tseries.frequencies.to_offset(freq)) - bins['date']).dt.days
+    return bins
+
+
 def get_wx_stats_from_csv():
     """
     Test helper: retrieves saved weather stats from file
@@ -159,6 +760,11 @@ def get_wx_stats_from_csv():
     path = Path.joinpath(CSV_FILE_LOC, "weather_stats.csv")
     weather_stats = pd.read_csv(path)
     weather_stats['last_date'] = pd.to_datetime(weather_stats.last_date)
+    weather_stats['day_of_year'] = day_of_year_from_keys(weather_stats['month_day'])
+    if 'sum_min_temp' not in weather_stats:  # file saved before the stats had sums
+        for temp in ['min_temp', 'max_temp']:
+            weather_stats[f'sum_{temp}'] = weather_stats[f'avg_{temp}'] * weather_stats['stats_count']
+            weather_stats[f'sumsq_{temp}'] = weather_stats[f'avg_{temp}'] ** 2 * weather_stats['stats_count']
     return weather_stats
 
 
@@ -169,4 +775,5 @@ def get_latest_wx_from_csv():
     path = Path.joinpath(CSV_FILE_LOC, "latest_weather.csv")
     latest = pd.read_csv(path)
     latest['date'] = pd.to_datetime(latest.date)
+    latest['day_of_year'] = day_of_year(latest['date'])
     return latest
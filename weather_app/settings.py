@@ -41,18 +41,20 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'weather',
+    'weather.apps.WeatherConfig',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'weather.middleware.static_files_middleware',  # whitenoise, async-capable
+    'weather.middleware.prerender_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'weather.middleware.server_timing_middleware',
 ]
 
 ROOT_URLCONF = 'weather_app.urls'
@@ -135,3 +137,87 @@ STATIC_URL = '/static/'
 # Simplified static file serving.
 # https://warehouse.python.org/project/whitenoise/
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+
+# Weather data API downloads
+# Bulk data endpoint of the climate data API. Point it at `manage.py fake_climate_api` for load tests, with
+# a separate WEATHER_CACHE_DIR and WEATHER_HISTORY_DIR since the fake data would be cached as real data.
+WEATHER_API_URL = os.environ.get('WEATHER_API_URL', 'https://climate.weather.gc.ca/climate_data/bulk_data_e.html')
+# Number of station-years downloaded concurrently, and the cap on connections to the API host
+WEATHER_API_WORKERS = int(os.environ.get('WEATHER_API_WORKERS', 8))
+WEATHER_API_MAX_PER_HOST = int(os.environ.get('WEATHER_API_MAX_PER_HOST', 8))
+# Download the station-years on an event loop with a non-blocking HTTP client (httpx) rather than on threads
+WEATHER_API_ASYNC = os.environ.get('WEATHER_API_ASYNC', 'True') == 'True'
+# Failed downloads are retried with exponential backoff starting at WEATHER_API_BACKOFF seconds
+WEATHER_API_RETRIES = int(os.environ.get('WEATHER_API_RETRIES', 3))
+WEATHER_API_BACKOFF = float(os.environ.get('WEATHER_API_BACKOFF', 1.0))
+# Number of CSV rows parsed at a time, to cap the memory used by the parsing of large downloads (0 parses each
+# download at once)
+WEATHER_API_CHUNKSIZE = int(os.environ.get('WEATHER_API_CHUNKSIZE', 0))
+
+# On-disk cache of raw API downloads (set WEATHER_CACHE_DIR to an empty string to disable).
+# Years (months of hourly data) downloaded more than WEATHER_CACHE_GRACE seconds after they ended no longer change
+# and are kept until evicted; other downloads are renewed after WEATHER_CACHE_MAX_AGE seconds. The least recently
+# used files are evicted beyond WEATHER_CACHE_MAX_BYTES.
+WEATHER_CACHE_DIR = os.environ.get('WEATHER_CACHE_DIR', BASE_DIR / 'weather_cache')
+WEATHER_CACHE_MAX_BYTES = int(os.environ.get('WEATHER_CACHE_MAX_BYTES', 200 * 2 ** 20))
+WEATHER_CACHE_MAX_AGE = int(os.environ.get('WEATHER_CACHE_MAX_AGE', 3600))
+WEATHER_CACHE_GRACE = int(os.environ.get('WEATHER_CACHE_GRACE', 3 * 86400))
+
+# Local columnar store of the cleaned daily history, partitioned by station and year (set WEATHER_HISTORY_DIR to
+# an empty string to disable). It is filled as the data is fetched; set_stats(from_api=False) rebuilds the stats
+# from it without downloading, and records invalidated by corrections are recomputed from it.
+WEATHER_HISTORY_DIR = os.environ.get('WEATHER_HISTORY_DIR', BASE_DIR / 'weather_history')
+
+# Seconds the rendered homepage plot is cached for. Cache entries are keyed by the date and version of the
+# weather tables, so they are invalidated as soon as the tables change. With several processes (web and
+# scheduler dynos) configure a shared CACHES backend so all of them see the same entries.
+WEATHER_PLOT_CACHE_TIMEOUT = int(os.environ.get('WEATHER_PLOT_CACHE_TIMEOUT', 24 * 3600))
+
+# Seconds after which a daily refresh of the weather tables is considered abandoned (another process may
+# then take it over) if its process stopped renewing its lease, which it does every third of this while the
+# refresh runs; also the wait before retrying a failed refresh.
+WEATHER_REFRESH_TIMEOUT = int(os.environ.get('WEATHER_REFRESH_TIMEOUT', 600))
+
+# Scheduled refresh pipeline (`python manage.py scheduler`): runs at minute 0 of the WEATHER_REFRESH_HOURS (a cron
+# hour field, UTC), and skips the runs after the tables were refreshed for the day. Each station is fetched by its
+# own job on a pool of WEATHER_JOB_WORKERS threads, retried WEATHER_JOB_RETRIES times with exponential backoff
+# starting at WEATHER_JOB_BACKOFF seconds. Job runs are kept for WEATHER_JOB_HISTORY_DAYS.
+WEATHER_REFRESH_HOURS = os.environ.get('WEATHER_REFRESH_HOURS', '10-23')
+WEATHER_JOB_WORKERS = int(os.environ.get('WEATHER_JOB_WORKERS', 4))
+WEATHER_JOB_RETRIES = int(os.environ.get('WEATHER_JOB_RETRIES', 2))
+WEATHER_JOB_BACKOFF = float(os.environ.get('WEATHER_JOB_BACKOFF', 30.0))
+WEATHER_JOB_HISTORY_DAYS = int(os.environ.get('WEATHER_JOB_HISTORY_DAYS', 30))
+
+# Hourly ingest mode: the so far today values of the current weather are fetched from the hourly data of the API
+# (one station-month per download), downsampled to daily min and max temperatures and refreshed by the scheduler
+# every hour at minute 30. The past days of the current weather and the stats stay on the daily data.
+WEATHER_HOURLY_INGEST = os.environ.get('WEATHER_HOURLY_INGEST', '') == 'True'
+
+# Slug of the Location served at the site root
+WEATHER_DEFAULT_LOCATION = os.environ.get('WEATHER_DEFAULT_LOCATION', 'yyc')
+
+# Static pre-render mode: the homepage of every location and its plot data are rendered to files in
+# WEATHER_PRERENDER_DIR by `python manage.py prerender` and after each scheduled refresh, and served by WhiteNoise
+# (set it to an empty string to always serve the dynamic views). Each process checks the render against the
+# weather tables every WEATHER_PRERENDER_CHECK seconds, serving the dynamic views while it renders a new one.
+# Processes with separate filesystems (dynos) each render their own.
+WEATHER_PRERENDER_DIR = os.environ.get('WEATHER_PRERENDER_DIR', BASE_DIR / 'prerendered')
+WEATHER_PRERENDER_CHECK = int(os.environ.get('WEATHER_PRERENDER_CHECK', 60))
+
+# Maximum number of bars of a plotted date range (?start=YYYY-MM-DD&end=YYYY-MM-DD): longer ranges are downsampled
+# to weeks, months, quarters or years, so the plot data and its rendering stay bounded whatever the range
+WEATHER_PLOT_MAX_BARS = int(os.environ.get('WEATHER_PLOT_MAX_BARS', 400))
+
+# Seconds browsers and proxies may reuse the plot data JSON before revalidating it with its ETag
+WEATHER_PLOT_DATA_MAX_AGE = int(os.environ.get('WEATHER_PLOT_DATA_MAX_AGE', 600))
+
+# Stage timings (Server-Timing header) and Prometheus metrics served at /metrics. The metrics endpoint is only
+# available when enabled; restrict access to it at the proxy if the site is public.
+WEATHER_METRICS_ENABLED = os.environ.get('WEATHER_METRICS_ENABLED', '') == 'True'
+
+# Smoothing variants of the daily averages, as name:window:order (Savitzky-Golay filter window length and polynomial
+# order), computed whenever the stats change. A variant is selected per request with ?smoothing=<name>.
+WEATHER_SMOOTHING = {name: (int(window), int(order)) for name, window, order in (
+    variant.split(':') for variant in os.environ.get('WEATHER_SMOOTHING', 'savgol31:31:2,savgol15:15:2,savgol61:61:3')
+    .split(','))}
+WEATHER_DEFAULT_SMOOTHING = os.environ.get('WEATHER_DEFAULT_SMOOTHING', 'savgol31')